@@ -1,10 +1,32 @@
 # noinspection PyUnresolvedReferences
 import numpy as np
-from typing import Optional, List, Tuple, Set, Union
+from typing import Any, Dict, Iterator, Optional, List, Tuple, Set, Union
+from bit_packing import BitPacker
+from phase_keying import DifferentialPhaseKeying
 from symbol import OFDMSymbol
 from symbol_map import SymbolMap
-from utils import *
-from scipy.signal import chirp
+from demodulator import AUTO_DETECTOR, BatchDemodulator, SharedSpectrum
+from instrumentation import Instrumentation
+from modem_profile import ModemProfile
+from synthesizer import SymbolSynthesizer
+from timing_recovery import TimingRecovery
+from waveform_codebook import WaveformCodebook
+from time import perf_counter
+
+# One byte per constant weight symbol
+CONSTANT_WEIGHT_MODE = 'constant_weight'
+# floor(log2(codebook size)) bits per constant weight symbol, using more of the codebook than the 256 byte values
+PACKED_CONSTANT_WEIGHT_MODE = 'packed_constant_weight'
+# (phase bits, amplitude bits) keyed into every subcarrier but the first, see DifferentialPhaseKeying
+PHASE_KEYING_MODES = {
+    'dbpsk': (1, 0),
+    'dqpsk': (2, 0),
+    'd8psk': (3, 0),
+    'dqpsk_ask': (2, 1),
+}
+MODULATION_MODES = (CONSTANT_WEIGHT_MODE, PACKED_CONSTANT_WEIGHT_MODE) + tuple(PHASE_KEYING_MODES)
+# Part of every sub-band left empty above its subcarriers, between it and the next sub-band
+SUB_BAND_GUARD_FRACTION = 0.125
 
 
 class OFDM(object):
@@ -15,36 +37,200 @@ class OFDM(object):
                  sample_rate_hz: float,
                  frequency_range_start_hz: float,
                  frequency_range_end_hz: float,
-                 snr_threshold: float = 1):
+                 snr_threshold: float = 1,
+                 codebook_memory_limit_bytes: int = WaveformCodebook.DEFAULT_MEMORY_LIMIT_BYTES,
+                 instrumentation: Optional[Instrumentation] = None,
+                 modulation_mode: str = CONSTANT_WEIGHT_MODE,
+                 cyclic_prefix_length: Optional[int] = None,
+                 modem_profile: Optional[ModemProfile] = None,
+                 sub_band_count: int = 1,
+                 sub_band_index: int = 0,
+                 shared_spectrum: Optional[SharedSpectrum] = None,
+                 detector: str = AUTO_DETECTOR):
+        """
+        :param modulation_mode: one of MODULATION_MODES, trades robustness for bit rate.
+                The symbol weight is only used by the constant weight modes.
+        :param cyclic_prefix_length: guard the symbols with a cyclic prefix of this many samples instead of silent
+                padding. The subcarriers are then orthogonal over the samples_per_symbol - cyclic_prefix_length samples
+                that follow the prefix, and any echo shorter than half the prefix causes no inter-symbol interference.
+        :param modem_profile: precomputed tables of this configuration (see to_profile), instead of computing them.
+        :param sub_band_count: split the frequency range into this many independent sub-bands (see get_sub_band_range),
+                and only use the sub-band sub_band_index, with its own subcarriers and chirp.
+        :param shared_spectrum: share the FFT of the symbol windows with the demodulators of the other sub-bands.
+        :param detector: how the spectrum of the symbol windows is computed, one of demodulator.DETECTORS.
+        """
+        if modulation_mode not in MODULATION_MODES:
+            raise ValueError(f'Unknown modulation mode {modulation_mode!r}, expected one of {MODULATION_MODES}')
+        band_start_hz, band_end_hz = self.get_sub_band_range(frequency_range_start_hz,
+                                                             frequency_range_end_hz,
+                                                             sub_band_count,
+                                                             sub_band_index)
+
+        self._instrumentation = instrumentation
+        self._modulation_mode = modulation_mode
         self._symbol_weight = symbol_weight
         self._symbol_size = symbol_size
         self._samples_per_symbol = samples_per_symbol
         self._sample_rate_hz = sample_rate_hz
         self._frequency_range_start_hz = frequency_range_start_hz
         self._frequency_range_end_hz = frequency_range_end_hz
+        self._cyclic_prefix_length = cyclic_prefix_length
+        self._sub_band_count = sub_band_count
+        self._sub_band_index = sub_band_index
+        self._band_start_hz = band_start_hz
+        self._band_end_hz = band_end_hz
         self._duration_sec = samples_per_symbol / sample_rate_hz
-        self._frequencies = self._get_frequencies(
-            frequency_range_start_hz,
-            frequency_range_end_hz,
-            symbol_size,
-            sample_rate_hz,
-            samples_per_symbol)
         self._snr_threshold = snr_threshold
-        self._symbol_map = SymbolMap(symbol_size, symbol_weight)
-        self._sync_preamble = self._generate_chip_signal()
+        if modem_profile is None:
+            self._frequencies = self._get_frequencies(
+                band_start_hz,
+                band_end_hz,
+                symbol_size,
+                sample_rate_hz,
+                samples_per_symbol - (cyclic_prefix_length or 0))
+            self._symbol_map = SymbolMap(symbol_size, symbol_weight)
+            self._sync_preamble = self._generate_chip_signal()
+        else:
+            modem_profile.check_configuration(self.configuration)
+            self._frequencies = modem_profile.frequencies_hz.tolist()
+            self._symbol_map = SymbolMap(symbol_size, symbol_weight, symbol_indices=modem_profile.symbol_indices)
+            self._sync_preamble = modem_profile.sync_preamble
+        self._synthesizer = SymbolSynthesizer(self._frequencies,
+                                              samples_per_symbol,
+                                              sample_rate_hz,
+                                              cyclic_prefix_length)
+        self._demodulator = BatchDemodulator(self._frequencies,
+                                             symbol_weight,
+                                             samples_per_symbol,
+                                             sample_rate_hz,
+                                             snr_threshold,
+                                             self._synthesizer.cyclic_prefix_length,
+                                             detector)
+        # The energy of the other sub-bands fills the guards of a sub-band, only the preamble timing can be trusted
+        self._timing_recovery = TimingRecovery(samples_per_symbol,
+                                               self._synthesizer.padding_length,
+                                               loop_gain=TimingRecovery.DEFAULT_LOOP_GAIN if sub_band_count == 1 else 0)
+        self._codebook = WaveformCodebook(self._synthesizer,
+                                          self._symbol_map.symbol_indices,
+                                          codebook_memory_limit_bytes,
+                                          None if modem_profile is None else modem_profile.waveform_table)
+
+        # The bit packer is only used by the modes that do not map one byte to one symbol
+        self._bit_packer: Optional[BitPacker] = None
+        self._phase_keying: Optional[DifferentialPhaseKeying] = None
+        self._shared_spectrum = shared_spectrum
+        self._shared_spectrum_columns: Optional[np.ndarray] = None
+        if shared_spectrum is not None:
+            self._shared_spectrum_columns = shared_spectrum.register(self._demodulator)
+        if modulation_mode == PACKED_CONSTANT_WEIGHT_MODE:
+            self._bit_packer = BitPacker(self._symbol_map.symbol_count.bit_length() - 1)
+        elif modulation_mode in PHASE_KEYING_MODES:
+            phase_bits, amplitude_bits = PHASE_KEYING_MODES[modulation_mode]
+            self._phase_keying = DifferentialPhaseKeying(self._synthesizer,
+                                                         self._demodulator,
+                                                         phase_bits,
+                                                         amplitude_bits)
+            self._bit_packer = BitPacker(self._phase_keying.bits_per_digit, self._phase_keying.digits_per_symbol)
 
     @property
     def samples_per_symbol(self):
         return self._samples_per_symbol
 
-    def _generate_chip_signal(self):
+    @property
+    def cyclic_prefix_length(self) -> int:
+        return self._synthesizer.cyclic_prefix_length
+
+    @property
+    def sub_band_count(self) -> int:
+        return self._sub_band_count
+
+    @property
+    def sub_band_index(self) -> int:
+        return self._sub_band_index
+
+    @property
+    def modulation_mode(self) -> str:
+        return self._modulation_mode
+
+    @property
+    def bits_per_symbol(self) -> int:
+        return 8 if self._bit_packer is None else self._bit_packer.bits_per_symbol
+
+    @property
+    def bit_rate_bps(self) -> float:
+        """
+        The raw bit rate of the data symbols, before error correction and preambles.
+        """
+        return self.bits_per_symbol * self._sample_rate_hz / self._samples_per_symbol
+
+    @property
+    def window_position_tolerance(self) -> int:
+        """
+        How many samples a symbol window can be moved by without changing its decision much. The phase keying modes
+        turn any offset into a phase slope across the subcarriers, the constant weight modes only need the window to
+        hold the data of the symbol.
+        """
+        if self._phase_keying is not None:
+            return 1
+        if self._synthesizer.padding_length > 0:
+            return max(1, self._synthesizer.padding_length // 2)
+
+        return max(1, self._synthesizer.cyclic_prefix_length // 4)
+
+    def symbol_count(self, data_length: int) -> int:
+        """
+        :return: the number of symbols that data_length bytes are transmitted in.
+        """
+        if self._bit_packer is None:
+            return data_length
+
+        return self._bit_packer.symbol_count(data_length)
+
+    def data_lengths(self, symbol_count: int) -> range:
+        """
+        :return: the data lengths that are transmitted in symbol_count symbols. When a symbol holds more than a byte,
+                the last symbol may hold a few bytes worth of padding bits, and several lengths are possible.
+        """
+        if self._bit_packer is None:
+            return range(symbol_count, symbol_count + 1)
+
+        return self._bit_packer.data_lengths(symbol_count)
+
+    @property
+    def configuration(self) -> Dict[str, Any]:
+        """
+        The arguments that determine the frequency grid, the sync chirp and the symbol waveforms.
+        """
+        return {
+            'symbol_weight': self._symbol_weight,
+            'symbol_size': self._symbol_size,
+            'samples_per_symbol': self._samples_per_symbol,
+            'sample_rate_hz': float(self._sample_rate_hz),
+            'frequency_range_start_hz': float(self._frequency_range_start_hz),
+            'frequency_range_end_hz': float(self._frequency_range_end_hz),
+            'cyclic_prefix_length': self._cyclic_prefix_length,
+            'sub_band_count': self._sub_band_count,
+            'sub_band_index': self._sub_band_index,
+        }
+
+    def to_profile(self, include_waveforms: bool = True) -> ModemProfile:
+        """
+        :param include_waveforms: also store the waveform of every symbol, samples_per_symbol floats per symbol.
+        """
+        return ModemProfile(self.configuration,
+                            np.asarray(self._frequencies, dtype=np.float64),
+                            self._sync_preamble,
+                            self._symbol_map.symbol_indices,
+                            self._codebook.table() if include_waveforms else None)
+
+    def _generate_chip_signal(self) -> np.ndarray:
         time_sequence = np.linspace(0, self._duration_sec, self._samples_per_symbol)
+        start_frequency_hz = float(self._band_start_hz)
+        # Linear chirp, in the same order of operations as scipy.signal.chirp so that the samples are bit-identical
+        frequency_slope = (float(self._band_end_hz) - start_frequency_hz) / float(time_sequence[-1])
 
-        return list(chirp(time_sequence,
-                          f0=self._frequency_range_start_hz,
-                          f1=self._frequency_range_end_hz,
-                          t1=time_sequence[-1],
-                          method="linear"))
+        return np.cos(2 * np.pi * (start_frequency_hz * time_sequence +
+                                   0.5 * frequency_slope * time_sequence * time_sequence))
 
     @property
     def sample_rate_hz(self):
@@ -55,13 +241,40 @@ class OFDM(object):
         return self._frequencies
 
     @property
-    def sync_preamble(self):
+    def sync_preamble(self) -> np.ndarray:
         return self._sync_preamble
 
+    @property
+    def timing_recovery(self) -> TimingRecovery:
+        return self._timing_recovery
+
+    @property
+    def codebook(self) -> WaveformCodebook:
+        return self._codebook
+
     @property
     def termination_symbol(self):
         return self._symbol_map.termination_symbol
 
+    @staticmethod
+    def get_sub_band_range(start_range_hz: float,
+                           end_range_hz: float,
+                           sub_band_count: int,
+                           sub_band_index: int) -> Tuple[float, float]:
+        """
+        :return: the frequency range of a sub-band, the range is split into sub_band_count sub-bands of equal width
+                and the top SUB_BAND_GUARD_FRACTION of every sub-band is left empty.
+        """
+        if sub_band_count < 1 or not 0 <= sub_band_index < sub_band_count:
+            raise ValueError(f'Sub-band {sub_band_index} is out of the {sub_band_count} sub-bands')
+        if sub_band_count == 1:
+            return start_range_hz, end_range_hz
+
+        sub_band_width_hz = (end_range_hz - start_range_hz) / sub_band_count
+        sub_band_start_hz = start_range_hz + sub_band_index * sub_band_width_hz
+
+        return sub_band_start_hz, sub_band_start_hz + (1 - SUB_BAND_GUARD_FRACTION) * sub_band_width_hz
+
     @staticmethod
     def _get_step(start_range_hz: float, end_range_hz: float, symbol_size: int, sample_rate_hz: float,
                   num_samples: int) -> float:
@@ -82,95 +295,209 @@ class OFDM(object):
             raise ValueError("The size of the array (symbol_size) must be greater than 1.")
 
         step = OFDM._get_step(start_range_hz, end_range_hz, symbol_size, sample_rate_hz, num_samples)
+        if step <= 0:
+            raise ValueError(f'{symbol_size} subcarriers spaced by {sample_rate_hz / num_samples} Hz do not fit '
+                             f'between {start_range_hz} Hz and {end_range_hz} Hz')
 
         # Use a list comprehension to generate the array
         frequencies = [start_range_hz + index * step for index in range(symbol_size)]
 
         return frequencies
 
-    def _top_frequencies(self, signal: List[float]) -> List[Tuple[float, float]]:
-        frequencies = signal_fft(signal, self._sample_rate_hz)
-        frequencies = [(freq, amp) for freq, amp in frequencies if freq in self._frequencies]
-
-        MAGNITUDE_INDEX = 1
-        sorted_frequencies = sorted(frequencies, key=lambda item: item[MAGNITUDE_INDEX], reverse=True)
-
-        return sorted_frequencies[:self._symbol_weight + 1]
-
     def _signal_to_symbol(self, signal: List[float]) -> Optional[OFDMSymbol]:
         if len(signal) != self._samples_per_symbol:
             raise RuntimeError('Unexpected signal length.'
                                f'Expected {self._samples_per_symbol} but got {len(signal)}')
-        top_frequencies = self._top_frequencies(signal)
-
-        MAGNITUDE_INDEX = 1
-        if (top_frequencies[self._symbol_weight - 1][MAGNITUDE_INDEX] /
-                top_frequencies[self._symbol_weight][MAGNITUDE_INDEX] < self._snr_threshold):
-            return None
-
-        present_frequencies = {
-            self._frequencies.index(frequency) for
-            frequency, magnitude in
-            top_frequencies[:self._symbol_weight]}
-
-        return OFDMSymbol(present_frequencies)
-
-    def signal_to_symbols(self, signal: List[float]) -> List[OFDMSymbol]:
-        if len(signal) % self._samples_per_symbol != 0:
-            signal = signal + [0] * (self._samples_per_symbol - len(signal) % self._samples_per_symbol)
-
-        message = []
-        for signal_data_index in range(0, len(signal), self._samples_per_symbol):
-            signal_chunk = signal[signal_data_index:signal_data_index + self._samples_per_symbol]
-            message.append(self._signal_to_symbol(signal_chunk))
-
-        return message
-
-    # TODO: This is a work-in-progress mess that needs to be redone
-    def _remove_preamble_from_signal(self, signal: List[float]) -> List[float]:
-        new_signal = []
-        removed = 0
-        for signal_data_index in range(0, len(signal), self._samples_per_symbol):
-            signal_chunk = signal[signal_data_index:signal_data_index + self._samples_per_symbol]
-            correlation = normalized_correlation(signal_chunk, self.sync_preamble)
-            if len(correlation) == 0:
-                new_signal += signal_chunk
-                continue
-            assert len(correlation) == 1
-            correlation = correlation[0]
-            if correlation < 0.3 or removed > 3:
-                new_signal += signal_chunk
-            removed += 1
-
-        return new_signal
-
-    def signal_to_data(self, signal: List[float]) -> Tuple[bytes, Set[int]]:
-        signal = self._remove_preamble_from_signal(signal)
-        symbols = self.signal_to_symbols(signal)
-        try:
-            symbols.remove(self._symbol_map.termination_symbol)
-        except ValueError:
-            pass
-
-        return self._symbol_map.symbols_to_bytes(symbols)
-
-    def _symbol_to_signal(self, symbol: OFDMSymbol) -> List[float]:
-        PADDING_LENGTH = self._samples_per_symbol // 16
-        padding_data = [0] * PADDING_LENGTH
-        data_length = self._samples_per_symbol - 2 * PADDING_LENGTH
-        return (padding_data +
-                inverse_fft(symbol.frequencies(self._frequencies), data_length, self._sample_rate_hz) +
-                padding_data)
-
-    def symbols_to_signal(self, symbols: Union[OFDMSymbol, List[OFDMSymbol]]) -> List[float]:
+
+        return self.signal_to_symbols(signal)[0]
+
+    def _check_constant_weight(self):
+        if self._phase_keying is not None:
+            raise RuntimeError(f'Subcarrier combinations are only defined for the constant weight modes, '
+                               f'not for {self._modulation_mode}')
+
+    def spectrum(self, signal: Union[np.ndarray, List[float]], window_starts: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        :param window_starts: the absolute sample position of every symbol window of the signal, so that the windows
+                already transformed for another sub-band are taken from the shared spectrum.
+        :return: the (n_symbols, symbol_size) complex spectrum of every symbol window at the subcarrier bins.
+        """
+        start_time = perf_counter() if self._instrumentation is not None else 0
+        symbol_matrix = self._demodulator.to_symbol_matrix(signal)
+        if self._shared_spectrum is None or window_starts is None:
+            spectrum = self._demodulator.spectrum(symbol_matrix)
+        else:
+            spectrum = self._shared_spectrum.spectrum(window_starts, symbol_matrix)[:, self._shared_spectrum_columns]
+
+        if self._instrumentation is not None:
+            self._instrumentation.observe_stage('fft', perf_counter() - start_time)
+            self._instrumentation.count('symbols_demodulated', len(spectrum))
+        return spectrum
+
+    def _demodulate(self, spectrum: np.ndarray, soft: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if self._phase_keying is not None:
+            measure, decide = self._phase_keying.equalize, self._phase_keying.decide
+        else:
+            measure = np.abs
+            decide = self._demodulator.soft_decide if soft else self._demodulator.decide
+        if self._instrumentation is None:
+            return decide(measure(spectrum))
+
+        start_time = perf_counter()
+        decision = decide(measure(spectrum))
+        self._instrumentation.observe_stage('symbol_decision', perf_counter() - start_time)
+
+        return decision
+
+    def _indices_to_values(self, present_indices: np.ndarray) -> np.ndarray:
+        if self._instrumentation is None:
+            return self._symbol_map.indices_to_values(present_indices)
+
+        start_time = perf_counter()
+        values = self._symbol_map.indices_to_values(present_indices)
+        self._instrumentation.observe_stage('symbol_mapping', perf_counter() - start_time)
+
+        return values
+
+    def _demodulate_digits(self, spectrum: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the digits of the bit packer, and their confidences.
+        """
+        if self._phase_keying is not None:
+            return self._demodulate(spectrum, soft=True)
+
+        present_indices, confidences = self._demodulate(spectrum, soft=True)
+        digits = self._indices_to_values(present_indices)
+        # The codebook values past the packed digits are never transmitted
+        is_unknown = (digits < 0) | (digits >= 1 << self._bit_packer.bits_per_digit)
+        digits[is_unknown] = 0
+        confidences[is_unknown] = -np.inf
+
+        return digits, confidences
+
+    def signal_to_symbols(self, signal: Union[np.ndarray, List[float]]) -> List[Optional[OFDMSymbol]]:
+        self._check_constant_weight()
+        present_indices, is_valid = self._demodulate(self.spectrum(signal))
+
+        return [OFDMSymbol(indices.tolist()) if valid else None
+                for indices, valid in zip(present_indices, is_valid)]
+
+    def _spectrum_to_values(self, spectrum: np.ndarray) -> np.ndarray:
+        self._check_constant_weight()
+        present_indices, is_valid = self._demodulate(spectrum)
+        values = self._indices_to_values(present_indices)
+        values[~is_valid] = SymbolMap.UNKNOWN_VALUE
+
+        return values
+
+    def signal_to_values(self, signal: Union[np.ndarray, List[float]]) -> np.ndarray:
+        return self._spectrum_to_values(self.spectrum(signal))
+
+    def _spectrum_to_soft_values(self, spectrum: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        self._check_constant_weight()
+        present_indices, confidences = self._demodulate(spectrum, soft=True)
+        values = self._indices_to_values(present_indices)
+        confidences[values == SymbolMap.UNKNOWN_VALUE] = -np.inf
+
+        return values, confidences
+
+    def signal_to_soft_values(self, signal: Union[np.ndarray, List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the best guess value of every symbol, even under the snr threshold, and its confidence.
+                Unknown subcarrier combinations get an infinitely low confidence.
+        """
+        return self._spectrum_to_soft_values(self.spectrum(signal))
+
+    def spectrum_to_decisions(self, spectrum: np.ndarray, soft: bool = True) -> Tuple[np.ndarray, ...]:
+        """
+        The part of the demodulation that is done symbol by symbol: decide and map every symbol.
+        :return: arrays along the symbols, the decisions of consecutive spectra can be concatenated
+                and turned into data by decisions_to_data.
+        """
+        if self._bit_packer is not None:
+            return self._demodulate_digits(spectrum)
+        if soft:
+            return self._spectrum_to_soft_values(spectrum)
+
+        return (self._spectrum_to_values(spectrum),)
+
+    def _remove_termination(self, values: np.ndarray, *symbol_arrays: np.ndarray) -> Tuple[np.ndarray, ...]:
+        termination_locations = np.flatnonzero(values == self._symbol_map.termination_value)
+        if len(termination_locations) == 0:
+            return (values,) + symbol_arrays
+
+        return tuple(np.delete(array, termination_locations[0]) for array in (values,) + symbol_arrays)
+
+    def decisions_to_data(self,
+                          decisions: Tuple[np.ndarray, ...],
+                          soft: bool = True) -> Union[Tuple[bytes, Set[int]], Tuple[bytes, Set[int], np.ndarray]]:
+        """
+        :param decisions: the concatenated spectrum_to_decisions of a message, with the same soft argument.
+        :return: the data and its erasures, and the confidence of every byte when soft.
+        """
+        if self._bit_packer is not None:
+            data, confidences = self._bit_packer.digits_to_bytes(*decisions)
+        elif soft:
+            values, confidences = self._remove_termination(*decisions)
+            data, unknown_locations = self._symbol_map.values_to_bytes(values)
+            confidences[list(unknown_locations)] = -np.inf
+        else:
+            values, = self._remove_termination(*decisions)
+            return self._symbol_map.values_to_bytes(values)
+        is_erasure = np.isneginf(confidences) | (confidences < self._demodulator.confidence_threshold)
+        erasures = set(np.flatnonzero(is_erasure).tolist())
+
+        if not soft:
+            return data, erasures
+        return data, erasures, confidences
+
+    def signal_to_data(self, signal: Union[np.ndarray, List[float]]) -> Tuple[bytes, Set[int]]:
+        return self.spectrum_to_data(self.spectrum(signal))
+
+    def spectrum_to_data(self, spectrum: np.ndarray) -> Tuple[bytes, Set[int]]:
+        return self.decisions_to_data(self.spectrum_to_decisions(spectrum, soft=False), soft=False)
+
+    def signal_to_soft_data(self, signal: Union[np.ndarray, List[float]]) -> Tuple[bytes, Set[int], np.ndarray]:
+        return self.spectrum_to_soft_data(self.spectrum(signal))
+
+    def spectrum_to_soft_data(self, spectrum: np.ndarray) -> Tuple[bytes, Set[int], np.ndarray]:
+        """
+        :return: the best guess data, the erasures of the hard decision and the confidence of every byte.
+                With a bit packer, this is the longest of the data_lengths.
+        """
+        return self.decisions_to_data(self.spectrum_to_decisions(spectrum))
+
+    def _symbol_to_signal(self, symbol: OFDMSymbol) -> np.ndarray:
+        return self._synthesizer.symbols_to_signal([symbol])
+
+    def symbols_to_signal(self, symbols: Union[OFDMSymbol, List[OFDMSymbol]]) -> np.ndarray:
         if not isinstance(symbols, list):
             symbols = [symbols]
-        signal = []
 
-        for symbol in symbols:
-            signal += self._symbol_to_signal(symbol)
+        return self._synthesizer.symbols_to_signal(symbols)
+
+    def _data_to_values(self, data: bytes) -> np.ndarray:
+        """
+        :return: the values of the symbols, along the first axis.
+        """
+        if self._bit_packer is None:
+            return self._symbol_map.bytes_to_values(data)
+
+        return self._bit_packer.bytes_to_digits(data)
+
+    def _values_to_signal(self, values: np.ndarray) -> np.ndarray:
+        if self._phase_keying is not None:
+            return self._phase_keying.digits_to_signal(values)
+
+        return self._codebook.values_to_signal(values.reshape(-1))
 
-        return signal
+    def data_to_signal(self, data: bytes) -> np.ndarray:
+        return self._values_to_signal(self._data_to_values(data))
 
-    def data_to_signal(self, data: bytes) -> List[float]:
-        return self.symbols_to_signal(self._symbol_map.bytes_to_symbols(data))
+    def data_to_signal_chunks(self, data: bytes, symbols_per_chunk: int) -> Iterator[np.ndarray]:
+        """
+        Synthesize the data signal a few symbols at a time, the concatenated chunks are equal to data_to_signal(data).
+        """
+        values = self._data_to_values(data)
+        for chunk_start in range(0, len(values), symbols_per_chunk):
+            yield self._values_to_signal(values[chunk_start:chunk_start + symbols_per_chunk])
@@ -0,0 +1,216 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncIterable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from receiver import Receiver
+from utils import PCM16Data, pcm_to_signal
+
+MessageEntry = Tuple[bytes, Set[int], bytes, bool]
+
+_END_OF_STREAM = None
+
+
+class AsyncReceiver(object):
+    """
+    Runs a Receiver behind a bounded asyncio queue. Blocks are demodulated and decoded on an executor,
+    so neither the audio thread nor the event loop waits on sync detection or Reed-Solomon,
+    and decoded messages are consumed with `async for`.
+    """
+    DEFAULT_MAX_QUEUED_BLOCKS = 32
+
+    def __init__(self,
+                 receiver: Receiver,
+                 max_queued_blocks: int = DEFAULT_MAX_QUEUED_BLOCKS,
+                 executor: Optional[Executor] = None):
+        self._receiver = receiver
+        self._max_queued_blocks = max_queued_blocks
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._input_queue: Optional[asyncio.Queue] = None
+        self._output_queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._is_closing = False
+
+        self._received_blocks = 0
+        self._processed_blocks = 0
+        self._dropped_blocks = 0
+        self._max_queue_depth = 0
+
+    @property
+    def receiver(self) -> Receiver:
+        return self._receiver
+
+    @property
+    def received_blocks(self) -> int:
+        return self._received_blocks
+
+    @property
+    def processed_blocks(self) -> int:
+        return self._processed_blocks
+
+    @property
+    def dropped_blocks(self) -> int:
+        return self._dropped_blocks
+
+    @property
+    def max_queue_depth(self) -> int:
+        return self._max_queue_depth
+
+    @property
+    def queue_depth(self) -> int:
+        return 0 if self._input_queue is None else self._input_queue.qsize()
+
+    async def start(self):
+        if self._worker is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._input_queue = asyncio.Queue(maxsize=self._max_queued_blocks)
+        self._output_queue = asyncio.Queue()
+        if self._executor is None:
+            # A single thread keeps the blocks in order and the Receiver state single-threaded
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncReceiver')
+        self._worker = asyncio.create_task(self._run())
+
+    def _receive_block(self, signal: np.ndarray) -> List[MessageEntry]:
+        message_count = self._receiver.message_count
+        self._receiver.receive_buffer(signal)
+        return self._receiver.messages_since(message_count)
+
+    async def _run(self):
+        end_marker = _END_OF_STREAM
+        try:
+            while True:
+                signal = await self._input_queue.get()
+                if signal is _END_OF_STREAM:
+                    break
+
+                new_messages = await self._loop.run_in_executor(self._executor, self._receive_block, signal)
+                self._processed_blocks += 1
+                for message in new_messages:
+                    self._output_queue.put_nowait(message)
+        except Exception as error:
+            # The consumers get the error instead of waiting for messages that will never come
+            end_marker = error
+            raise
+        finally:
+            self._output_queue.put_nowait(end_marker)
+
+    def _check_started(self):
+        if self._worker is None:
+            raise RuntimeError('The AsyncReceiver was not started')
+        if self._is_closing:
+            raise RuntimeError('The AsyncReceiver is closed')
+
+    def _check_worker(self):
+        """
+        Raise the error that stopped the worker, if it stopped.
+        """
+        if not self._worker.done():
+            return
+
+        error = self._worker.exception()
+        if error is not None:
+            raise error
+        raise RuntimeError('The AsyncReceiver worker stopped')
+
+    async def _put_input(self, item):
+        """
+        Wait for room in the queue, unless the worker that drains it stops.
+        """
+        self._check_worker()
+        put_task = asyncio.ensure_future(self._input_queue.put(item))
+        await asyncio.wait((put_task, self._worker), return_when=asyncio.FIRST_COMPLETED)
+        if not put_task.done():
+            put_task.cancel()
+            self._check_worker()
+
+    def _track_queue_depth(self):
+        self._received_blocks += 1
+        self._max_queue_depth = max(self._max_queue_depth, self._input_queue.qsize())
+
+    async def put(self, signal: Union[np.ndarray, List[float]]):
+        """
+        Queue a block, waiting while the queue is full (backpressure for async sources).
+        """
+        self._check_started()
+        await self._put_input(np.array(signal, dtype=np.float32))
+        self._track_queue_depth()
+
+    def put_nowait(self, signal: Union[np.ndarray, List[float]]) -> bool:
+        """
+        Queue a block from the event loop thread, dropping it when the queue is full.
+        :return: whether the block was queued.
+        """
+        self._check_started()
+        return self._enqueue_nowait(np.array(signal, dtype=np.float32))
+
+    def _enqueue_nowait(self, signal: np.ndarray) -> bool:
+        try:
+            self._input_queue.put_nowait(signal)
+        except asyncio.QueueFull:
+            self._dropped_blocks += 1
+            return False
+
+        self._track_queue_depth()
+        return True
+
+    def put_threadsafe(self, signal: Union[np.ndarray, List[float]]):
+        """
+        Queue a block from another thread (e.g. an audio callback). The block is copied right away,
+        and dropped when the queue is full.
+        """
+        self._check_started()
+        self._loop.call_soon_threadsafe(self._enqueue_nowait, np.array(signal, dtype=np.float32))
+
+    def put_pcm16_threadsafe(self, pcm_data: PCM16Data):
+        self._check_started()
+        # The conversion already makes the copy
+        self._loop.call_soon_threadsafe(self._enqueue_nowait, pcm_to_signal(pcm_data, dtype=np.float32))
+
+    async def feed(self, source: AsyncIterable[Union[np.ndarray, List[float]]]):
+        async for signal in source:
+            await self.put(signal)
+
+    async def close(self):
+        """
+        Stop accepting blocks, and wait for the queued ones to be processed.
+        """
+        if self._worker is None or self._is_closing:
+            return
+
+        self._is_closing = True
+        try:
+            if not self._worker.done():
+                await self._put_input(_END_OF_STREAM)
+            await self._worker
+        finally:
+            if self._owns_executor:
+                self._executor.shutdown(wait=False)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> MessageEntry:
+        if self._output_queue is None:
+            raise RuntimeError('The AsyncReceiver was not started')
+
+        message = await self._output_queue.get()
+        if message is _END_OF_STREAM or isinstance(message, Exception):
+            # Keep the end marker (or the error) for any other consumer
+            self._output_queue.put_nowait(message)
+            if isinstance(message, Exception):
+                raise message
+            raise StopAsyncIteration
+
+        return message
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,379 @@
+import argparse
+import json
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, TextIO, Tuple
+
+import numpy as np
+
+from OFDM import CONSTANT_WEIGHT_MODE, MODULATION_MODES
+from demodulator import AUTO_DETECTOR, DETECTORS
+from framing import PayloadAssembler, parse_frame
+from modem_profile import ModemProfile
+from receiver import Receiver
+from streaming_correlator import StreamingCorrelator
+from utils import pcm_to_signal
+
+DEFAULT_CHUNK_LENGTH = 1 << 20
+DECODE_BATCH_SIZE = 64
+
+
+def _find_wav_data(path: str) -> Tuple[int, int, int, float]:
+    """
+    Locate the PCM samples of a WAV file without reading them.
+    :return: the data offset in bytes, the number of frames, the number of channels and the sample rate.
+    """
+    with open(path, 'rb') as wav_file:
+        riff_header = wav_file.read(12)
+        if len(riff_header) < 12 or riff_header[:4] != b'RIFF' or riff_header[8:12] != b'WAVE':
+            raise ValueError(f'{path} is not a WAV file')
+
+        channel_count = None
+        sample_rate_hz = None
+        while True:
+            chunk_header = wav_file.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f'{path} has no data chunk')
+
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                audio_format, channel_count, sample_rate_hz, _, _, bits_per_sample = struct.unpack(
+                    '<HHIIHH', wav_file.read(16))
+                if audio_format != 1 or bits_per_sample != 16:
+                    raise ValueError(f'{path} is not 16-bit PCM')
+                wav_file.seek(chunk_size - 16 + chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                if channel_count is None:
+                    raise ValueError(f'{path} has a data chunk before its fmt chunk')
+                return wav_file.tell(), chunk_size // (2 * channel_count), channel_count, float(sample_rate_hz)
+            else:
+                wav_file.seek(chunk_size + chunk_size % 2, 1)
+
+
+def map_pcm16_file(path: str, channel: int = 0) -> Tuple[np.ndarray, Optional[float]]:
+    """
+    Memory-map the 16-bit PCM samples of a WAV file (or of a headerless raw PCM16 file).
+    :return: the samples of the requested channel and the sample rate (None for raw files).
+    """
+    with open(path, 'rb') as audio_file:
+        is_wav = audio_file.read(4) == b'RIFF'
+
+    if not is_wav:
+        return np.memmap(path, dtype=np.int16, mode='r'), None
+
+    data_offset, frame_count, channel_count, sample_rate_hz = _find_wav_data(path)
+    if frame_count == 0:
+        return np.zeros(0, dtype=np.int16), sample_rate_hz
+
+    frames = np.memmap(path, dtype=np.int16, mode='r', offset=data_offset, shape=(frame_count, channel_count))
+    return frames[:, channel], sample_rate_hz
+
+
+def find_preambles(pcm_samples: np.ndarray,
+                   preamble: np.ndarray,
+                   correlation_threshold: float,
+                   chunk_length: int = DEFAULT_CHUNK_LENGTH) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find every preamble in a PCM16 recording in one pass over the samples.
+    :return: the sample positions of the preambles and their correlation scores.
+    """
+    correlator = StreamingCorrelator(preamble)
+    candidate_positions = []
+    candidate_scores = []
+    chunk = np.empty(min(chunk_length, len(pcm_samples)), dtype=np.float64)
+    for chunk_index in range(0, len(pcm_samples), chunk_length):
+        pcm_chunk = pcm_samples[chunk_index:chunk_index + chunk_length]
+        correlation_position, correlation = correlator.process(pcm_to_signal(pcm_chunk, out=chunk[:len(pcm_chunk)]))
+        above_threshold = np.flatnonzero(correlation > correlation_threshold)
+        candidate_positions.append(above_threshold + correlation_position)
+        candidate_scores.append(correlation[above_threshold])
+
+    if len(candidate_positions) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+    positions = np.concatenate(candidate_positions).astype(np.int64)
+    scores = np.concatenate(candidate_scores)
+    if len(positions) == 0:
+        return positions, scores
+
+    # Candidates closer than a preamble length belong to the same peak, keep the strongest of each
+    peak_ids = np.concatenate(([0], np.cumsum(np.diff(positions) >= len(preamble))))
+    order = np.lexsort((-scores, peak_ids))
+    is_strongest = np.concatenate(([True], np.diff(peak_ids[order]) != 0))
+
+    return positions[order][is_strongest], scores[order][is_strongest]
+
+
+def pair_preambles(positions: np.ndarray,
+                   scores: np.ndarray,
+                   max_span: Optional[int] = None,
+                   chain_messages: bool = False) -> List[Tuple[int, int, float]]:
+    """
+    Pair the preambles into messages: they alternate between starting and terminating a message.
+    :param max_span: the longest distance between the preambles of a message. A preamble further away from the start
+            of the message starts a new message instead (the terminating preamble was missed or the start was a false
+            detection), so that a single bad preamble does not shift the pairing of the rest of the recording.
+    :param chain_messages: every preamble terminates a message and starts the next one, like the frames of a payload
+            (see Transmitter.transmit_payload).
+    :return: the start position, end position and start score of every message.
+    """
+    message_bounds = []
+    start_position, start_score = None, None
+    for position, score in zip(positions.tolist(), scores.tolist()):
+        if start_position is None or (max_span is not None and position - start_position > max_span):
+            start_position, start_score = position, score
+            continue
+
+        message_bounds.append((start_position, position, start_score))
+        start_position, start_score = (position, score) if chain_messages else (None, None)
+
+    return message_bounds
+
+
+def _message_signal(receiver: Receiver, pcm_samples: np.ndarray, start_position: int, end_position: int) -> np.ndarray:
+    """
+    :return: the data of the message between two preambles, aligned on its symbols.
+    """
+    preamble_length = len(receiver.sync_preamble)
+    samples_per_symbol = receiver.samples_per_symbol
+    timing_recovery = receiver.timing_recovery
+    data_start = timing_recovery.refine_position(pcm_samples, receiver.sync_preamble,
+                                                 int(start_position)) + preamble_length
+    data_end = timing_recovery.refine_position(pcm_samples, receiver.sync_preamble, int(end_position))
+    # Convert the message and a symbol of margin on each side for the drift tracking
+    region_start = max(0, int(data_start) - samples_per_symbol)
+    region_samples = pcm_samples[region_start:int(np.ceil(data_end)) + samples_per_symbol]
+    return timing_recovery.align(pcm_to_signal(region_samples), data_start - region_start, data_end - region_start)
+
+
+def _decode_messages(receiver: Receiver,
+                     pcm_samples: np.ndarray,
+                     bounds_batch: List[Tuple[int, int, float]]) -> List[Tuple[bytes, Set[int], bytes, bool]]:
+    return receiver.decode_message_signals([_message_signal(receiver, pcm_samples, start_position, end_position)
+                                            for start_position, end_position, _ in bounds_batch])
+
+
+def _message_record(message_index: int,
+                    preamble_length: int,
+                    bounds: Tuple[int, int, float],
+                    message: Tuple[bytes, Set[int], bytes, bool]) -> Dict[str, Any]:
+    start_position, end_position, sync_score = bounds
+    raw_message, errata, decoded_message, is_message_valid = message
+    return {
+        'message_index': message_index,
+        'start_sample': int(start_position),
+        'end_sample': int(end_position) + preamble_length,
+        'sync_score': float(sync_score),
+        'raw_message': bytes(raw_message).hex(),
+        'errata': sorted(int(location) for location in errata),
+        'decoded_message': bytes(decoded_message).hex(),
+        'is_valid': bool(is_message_valid),
+    }
+
+
+def decode_pcm16_samples(receiver: Receiver,
+                         pcm_samples: np.ndarray,
+                         chunk_length: int = DEFAULT_CHUNK_LENGTH,
+                         reassemble_frames: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Decode every message of a recording. Preambles alternate between starting and terminating a message,
+    and the receiver's max_message_symbols (when set) bounds how far apart they can be, see pair_preambles.
+    :param reassemble_frames: the recording holds framed payloads, whose frames share their preambles. Every frame is
+            yielded as a message, followed by a {'payload_id', 'payload'} record for every reassembled payload,
+            and a final {'missing_frames'} record for the incomplete payloads.
+    """
+    preamble_length = len(receiver.sync_preamble)
+    samples_per_symbol = receiver.samples_per_symbol
+    positions, scores = find_preambles(pcm_samples, receiver.sync_preamble, receiver.correlation_threshold,
+                                       chunk_length)
+
+    max_symbols = receiver.max_message_symbols
+    if reassemble_frames:
+        max_symbols = min(receiver.max_frame_symbols, max_symbols or receiver.max_frame_symbols)
+    max_span = None
+    if max_symbols is not None:
+        # A symbol of margin for the clock drift, like the streaming receiver
+        max_span = preamble_length + (max_symbols + 1) * samples_per_symbol
+    message_bounds = pair_preambles(positions, scores, max_span, chain_messages=reassemble_frames)
+    if reassemble_frames:
+        yield from _decode_framed_messages(receiver, pcm_samples, message_bounds)
+        return
+
+    for batch_index in range(0, len(message_bounds), DECODE_BATCH_SIZE):
+        bounds_batch = message_bounds[batch_index:batch_index + DECODE_BATCH_SIZE]
+        decoded_messages = _decode_messages(receiver, pcm_samples, bounds_batch)
+        for message_index, (bounds, message) in enumerate(zip(bounds_batch, decoded_messages), batch_index):
+            yield _message_record(message_index, preamble_length, bounds, message)
+
+
+def _decode_framed_messages(receiver: Receiver,
+                            pcm_samples: np.ndarray,
+                            message_bounds: List[Tuple[int, int, float]]) -> Iterator[Dict[str, Any]]:
+    """
+    Decode the chained messages of a recording of framed payloads. The pairs of preambles that follow the last frame
+    of a payload are the gaps between payloads, they are skipped without being decoded.
+    """
+    preamble_length = len(receiver.sync_preamble)
+    payload_assembler = PayloadAssembler()
+    # The number of frames known to follow the last decoded message, None when unknown
+    frames_left: Optional[int] = None
+    previous_end = None
+    message_index = 0
+    bounds_index = 0
+    while bounds_index < len(message_bounds):
+        if message_bounds[bounds_index][0] != previous_end:
+            # Too far from the previous preamble to continue its payload
+            frames_left = None
+        elif frames_left == 0:
+            # The gap between two payloads
+            frames_left = None
+            previous_end = message_bounds[bounds_index][1]
+            bounds_index += 1
+            continue
+
+        # Only the frames known to follow are decoded together, each decoded frame tells what comes next
+        batch_size = 1 if frames_left is None else min(frames_left, DECODE_BATCH_SIZE)
+        bounds_batch = [message_bounds[bounds_index]]
+        for bounds in message_bounds[bounds_index + 1:bounds_index + batch_size]:
+            if bounds[0] != bounds_batch[-1][1]:
+                break
+            bounds_batch.append(bounds)
+        bounds_index += len(bounds_batch)
+        previous_end = bounds_batch[-1][1]
+
+        for bounds, message in zip(bounds_batch, _decode_messages(receiver, pcm_samples, bounds_batch)):
+            yield _message_record(message_index, preamble_length, bounds, message)
+            message_index += 1
+
+            _, _, decoded_message, is_message_valid = message
+            if not is_message_valid:
+                # Like Receiver: an invalid frame may be followed by more frames
+                frames_left = None if frames_left is None else max(frames_left - 1, 0)
+                continue
+            try:
+                completed_payload = payload_assembler.add_frame(decoded_message)
+            except ValueError:
+                # A message that is not a frame
+                frames_left = 0
+                continue
+            _, sequence, frame_count, _ = parse_frame(decoded_message)
+            frames_left = frame_count - sequence - 1
+            if completed_payload is not None:
+                payload_id, payload = completed_payload
+                yield {'payload_id': payload_id, 'payload': payload.hex()}
+
+    if len(payload_assembler.missing_frames()) > 0:
+        yield {'missing_frames': payload_assembler.missing_frames()}
+
+
+def decode_file(path: str,
+                receiver_args: Sequence[Any],
+                receiver_kwargs: Optional[Dict[str, Any]] = None,
+                chunk_length: int = DEFAULT_CHUNK_LENGTH,
+                reassemble_frames: bool = False) -> List[Dict[str, Any]]:
+    receiver = Receiver(*receiver_args, **(receiver_kwargs or {}))
+    try:
+        pcm_samples, sample_rate_hz = map_pcm16_file(path)
+    except (OSError, ValueError) as error:
+        return [{'file': path, 'error': str(error)}]
+    # Raw files have no header, their rate is assumed to match
+    if sample_rate_hz is not None and sample_rate_hz != receiver.sample_rate_hz:
+        return [{'file': path, 'error': f'{path} is sampled at {sample_rate_hz:g} Hz, '
+                                        f'the receiver expects {receiver.sample_rate_hz:g} Hz'}]
+
+    return [dict(file=path, **result)
+            for result in decode_pcm16_samples(receiver, pcm_samples, chunk_length, reassemble_frames)]
+
+
+def decode_files(paths: Sequence[str],
+                 receiver_args: Sequence[Any],
+                 receiver_kwargs: Optional[Dict[str, Any]] = None,
+                 output: TextIO = sys.stdout,
+                 worker_count: Optional[int] = None,
+                 chunk_length: int = DEFAULT_CHUNK_LENGTH,
+                 reassemble_frames: bool = False) -> int:
+    """
+    Decode the files on a pool of worker processes and write one JSON line per message, in file order.
+    :param reassemble_frames: the files hold framed payloads, see decode_pcm16_samples.
+    :return: the number of messages written.
+    """
+    message_count = 0
+    with ProcessPoolExecutor(max_workers=worker_count) as executor:
+        file_results = executor.map(decode_file,
+                                    paths,
+                                    [tuple(receiver_args)] * len(paths),
+                                    [receiver_kwargs] * len(paths),
+                                    [chunk_length] * len(paths),
+                                    [reassemble_frames] * len(paths))
+        for results in file_results:
+            for result in results:
+                output.write(json.dumps(result) + '\n')
+                message_count += 'message_index' in result
+            output.flush()
+
+    return message_count
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description='Decode every message in WAV / raw PCM16 recordings into JSONL.')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--output', '-o', default=None, help='JSONL output path, stdout by default')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--symbol-weight', type=int, default=3)
+    parser.add_argument('--symbol-size', type=int, default=16)
+    parser.add_argument('--samples-per-symbol', type=int, default=4096)
+    parser.add_argument('--sample-rate-hz', type=float, default=16_000)
+    parser.add_argument('--frequency-range-start-hz', type=float, default=2_000)
+    parser.add_argument('--frequency-range-end-hz', type=float, default=4_000)
+    parser.add_argument('--ecc-symbols', type=int, default=5)
+    parser.add_argument('--ecc-block', type=int, default=15)
+    parser.add_argument('--snr-threshold', type=float, default=1.5)
+    parser.add_argument('--correlation-threshold', type=float, default=0.4)
+    parser.add_argument('--hard-decision', action='store_true', help='Only erase the symbols under the snr threshold')
+    parser.add_argument('--modulation-mode', choices=MODULATION_MODES, default=CONSTANT_WEIGHT_MODE)
+    parser.add_argument('--cyclic-prefix-length', type=int, default=None,
+                        help='Cyclic prefix length in samples, silent symbol guards by default')
+    parser.add_argument('--sub-band-count', type=int, default=1)
+    parser.add_argument('--sub-band-index', type=int, default=0, help='The sub-band to decode')
+    parser.add_argument('--detector', choices=DETECTORS, default=AUTO_DETECTOR,
+                        help='How the spectrum of the symbol windows is computed')
+    parser.add_argument('--max-message-symbols', type=int, default=None,
+                        help='The longest message, a preamble further away from a start preamble starts a new message')
+    parser.add_argument('--reassemble-frames', action='store_true',
+                        help='The recordings hold framed payloads (Transmitter.transmit_payload)')
+    parser.add_argument('--profile', default=None, help='A modem profile .npz of the same configuration')
+    arguments = parser.parse_args(argv)
+
+    receiver_args = (arguments.symbol_weight,
+                     arguments.symbol_size,
+                     arguments.samples_per_symbol,
+                     arguments.sample_rate_hz,
+                     arguments.frequency_range_start_hz,
+                     arguments.frequency_range_end_hz,
+                     arguments.ecc_symbols,
+                     arguments.ecc_block)
+    receiver_kwargs = dict(snr_threshold=arguments.snr_threshold,
+                           correlation_threshold=arguments.correlation_threshold,
+                           soft_decision=not arguments.hard_decision,
+                           modulation_mode=arguments.modulation_mode,
+                           cyclic_prefix_length=arguments.cyclic_prefix_length,
+                           sub_band_count=arguments.sub_band_count,
+                           sub_band_index=arguments.sub_band_index,
+                           detector=arguments.detector,
+                           max_message_symbols=arguments.max_message_symbols)
+    if arguments.profile is not None:
+        receiver_kwargs['modem_profile'] = ModemProfile.load(arguments.profile, load_waveforms=False)
+
+    if arguments.output is None:
+        decode_files(arguments.paths, receiver_args, receiver_kwargs, sys.stdout, arguments.workers,
+                     reassemble_frames=arguments.reassemble_frames)
+        return
+
+    with open(arguments.output, 'w') as output:
+        decode_files(arguments.paths, receiver_args, receiver_kwargs, output, arguments.workers,
+                     reassemble_frames=arguments.reassemble_frames)
+
+
+if __name__ == '__main__':
+    main()
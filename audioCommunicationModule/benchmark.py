@@ -0,0 +1,317 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from math import comb
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from demodulator import DFT_DETECTOR, FFT_DETECTOR, BinDetector, select_detector
+from receiver import Receiver
+from transmitter import Transmitter
+from utils import normalized_correlation
+
+DEFAULT_CONFIGURATION = {
+    'symbol_weight': 3,
+    'symbol_size': 16,
+    'samples_per_symbol': 4096,
+    'sample_rate_hz': 16_000,
+    'frequency_range_start_hz': 2_000,
+    'frequency_range_end_hz': 4_000,
+    'ecc_symbols': 5,
+    'ecc_block': 15,
+    'message_length': 32,
+}
+
+SWEEPS = {
+    'samples_per_symbol': [1024, 2048, 4096, 8192],
+    'symbol_size': [16, 20, 24],
+    'symbol_weight': [3, 4, 5],
+    'message_length': [8, 32, 128, 512],
+    'ecc': [(5, 15), (10, 30), (16, 64), (32, 255)],
+}
+
+QUICK_SWEEPS = {
+    'samples_per_symbol': [2048, 4096],
+    'message_length': [8, 128],
+    'ecc': [(5, 15), (32, 255)],
+}
+
+RECEIVER_KWARGS = {'snr_threshold': 1.5, 'correlation_threshold': 0.4}
+
+# The detector backends are compared at every combination
+DETECTOR_SWEEP = {
+    'samples_per_symbol': [1024, 2048, 4096, 8192],
+    'bin_count': [4, 8, 16, 24, 32, 48, 64, 128],
+    'batch_size': [1, 4, 64],
+}
+
+QUICK_DETECTOR_SWEEP = {
+    'samples_per_symbol': [1024, 4096],
+    'bin_count': [8, 16, 32, 64],
+    'batch_size': [1, 64],
+}
+
+
+def _time_calls(function: Callable[[], Any], min_time_sec: float, max_repeats: int) -> List[float]:
+    # Warm-up call, so that lazily built tables are not part of the measurement
+    function()
+
+    call_times = []
+    total_time = 0.0
+    while len(call_times) < max_repeats and (total_time < min_time_sec or len(call_times) < 3):
+        start_time = time.perf_counter()
+        function()
+        call_time = time.perf_counter() - start_time
+        call_times.append(call_time)
+        total_time += call_time
+
+    return call_times
+
+
+def _summary(call_times: Sequence[float], samples_per_call: int, messages_per_call: float) -> Dict[str, float]:
+    median_time = float(np.median(call_times))
+    return {
+        'calls': len(call_times),
+        'median_sec': median_time,
+        'min_sec': float(np.min(call_times)),
+        'max_sec': float(np.max(call_times)),
+        'samples_per_sec': samples_per_call / median_time if median_time > 0 else float('inf'),
+        'messages_per_sec': messages_per_call / median_time if median_time > 0 else float('inf'),
+    }
+
+
+def _configurations(sweeps: Dict[str, list]) -> Iterator[Dict[str, Any]]:
+    """
+    One-factor-at-a-time sweep around the default configuration.
+    """
+    yield dict(DEFAULT_CONFIGURATION)
+    for parameter, values in sweeps.items():
+        for value in values:
+            configuration = dict(DEFAULT_CONFIGURATION)
+            if parameter == 'ecc':
+                configuration['ecc_symbols'], configuration['ecc_block'] = value
+            else:
+                configuration[parameter] = value
+
+            if configuration == DEFAULT_CONFIGURATION:
+                continue
+            # The symbol map needs room for 256 byte values, the termination symbol and its neighbour
+            if comb(configuration['symbol_size'], configuration['symbol_weight']) < 258:
+                continue
+            yield configuration
+
+
+def benchmark_configuration(configuration: Dict[str, Any],
+                            min_time_sec: float = 0.2,
+                            max_repeats: int = 50) -> List[Dict[str, Any]]:
+    modem_args = (configuration['symbol_weight'],
+                  configuration['symbol_size'],
+                  configuration['samples_per_symbol'],
+                  configuration['sample_rate_hz'],
+                  configuration['frequency_range_start_hz'],
+                  configuration['frequency_range_end_hz'],
+                  configuration['ecc_symbols'],
+                  configuration['ecc_block'])
+    samples_per_symbol = configuration['samples_per_symbol']
+    rng = np.random.default_rng(0)
+    message = bytes(rng.integers(32, 127, configuration['message_length']).tolist())
+
+    transmitter = Transmitter(*modem_args, snr_threshold=RECEIVER_KWARGS['snr_threshold'])
+    modulation = transmitter._modulation
+    encoded_message = transmitter._message_codec.encode(message)
+    message_signal = transmitter.transmit_buffer(message)
+    data_signal = modulation.data_to_signal(encoded_message)
+    padding = rng.normal(0, 0.01, samples_per_symbol + samples_per_symbol // 3)
+    received_signal = np.concatenate((padding, message_signal, padding)).astype(np.float32)
+
+    results = []
+
+    def add_result(name: str, function: Callable[[], Any], samples_per_call: int, messages_per_call: float = 1):
+        call_times = _time_calls(function, min_time_sec, max_repeats)
+        results.append(dict(benchmark=name,
+                            configuration=configuration,
+                            **_summary(call_times, samples_per_call, messages_per_call)))
+
+    add_result('Transmitter.transmit_buffer', lambda: transmitter.transmit_buffer(message), len(message_signal))
+    add_result('OFDM.data_to_signal', lambda: modulation.data_to_signal(encoded_message), len(data_signal))
+    add_result('OFDM.signal_to_symbols', lambda: modulation.signal_to_symbols(data_signal), len(data_signal))
+    add_result('normalized_correlation',
+               lambda: normalized_correlation(received_signal, modulation.sync_preamble),
+               len(received_signal))
+
+    decoding_receiver = Receiver(*modem_args, **RECEIVER_KWARGS)
+    add_result('Receiver._decode_message', lambda: decoding_receiver._decode_message(encoded_message, set()), 0)
+
+    def receive_message():
+        receiver = Receiver(*modem_args, **RECEIVER_KWARGS)
+        block_times = []
+        for block_index in range(0, len(received_signal), samples_per_symbol):
+            start_time = time.perf_counter()
+            receiver.receive_buffer(received_signal[block_index:block_index + samples_per_symbol])
+            block_times.append(time.perf_counter() - start_time)
+
+        receive_message.block_times = block_times
+        receive_message.is_decoded = [entry[2] for entry in receiver.message_history] == [message]
+
+    add_result('Receiver.receive_buffer', receive_message, len(received_signal))
+    # Latency of a single audio callback, and of the callback that completes the message
+    results[-1]['max_block_sec'] = float(np.max(receive_message.block_times))
+    results[-1]['median_block_sec'] = float(np.median(receive_message.block_times))
+    results[-1]['is_decoded'] = bool(receive_message.is_decoded)
+
+    return results
+
+
+def benchmark_detectors(sweep: Dict[str, list], min_time_sec: float = 0.2, max_repeats: int = 50) -> List[Dict[str, Any]]:
+    """
+    Time every detector backend on batches of random symbol windows, with the bins spread over the spectrum.
+    """
+    rng = np.random.default_rng(0)
+    results = []
+    for samples_per_symbol in sweep['samples_per_symbol']:
+        for batch_size in sweep['batch_size']:
+            symbol_matrix = rng.normal(0, 1, (batch_size, samples_per_symbol))
+            for bin_count in sweep['bin_count']:
+                bins = np.linspace(1, samples_per_symbol // 2 - 1, bin_count).astype(np.intp)
+                configuration = dict(samples_per_symbol=samples_per_symbol, bin_count=bin_count, batch_size=batch_size)
+                for detector in (FFT_DETECTOR, DFT_DETECTOR):
+                    bin_detector = BinDetector(bins, samples_per_symbol, detector=detector)
+                    call_times = _time_calls(lambda: bin_detector.spectrum(symbol_matrix), min_time_sec, max_repeats)
+                    results.append(dict(benchmark=f'BinDetector.spectrum[{detector}]',
+                                        configuration=configuration,
+                                        **_summary(call_times, batch_size * samples_per_symbol, 0)))
+
+    return results
+
+
+def detector_crossovers(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    :return: for every window length and batch size, the largest bin count up to which the DFT detector was faster
+            than the FFT detector, next to the largest bin count for which select_detector picks the DFT detector.
+    """
+    median_times = {(result['benchmark'], json.dumps(result['configuration'], sort_keys=True)): result['median_sec']
+                    for result in results}
+    crossovers = {}
+    for result in results:
+        configuration = result['configuration']
+        key = (configuration['samples_per_symbol'], configuration['batch_size'])
+        crossover = crossovers.setdefault(key, dict(samples_per_symbol=key[0],
+                                                    batch_size=key[1],
+                                                    measured_max_dft_bins=0,
+                                                    selected_max_dft_bins=0))
+        configuration_key = json.dumps(configuration, sort_keys=True)
+        dft_time = median_times[(f'BinDetector.spectrum[{DFT_DETECTOR}]', configuration_key)]
+        fft_time = median_times[(f'BinDetector.spectrum[{FFT_DETECTOR}]', configuration_key)]
+        bin_count = configuration['bin_count']
+        if dft_time < fft_time:
+            crossover['measured_max_dft_bins'] = max(crossover['measured_max_dft_bins'], bin_count)
+        if select_detector(bin_count, key[0], key[1]) == DFT_DETECTOR:
+            crossover['selected_max_dft_bins'] = max(crossover['selected_max_dft_bins'], bin_count)
+
+    return list(crossovers.values())
+
+
+def _metadata() -> Dict[str, str]:
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def run_benchmarks(sweeps: Dict[str, list], min_time_sec: float, max_repeats: int) -> Dict[str, Any]:
+    results = []
+    for configuration in _configurations(sweeps):
+        results += benchmark_configuration(configuration, min_time_sec, max_repeats)
+
+    return {
+        'metadata': _metadata(),
+        'results': results,
+    }
+
+
+def run_detector_benchmarks(sweep: Dict[str, list], min_time_sec: float, max_repeats: int) -> Dict[str, Any]:
+    results = benchmark_detectors(sweep, min_time_sec, max_repeats)
+
+    return {
+        'metadata': _metadata(),
+        'results': results,
+        'crossovers': detector_crossovers(results),
+    }
+
+
+def _result_key(result: Dict[str, Any]) -> str:
+    return json.dumps([result['benchmark'], result['configuration']], sort_keys=True)
+
+
+def find_regressions(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    :return: the benchmarks whose median time grew by more than the tolerance (0.2 == 20%) since the baseline.
+    """
+    baseline_results = {_result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        baseline_result = baseline_results.get(_result_key(result))
+        if baseline_result is None or baseline_result['median_sec'] <= 0:
+            continue
+
+        ratio = result['median_sec'] / baseline_result['median_sec']
+        if ratio > 1 + tolerance:
+            regressions.append(dict(benchmark=result['benchmark'],
+                                    configuration=result['configuration'],
+                                    baseline_median_sec=baseline_result['median_sec'],
+                                    median_sec=result['median_sec'],
+                                    ratio=ratio))
+
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Throughput and latency benchmarks of the modem pipeline.')
+    parser.add_argument('--output', '-o', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='Baseline results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--quick', action='store_true', help='Run a reduced parameter sweep')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimal measured time per benchmark')
+    parser.add_argument('--max-repeats', type=int, default=50)
+    parser.add_argument('--detectors', action='store_true',
+                        help='Compare the FFT and DFT detector backends instead of benchmarking the pipeline')
+    arguments = parser.parse_args(argv)
+
+    if arguments.detectors:
+        report = run_detector_benchmarks(QUICK_DETECTOR_SWEEP if arguments.quick else DETECTOR_SWEEP,
+                                         arguments.min_time,
+                                         arguments.max_repeats)
+    else:
+        report = run_benchmarks(QUICK_SWEEPS if arguments.quick else SWEEPS, arguments.min_time, arguments.max_repeats)
+    with open(arguments.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+    for result in report['results']:
+        print(f"{result['benchmark']:<30} {json.dumps(result['configuration'], sort_keys=True)}\n"
+              f"    median {result['median_sec'] * 1e3:9.3f} ms  "
+              f"{result['samples_per_sec']:14.0f} samples/s  {result['messages_per_sec']:10.2f} messages/s")
+    for crossover in report.get('crossovers', []):
+        print(f"samples_per_symbol {crossover['samples_per_symbol']:>5} batch {crossover['batch_size']:>3}: "
+              f"DFT faster up to {crossover['measured_max_dft_bins']:>3} bins, "
+              f"selected up to {crossover['selected_max_dft_bins']:>3} bins")
+
+    if arguments.compare is None:
+        return 0
+
+    with open(arguments.compare) as baseline_file:
+        regressions = find_regressions(json.load(baseline_file), report, arguments.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression['benchmark']} {json.dumps(regression['configuration'], sort_keys=True)}: "
+              f"{regression['baseline_median_sec'] * 1e3:.3f} ms -> {regression['median_sec'] * 1e3:.3f} ms "
+              f"(x{regression['ratio']:.2f})")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
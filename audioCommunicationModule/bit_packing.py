@@ -0,0 +1,70 @@
+from typing import Tuple
+
+import numpy as np
+
+
+class BitPacker(object):
+    """
+    Packs a byte stream into fixed-width digits (most significant bit first), digits_per_symbol digits per symbol.
+    The last symbol is padded with zero bits.
+    """
+
+    def __init__(self, bits_per_digit: int, digits_per_symbol: int = 1):
+        if bits_per_digit <= 0 or digits_per_symbol <= 0:
+            raise ValueError(f'Expected positive digit sizes, got {bits_per_digit} bits per digit '
+                             f'and {digits_per_symbol} digits per symbol')
+
+        self._bits_per_digit = bits_per_digit
+        self._digits_per_symbol = digits_per_symbol
+        self._bit_shifts = np.arange(bits_per_digit - 1, -1, -1, dtype=np.int64)
+
+    @property
+    def bits_per_digit(self) -> int:
+        return self._bits_per_digit
+
+    @property
+    def digits_per_symbol(self) -> int:
+        return self._digits_per_symbol
+
+    @property
+    def bits_per_symbol(self) -> int:
+        return self._bits_per_digit * self._digits_per_symbol
+
+    def symbol_count(self, byte_count: int) -> int:
+        return -(-8 * byte_count // self.bits_per_symbol)
+
+    def data_lengths(self, symbol_count: int) -> range:
+        """
+        :return: every data length that packs into exactly symbol_count symbols.
+        """
+        if symbol_count <= 0:
+            return range(0, 1)
+
+        return range((symbol_count - 1) * self.bits_per_symbol // 8 + 1, symbol_count * self.bits_per_symbol // 8 + 1)
+
+    def bytes_to_digits(self, data: bytes) -> np.ndarray:
+        """
+        :return: a (symbol_count, digits_per_symbol) matrix of digits.
+        """
+        bits = np.unpackbits(np.frombuffer(bytes(data), dtype=np.uint8))
+        symbol_count = self.symbol_count(len(data))
+        padded_bits = np.zeros(symbol_count * self.bits_per_symbol, dtype=np.int64)
+        padded_bits[:len(bits)] = bits
+        digits = np.left_shift(padded_bits.reshape(-1, self._bits_per_digit), self._bit_shifts).sum(axis=1)
+
+        return digits.reshape(symbol_count, self._digits_per_symbol)
+
+    def digits_to_bytes(self, digits: np.ndarray, confidences: np.ndarray) -> Tuple[bytes, np.ndarray]:
+        """
+        :param digits: the received digits, in any shape.
+        :param confidences: the confidence of every digit.
+        :return: the bytes held by the whole digits, and the confidence of every byte
+                (the lowest confidence of the digits it is made of).
+        """
+        digits = np.asarray(digits, dtype=np.int64).reshape(-1)
+        byte_count = len(digits) * self._bits_per_digit // 8
+        bits = np.bitwise_and(np.right_shift(digits[:, np.newaxis], self._bit_shifts), 1).reshape(-1)
+        data = np.packbits(bits[:8 * byte_count].astype(np.uint8)).tobytes()
+        bit_confidences = np.repeat(np.asarray(confidences, dtype=np.float64).reshape(-1), self._bits_per_digit)
+
+        return data, bit_confidences[:8 * byte_count].reshape(byte_count, 8).min(axis=1, initial=np.inf)
@@ -0,0 +1,160 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from receiver import Receiver
+from transmitter import Transmitter
+
+# The receiver arguments that the transmitter must share
+TRANSMITTER_KWARGS = ('snr_threshold', 'modulation_mode', 'cyclic_prefix_length', 'sub_band_count', 'sub_band_index')
+
+
+class ChannelSimulator(object):
+    """
+    Batched audio channel model, applied to a (n_trials, n_samples) matrix of transmitted signals in order:
+    frequency-selective attenuation, random timing offset, additive white gaussian noise and clipping.
+    """
+
+    def __init__(self,
+                 snr_db: float,
+                 max_timing_offset_samples: int = 0,
+                 max_attenuation_db: float = 0,
+                 attenuation_knots: int = 8,
+                 clipping_level: Optional[float] = None,
+                 tail_length_samples: int = 0,
+                 seed: Optional[int] = None):
+        if attenuation_knots < 2:
+            raise ValueError(f'At least 2 attenuation knots are needed, got {attenuation_knots}')
+
+        self._snr_db = snr_db
+        self._max_timing_offset_samples = max_timing_offset_samples
+        self._max_attenuation_db = max_attenuation_db
+        self._attenuation_knots = attenuation_knots
+        self._clipping_level = clipping_level
+        self._tail_length_samples = tail_length_samples
+        self._rng = np.random.default_rng(seed)
+
+    def _attenuate(self, signals: np.ndarray) -> np.ndarray:
+        if self._max_attenuation_db <= 0:
+            return signals
+
+        spectrum = np.fft.rfft(signals, axis=1)
+        # Random gain curve per trial, linear in dB between knots spread evenly from DC to Nyquist
+        knot_gains_db = -self._rng.uniform(0, self._max_attenuation_db, (len(signals), self._attenuation_knots))
+        knot_positions = np.linspace(0, spectrum.shape[1] - 1, self._attenuation_knots)
+        bin_positions = np.arange(spectrum.shape[1])
+        segment = np.minimum(np.searchsorted(knot_positions, bin_positions, side='right') - 1,
+                             self._attenuation_knots - 2)
+        fraction = (bin_positions - knot_positions[segment]) / (knot_positions[segment + 1] - knot_positions[segment])
+        gains_db = knot_gains_db[:, segment] * (1 - fraction) + knot_gains_db[:, segment + 1] * fraction
+        spectrum *= 10 ** (gains_db / 20)
+
+        return np.fft.irfft(spectrum, signals.shape[1], axis=1)
+
+    def _delay(self, signals: np.ndarray) -> np.ndarray:
+        trial_count, sample_count = signals.shape
+        offsets = self._rng.integers(0, self._max_timing_offset_samples + 1, trial_count)
+        output = np.zeros((trial_count, self._max_timing_offset_samples + sample_count + self._tail_length_samples))
+        columns = offsets[:, np.newaxis] + np.arange(sample_count)
+        output[np.arange(trial_count)[:, np.newaxis], columns] = signals
+
+        return output
+
+    def apply(self, signals: np.ndarray) -> np.ndarray:
+        signals = np.atleast_2d(np.asarray(signals, dtype=np.float64))
+        signal_power = np.mean(signals * signals, axis=1, keepdims=True)
+
+        output = self._delay(self._attenuate(signals))
+        noise_power = signal_power / 10 ** (self._snr_db / 10)
+        output += self._rng.standard_normal(output.shape) * np.sqrt(noise_power)
+        if self._clipping_level is not None:
+            np.clip(output, -self._clipping_level, self._clipping_level, out=output)
+
+        return output
+
+
+def _receive_trials(receiver_args: Sequence[Any],
+                    receiver_kwargs: Dict[str, Any],
+                    signals: np.ndarray,
+                    block_size: int) -> List[Optional[bytes]]:
+    decoded_messages = []
+    for signal in signals:
+        receiver = Receiver(*receiver_args, **receiver_kwargs)
+        for block_index in range(0, len(signal), block_size):
+            receiver.receive_buffer(signal[block_index:block_index + block_size])
+
+        history = receiver.message_history
+        decoded_messages.append(bytes(history[0][2]) if len(history) > 0 else None)
+
+    return decoded_messages
+
+
+def _bit_errors(sent_message: bytes, decoded_message: Optional[bytes]) -> int:
+    if decoded_message is None or len(decoded_message) != len(sent_message):
+        return 8 * len(sent_message)
+
+    difference = np.bitwise_xor(np.frombuffer(sent_message, dtype=np.uint8),
+                                np.frombuffer(decoded_message, dtype=np.uint8))
+    return int(np.unpackbits(difference).sum())
+
+
+def error_rate_curve(modem_args: Sequence[Any],
+                     snr_db_values: Sequence[float],
+                     trial_count: int,
+                     message_length: int = 16,
+                     receiver_kwargs: Optional[Dict[str, Any]] = None,
+                     channel_kwargs: Optional[Dict[str, Any]] = None,
+                     block_size: Optional[int] = None,
+                     worker_count: Optional[int] = None,
+                     seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Measure the bit and frame error rates of the receiver against the SNR of a simulated channel.
+    :param modem_args: the positional arguments shared by Transmitter and Receiver.
+    :param channel_kwargs: extra ChannelSimulator arguments (timing offsets, attenuation, clipping).
+    :param block_size: the size of the blocks fed to the receiver, samples_per_symbol by default.
+    :return: one row per SNR value.
+    """
+    receiver_kwargs = dict(receiver_kwargs or {})
+    channel_kwargs = dict(channel_kwargs or {})
+    samples_per_symbol = modem_args[2]
+    block_size = block_size or samples_per_symbol
+    channel_kwargs.setdefault('max_timing_offset_samples', samples_per_symbol)
+    channel_kwargs.setdefault('tail_length_samples', 2 * samples_per_symbol)
+
+    worker_count = worker_count or os.cpu_count() or 1
+
+    transmitter = Transmitter(*modem_args, **{name: value for name, value in receiver_kwargs.items()
+                                              if name in TRANSMITTER_KWARGS})
+    rng = np.random.default_rng(seed)
+    rows = []
+    with ProcessPoolExecutor(max_workers=worker_count) as executor:
+        for snr_db in snr_db_values:
+            messages = [bytes(rng.integers(0, 256, message_length).tolist()) for _ in range(trial_count)]
+            signals = np.stack([transmitter.transmit_buffer(message) for message in messages])
+            channel = ChannelSimulator(snr_db, seed=int(rng.integers(2 ** 32)), **channel_kwargs)
+            received_signals = channel.apply(signals).astype(np.float32)
+
+            chunk_count = min(trial_count, 4 * worker_count)
+            chunks = np.array_split(received_signals, chunk_count)
+            decoded_messages = []
+            for chunk_messages in executor.map(_receive_trials,
+                                               [tuple(modem_args)] * len(chunks),
+                                               [receiver_kwargs] * len(chunks),
+                                               chunks,
+                                               [block_size] * len(chunks)):
+                decoded_messages += chunk_messages
+
+            bit_errors = sum(_bit_errors(sent, decoded) for sent, decoded in zip(messages, decoded_messages))
+            frame_errors = sum(sent != decoded for sent, decoded in zip(messages, decoded_messages))
+            rows.append({
+                'snr_db': float(snr_db),
+                'trials': trial_count,
+                'bit_error_rate': bit_errors / (8 * message_length * trial_count),
+                'frame_error_rate': frame_errors / trial_count,
+                'missed_frames': sum(decoded is None for decoded in decoded_messages),
+                'receiver_kwargs': receiver_kwargs,
+            })
+
+    return rows
@@ -0,0 +1,305 @@
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+# How the spectrum of the symbol windows is computed at the subcarrier bins
+FFT_DETECTOR = 'fft'
+DFT_DETECTOR = 'dft'
+AUTO_DETECTOR = 'auto'
+DETECTORS = (AUTO_DETECTOR, FFT_DETECTOR, DFT_DETECTOR)
+# The DFT matrix product is faster than a full real FFT while there are at most this many bins per bit of the
+# FFT length, for a single window and for batches of windows (see benchmark.py --detectors)
+DFT_BINS_PER_LOG2_LENGTH = 0.75
+BATCH_DFT_BINS_PER_LOG2_LENGTH = 1.5
+DFT_MATRIX_MEMORY_LIMIT_BYTES = 8 * 1024 * 1024
+
+
+def select_detector(bin_count: int, fft_length: int, batch_size: int = 1) -> str:
+    """
+    :return: the fastest detector for a batch of batch_size windows.
+    """
+    bins_per_log2_length = DFT_BINS_PER_LOG2_LENGTH if batch_size <= 1 else BATCH_DFT_BINS_PER_LOG2_LENGTH
+    matrix_bytes = 2 * bin_count * fft_length * np.dtype(np.float64).itemsize
+    if bin_count <= bins_per_log2_length * np.log2(fft_length) and matrix_bytes <= DFT_MATRIX_MEMORY_LIMIT_BYTES:
+        return DFT_DETECTOR
+
+    return FFT_DETECTOR
+
+
+class BinDetector(object):
+    """
+    Computes the spectrum of a batch of symbol windows at a few bins only: either with a full real FFT of every window,
+    or with one product of the windows by the precomputed DFT rows of the bins, which costs a multiply-add per sample
+    and bin instead of the full FFT.
+    """
+
+    def __init__(self,
+                 bins: np.ndarray,
+                 samples_per_symbol: int,
+                 fft_start: int = 0,
+                 fft_length: Union[int, None] = None,
+                 detector: str = AUTO_DETECTOR):
+        """
+        :param fft_start: the start of the part of every window that is transformed.
+        :param fft_length: its length, the rest of the window by default.
+        :param detector: one of DETECTORS, AUTO_DETECTOR picks the fastest one for every batch with select_detector.
+        """
+        if detector not in DETECTORS:
+            raise ValueError(f'Unknown detector {detector!r}, expected one of {DETECTORS}')
+
+        self._bins = np.asarray(bins, dtype=np.intp)
+        self._samples_per_symbol = samples_per_symbol
+        self._fft_start = fft_start
+        self._fft_length = samples_per_symbol - fft_start if fft_length is None else fft_length
+        self._detector = detector
+        self._single_detector = detector
+        self._batch_detector = detector
+        if detector == AUTO_DETECTOR:
+            self._single_detector = select_detector(len(self._bins), self._fft_length, batch_size=1)
+            self._batch_detector = select_detector(len(self._bins), self._fft_length, batch_size=2)
+        # The real and imaginary DFT rows of the bins side by side, built on first use
+        self._dft_matrix: Union[np.ndarray, None] = None
+
+    @property
+    def detector(self) -> str:
+        return self._detector
+
+    @property
+    def bins(self) -> np.ndarray:
+        return self._bins
+
+    def _get_dft_matrix(self) -> np.ndarray:
+        if self._dft_matrix is None:
+            # Reduced modulo the length before scaling, so that the angles are exact for long windows too
+            phase_steps = np.outer(np.arange(self._fft_length), self._bins) % self._fft_length
+            angles = 2 * np.pi / self._fft_length * phase_steps
+            self._dft_matrix = np.hstack((np.cos(angles), -np.sin(angles)))
+
+        return self._dft_matrix
+
+    def spectrum(self, symbol_matrix: np.ndarray) -> np.ndarray:
+        """
+        :param symbol_matrix: a (n_symbols, samples_per_symbol) matrix of symbol windows.
+        :return: the (n_symbols, n_bins) complex spectrum of every window.
+        """
+        if self._fft_length != self._samples_per_symbol:
+            symbol_matrix = symbol_matrix[:, self._fft_start:self._fft_start + self._fft_length]
+        detector = self._single_detector if len(symbol_matrix) <= 1 else self._batch_detector
+        if detector == FFT_DETECTOR:
+            return np.fft.rfft(symbol_matrix, axis=1)[:, self._bins]
+
+        products = symbol_matrix @ self._get_dft_matrix()
+        bin_count = len(self._bins)
+
+        return products[:, :bin_count] + 1j * products[:, bin_count:]
+
+
+class BatchDemodulator(object):
+    def __init__(self,
+                 frequencies_hz: List[float],
+                 symbol_weight: int,
+                 samples_per_symbol: int,
+                 sample_rate_hz: float,
+                 snr_threshold: float = 1,
+                 cyclic_prefix_length: int = 0,
+                 detector: str = AUTO_DETECTOR):
+        """
+        :param cyclic_prefix_length: with a cyclic prefix, the FFT only runs on samples_per_symbol - cyclic_prefix_length
+                samples starting halfway through the prefix, which tolerates a timing error of half a prefix either way.
+        :param detector: how the spectrum is computed at the subcarrier bins, see BinDetector.
+        """
+        if symbol_weight >= len(frequencies_hz):
+            raise ValueError(f'The symbol weight ({symbol_weight}) must be smaller than '
+                             f'the number of subcarriers ({len(frequencies_hz)})')
+
+        self._symbol_weight = symbol_weight
+        self._samples_per_symbol = samples_per_symbol
+        self._snr_threshold = snr_threshold
+        self._fft_start = cyclic_prefix_length // 2
+        self._fft_length = samples_per_symbol - cyclic_prefix_length
+        self._subcarrier_bins = np.rint(
+            np.asarray(frequencies_hz, dtype=np.float64) * self._fft_length / sample_rate_hz).astype(np.intp)
+        self._detector = BinDetector(self._subcarrier_bins,
+                                     samples_per_symbol,
+                                     self._fft_start,
+                                     self._fft_length,
+                                     detector)
+
+    @property
+    def subcarrier_bins(self) -> np.ndarray:
+        return self._subcarrier_bins
+
+    def to_symbol_matrix(self, signal: Union[np.ndarray, List[float]]) -> np.ndarray:
+        signal = np.asarray(signal, dtype=np.float64)
+        remainder = len(signal) % self._samples_per_symbol
+        if remainder != 0:
+            signal = np.concatenate((signal, np.zeros(self._samples_per_symbol - remainder)))
+
+        return signal.reshape(-1, self._samples_per_symbol)
+
+    @property
+    def samples_per_symbol(self) -> int:
+        return self._samples_per_symbol
+
+    @property
+    def fft_window(self) -> Tuple[int, int]:
+        """
+        The start and the length of the part of a symbol window that is transformed.
+        """
+        return self._fft_start, self._fft_length
+
+    @property
+    def detector(self) -> str:
+        return self._detector.detector
+
+    def spectrum(self, symbol_matrix: np.ndarray) -> np.ndarray:
+        """
+        :return: the (n_symbols, symbol_size) complex spectrum of every symbol at the subcarrier bins.
+        """
+        return self._detector.spectrum(symbol_matrix)
+
+    def magnitudes(self, symbol_matrix: np.ndarray) -> np.ndarray:
+        return np.abs(self.spectrum(symbol_matrix))
+
+    def _rank(self, magnitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        symbol_size = magnitudes.shape[1]
+        partition = np.argpartition(magnitudes, symbol_size - self._symbol_weight - 1, axis=1)
+        present_indices = partition[:, symbol_size - self._symbol_weight:]
+        runner_up_indices = partition[:, symbol_size - self._symbol_weight - 1]
+
+        weakest_present = np.min(np.take_along_axis(magnitudes, present_indices, axis=1), axis=1)
+        strongest_absent = magnitudes[np.arange(len(magnitudes)), runner_up_indices]
+
+        return present_indices, weakest_present, strongest_absent
+
+    def decide(self, magnitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Hard decision on a (n_symbols, symbol_size) matrix of subcarrier magnitudes.
+        :return: the (n_symbols, symbol_weight) indices of the strongest subcarriers of each symbol,
+                and a mask of the symbols whose weakest present subcarrier is at least snr_threshold
+                times stronger than the strongest absent one.
+        """
+        present_indices, weakest_present, strongest_absent = self._rank(magnitudes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            is_valid = weakest_present / strongest_absent >= self._snr_threshold
+
+        return present_indices, is_valid
+
+    def soft_decide(self, magnitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Soft decision on a (n_symbols, symbol_size) matrix of subcarrier magnitudes.
+        :return: the indices of the strongest subcarriers of each symbol, and the confidence of each symbol:
+                the log ratio of its weakest present subcarrier to its strongest absent one
+                (a symbol is valid for the hard decision when it is at least log(snr_threshold)).
+        """
+        present_indices, weakest_present, strongest_absent = self._rank(magnitudes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            confidences = np.log(weakest_present) - np.log(strongest_absent)
+        # Silent symbols (0 / 0) carry no information at all
+        confidences[np.isnan(confidences)] = -np.inf
+
+        return present_indices, confidences
+
+    @property
+    def confidence_threshold(self) -> float:
+        return float(np.log(self._snr_threshold)) if self._snr_threshold > 0 else -np.inf
+
+    def demodulate(self, signal: Union[np.ndarray, List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.decide(self.magnitudes(self.to_symbol_matrix(signal)))
+
+    def demodulate_soft(self, signal: Union[np.ndarray, List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.soft_decide(self.magnitudes(self.to_symbol_matrix(signal)))
+
+
+class SharedSpectrum(object):
+    """
+    Lets the demodulators of several sub-bands of the same audio share the FFT of their symbol windows.
+    The spectrum of a window is kept at the subcarrier bins of every registered demodulator, keyed by the absolute
+    sample position of the window, and a window that starts within position_tolerance samples of a transformed one
+    reuses its spectrum (an offset of a few samples only turns into a small phase slope across the subcarriers).
+    """
+    DEFAULT_POSITION_TOLERANCE = 2
+
+    def __init__(self, position_tolerance: int = DEFAULT_POSITION_TOLERANCE, detector: str = AUTO_DETECTOR):
+        """
+        :param detector: how the spectrum is computed at the bins of all the demodulators, see BinDetector.
+        """
+        self._position_tolerance = position_tolerance
+        self._detector_name = detector
+        self._detector: Union[BinDetector, None] = None
+        self._position_offsets = [0] + [sign * offset for offset in range(1, position_tolerance + 1) for sign in (-1, 1)]
+        self._demodulator: Union[BatchDemodulator, None] = None
+        self._bins = np.zeros(0, dtype=np.intp)
+        self._spectra: Dict[int, np.ndarray] = {}
+        self._computed_windows = 0
+        self._shared_windows = 0
+
+    @property
+    def computed_windows(self) -> int:
+        return self._computed_windows
+
+    @property
+    def shared_windows(self) -> int:
+        return self._shared_windows
+
+    def __len__(self) -> int:
+        return len(self._spectra)
+
+    def register(self, demodulator: BatchDemodulator) -> np.ndarray:
+        """
+        :return: the columns of the shared spectrum that hold the subcarriers of the demodulator.
+        """
+        if self._demodulator is None:
+            self._demodulator = demodulator
+        elif (demodulator.samples_per_symbol != self._demodulator.samples_per_symbol or
+              demodulator.fft_window != self._demodulator.fft_window):
+            raise ValueError('Only demodulators of the same symbol windows can share their spectrum')
+        self._spectra.clear()
+
+        columns = np.arange(len(self._bins), len(self._bins) + len(demodulator.subcarrier_bins))
+        self._bins = np.concatenate((self._bins, demodulator.subcarrier_bins))
+        self._detector = BinDetector(self._bins, demodulator.samples_per_symbol, *demodulator.fft_window,
+                                     detector=self._detector_name)
+
+        return columns
+
+    def _find(self, window_start: int) -> Union[np.ndarray, None]:
+        for offset in self._position_offsets:
+            spectrum = self._spectra.get(window_start + offset)
+            if spectrum is not None:
+                return spectrum
+
+        return None
+
+    def spectrum(self, window_starts: np.ndarray, symbol_matrix: np.ndarray) -> np.ndarray:
+        """
+        :param window_starts: the absolute sample position of every row of the symbol matrix.
+        :return: the complex spectrum of every symbol at the bins of every registered demodulator.
+        """
+        if self._demodulator is None:
+            raise RuntimeError('No demodulator is registered')
+
+        spectrum = np.empty((len(symbol_matrix), len(self._bins)), dtype=np.complex128)
+        missing_rows = []
+        for row, window_start in enumerate(window_starts.tolist()):
+            cached_spectrum = self._find(window_start)
+            if cached_spectrum is None:
+                missing_rows.append(row)
+            else:
+                spectrum[row] = cached_spectrum
+
+        if len(missing_rows) > 0:
+            spectrum[missing_rows] = self._detector.spectrum(symbol_matrix[missing_rows])
+            for row in missing_rows:
+                self._spectra[int(window_starts[row])] = spectrum[row]
+        self._computed_windows += len(missing_rows)
+        self._shared_windows += len(symbol_matrix) - len(missing_rows)
+
+        return spectrum
+
+    def discard_before(self, position: float):
+        """
+        Forget the windows that start before position, once no demodulator can ask for them anymore.
+        """
+        self._spectra = {window_start: spectrum for window_start, spectrum in self._spectra.items()
+                         if window_start >= position}
@@ -0,0 +1,114 @@
+import struct
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from utils import CRC_SIZE, crc_checksum_bytes
+
+# payload id, frame sequence number, frame count
+FRAME_HEADER_FORMAT = '<HHH'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+MAX_FRAME_COUNT = 0xFFFF
+PAYLOAD_ID_MODULO = 0x10000
+DEFAULT_MAX_FRAME_PAYLOAD = 64
+
+
+def split_payload(payload: bytes, payload_id: int, max_frame_payload: int = DEFAULT_MAX_FRAME_PAYLOAD) -> List[bytes]:
+    """
+    Split a payload into sequence numbered frames, each one small enough to survive on its own.
+    The CRC of the whole payload follows it, so that frames of different payloads that share a payload id
+    (e.g. after a transmitter restart) are not reassembled together.
+    """
+    if max_frame_payload <= 0:
+        raise ValueError(f'The frame payload size must be positive, got {max_frame_payload}')
+
+    payload = bytes(payload) + crc_checksum_bytes(payload)
+    chunks = [payload[chunk_start:chunk_start + max_frame_payload]
+              for chunk_start in range(0, len(payload), max_frame_payload)]
+    if len(chunks) > MAX_FRAME_COUNT:
+        raise ValueError(f'The payload needs {len(chunks)} frames, at most {MAX_FRAME_COUNT} are supported')
+
+    return [struct.pack(FRAME_HEADER_FORMAT, payload_id % PAYLOAD_ID_MODULO, sequence, len(chunks)) + chunk
+            for sequence, chunk in enumerate(chunks)]
+
+
+def parse_frame(frame: bytes) -> Tuple[int, int, int, bytes]:
+    """
+    :return: the payload id, sequence number and frame count of a frame, and its part of the payload.
+    """
+    if len(frame) < FRAME_HEADER_SIZE:
+        raise ValueError(f'A frame is at least {FRAME_HEADER_SIZE} bytes long, got {len(frame)}')
+
+    payload_id, sequence, frame_count = struct.unpack_from(FRAME_HEADER_FORMAT, frame)
+    if sequence >= frame_count:
+        raise ValueError(f'Frame {sequence} is out of the {frame_count} frames of payload {payload_id}')
+
+    return payload_id, sequence, frame_count, bytes(frame[FRAME_HEADER_SIZE:])
+
+
+def is_last_frame(frame: bytes) -> bool:
+    _, sequence, frame_count, _ = parse_frame(frame)
+    return sequence == frame_count - 1
+
+
+class PayloadAssembler(object):
+    """
+    Incremental reassembly of framed payloads. Frames may arrive in any order, and the oldest incomplete
+    payloads are dropped once more than max_pending_payloads are in progress.
+    A payload whose CRC does not match was mixed with stale frames of an older payload with the same id,
+    only the last frame is kept and the payload waits for the other frames again.
+    """
+    DEFAULT_MAX_PENDING_PAYLOADS = 16
+
+    def __init__(self, max_pending_payloads: int = DEFAULT_MAX_PENDING_PAYLOADS):
+        self._max_pending_payloads = max_pending_payloads
+        # payload id -> (frame count, chunks by sequence number)
+        self._pending: 'OrderedDict[int, Tuple[int, Dict[int, bytes]]]' = OrderedDict()
+        self._dropped_payloads = 0
+        self._corrupt_payloads = 0
+
+    @property
+    def dropped_payloads(self) -> int:
+        return self._dropped_payloads
+
+    @property
+    def corrupt_payloads(self) -> int:
+        return self._corrupt_payloads
+
+    def add_frame(self, frame: bytes) -> Optional[Tuple[int, bytes]]:
+        """
+        :return: the payload id and the payload when this frame completes it, None otherwise.
+        """
+        payload_id, sequence, frame_count, chunk = parse_frame(frame)
+        pending_frame_count, chunks = self._pending.get(payload_id, (frame_count, {}))
+        if pending_frame_count != frame_count:
+            # The payload id wrapped around to a new payload
+            chunks = {}
+        chunks[sequence] = chunk
+        self._pending[payload_id] = (frame_count, chunks)
+        self._pending.move_to_end(payload_id)
+
+        if len(chunks) == frame_count:
+            payload = b''.join(chunks[sequence] for sequence in range(frame_count))
+            payload, payload_crc = payload[:-CRC_SIZE], payload[-CRC_SIZE:]
+            if len(payload_crc) == CRC_SIZE and payload_crc == crc_checksum_bytes(payload):
+                del self._pending[payload_id]
+                return payload_id, payload
+
+            self._corrupt_payloads += 1
+            if frame_count > 1:
+                self._pending[payload_id] = (frame_count, {sequence: chunk})
+            else:
+                del self._pending[payload_id]
+
+        while len(self._pending) > self._max_pending_payloads:
+            self._pending.popitem(last=False)
+            self._dropped_payloads += 1
+
+        return None
+
+    def missing_frames(self) -> Dict[int, List[int]]:
+        """
+        :return: the sequence numbers of the frames still missing, by payload id of the incomplete payloads.
+        """
+        return {payload_id: [sequence for sequence in range(frame_count) if sequence not in chunks]
+                for payload_id, (frame_count, chunks) in self._pending.items()}
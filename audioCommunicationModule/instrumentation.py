@@ -0,0 +1,126 @@
+import json
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Dict, List, Sequence
+
+# Stage durations, from 10us to 10s
+DEFAULT_TIME_BUCKETS_SEC = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                            1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Normalized correlation scores
+DEFAULT_SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+# Sizes and counts (samples, symbols, erasures)
+DEFAULT_COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram(object):
+    def __init__(self, bounds: Sequence[float]):
+        self._bounds = tuple(bounds)
+        # The last bucket counts the values above every bound
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def observe(self, value: float):
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._count += 1
+        self._sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'bounds': list(self._bounds),
+            'counts': list(self._counts),
+            'count': self._count,
+            'sum': self._sum,
+        }
+
+
+class Instrumentation(object):
+    """
+    Counters, gauges and histograms of the decoding pipeline, plus one record per decoded message.
+    Instrumented classes take an optional Instrumentation and skip all measurements when it is None,
+    so that it costs nothing unless enabled.
+    """
+    DEFAULT_MAX_MESSAGE_RECORDS = 1000
+
+    def __init__(self, max_message_records: int = DEFAULT_MAX_MESSAGE_RECORDS):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._message_records = deque(maxlen=max_message_records)
+
+    def count(self, name: str, increment: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + increment
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_COUNT_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def observe_stage(self, stage: str, duration_sec: float):
+        self.observe(f'{stage}_seconds', duration_sec, DEFAULT_TIME_BUCKETS_SEC)
+
+    def record_message(self, **fields: Any):
+        with self._lock:
+            self._message_records.append(fields)
+
+    @property
+    def message_records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._message_records)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._message_records.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': {name: histogram.snapshot() for name, histogram in self._histograms.items()},
+                'messages': list(self._message_records),
+            }
+
+    def dump(self, path: str):
+        with open(path, 'w') as output:
+            json.dump(self.snapshot(), output, indent=2, default=str)
+
+    def to_prometheus(self, prefix: str = 'ofdm') -> str:
+        """
+        :return: the counters, gauges and histograms in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines += [f'# TYPE {prefix}_{name} gauge', f'{prefix}_{name} {value}']
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append(f'# TYPE {prefix}_{name} histogram')
+            cumulative_count = 0
+            for bound, count in zip(histogram['bounds'] + ['+Inf'], histogram['counts']):
+                cumulative_count += count
+                lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {cumulative_count}')
+            lines += [f'{prefix}_{name}_sum {histogram["sum"]}', f'{prefix}_{name}_count {histogram["count"]}']
+
+        return '\n'.join(lines) + '\n'
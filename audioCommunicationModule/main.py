@@ -2,15 +2,12 @@ import random
 import threading
 import time
 
-import pyaudio
 from symbol_map import SymbolMap
 from receiver import Receiver
 from transmitter import Transmitter
 from utils import *
 import numpy as np
-import sounddevice as sd
 import wave
-import reedsolo
 
 
 default_samples_per_symbol = 4096
@@ -38,7 +35,8 @@ def store_audio_file(path: str, pcm_data: bytes):
 
 def test_recorded_file(receiver: Receiver, symbol_map: SymbolMap, path: str):
     audio_data = load_audio_file(path)
-    audio_signal = [random.random() * (-1 if random.random() > 0.5 else 1) for _ in range(9573)] + pcm_to_signal(audio_data)
+    audio_signal = np.concatenate(([random.random() * (-1 if random.random() > 0.5 else 1) for _ in range(9573)],
+                                   pcm_to_signal(audio_data)))
     import plot_utils
     plot_utils.plot_signal(audio_signal, 16000)
     chunk_size = default_samples_per_symbol
@@ -50,11 +48,13 @@ def test_recorded_file(receiver: Receiver, symbol_map: SymbolMap, path: str):
 
 
 def test_receiver_live(receiver: Receiver):
+    import pyaudio
+
     full_data = bytes()
     recording_event = threading.Event()
     received_message = []
 
-    def signal_handler(input_data: bytes, frame_count: int, time_info, status: sd.CallbackFlags):
+    def signal_handler(input_data: bytes, frame_count: int, time_info, status: int):
         start_time = time.time()
         nonlocal full_data
         nonlocal recording_event
@@ -83,13 +83,47 @@ def test_receiver_live(receiver: Receiver):
     print("\nStopped recording!")
 
     recorder.terminate()
-    message_signal = np.array(pcm_to_signal(full_data))
+    message_signal = pcm_to_signal(full_data)
     data = receiver.message_history
     print(f"final message: '{data[0][2]}'. Is valid: {data[0][3]}")
     return
 
 
+async def test_receiver_live_async(receiver: Receiver):
+    import pyaudio
+    from async_receiver import AsyncReceiver
+
+    async with AsyncReceiver(receiver) as async_receiver:
+        def signal_handler(input_data: bytes, frame_count: int, time_info, status: int):
+            # Only copies the block, sync and decoding happen off the audio thread
+            async_receiver.put_pcm16_threadsafe(input_data)
+            return None, pyaudio.paContinue
+
+        recorder = pyaudio.PyAudio()
+        # noinspection PyTypeChecker
+        stream = recorder.open(format=recorder.get_format_from_width(2),
+                               channels=1,
+                               rate=int(default_sample_rate_hz),
+                               input=True,
+                               frames_per_buffer=default_samples_per_symbol,
+                               stream_callback=signal_handler)
+
+        print("Recording...")
+        async for message in async_receiver:
+            print(f"final message: '{message[2]}'. Is valid: {message[3]}")
+            break
+        print("\nStopped recording!")
+
+        stream.stop_stream()
+        stream.close()
+        recorder.terminate()
+
+    print(f"Dropped blocks: {async_receiver.dropped_blocks}")
+
+
 def play_pcm(pcm: bytes, sample_rate_hz: float):
+    import pyaudio
+
     # instantiate PyAudio
     playback = pyaudio.PyAudio()
 
@@ -110,11 +144,42 @@ def play_pcm(pcm: bytes, sample_rate_hz: float):
     playback.terminate()
 
 
+def play_message_stream(transmitter: Transmitter, message: bytes, sample_rate_hz: float):
+    import pyaudio
+
+    # Playback starts as soon as the first block is synthesized, the rest is synthesized in the output callback
+    pcm_stream = transmitter.pcm_stream(message, default_samples_per_symbol)
+    finished_event = threading.Event()
+
+    def output_handler(input_data, frame_count: int, time_info, status):
+        pcm_data = pcm_stream.read(frame_count)
+        if pcm_stream.is_finished:
+            finished_event.set()
+            return pcm_data, pyaudio.paComplete
+
+        return pcm_data, pyaudio.paContinue
+
+    playback = pyaudio.PyAudio()
+    # noinspection PyTypeChecker
+    stream = playback.open(format=playback.get_format_from_width(2),
+                           channels=1,
+                           rate=int(sample_rate_hz),
+                           output=True,
+                           frames_per_buffer=default_samples_per_symbol,
+                           stream_callback=output_handler)
+
+    finished_event.wait()
+    while stream.is_active():
+        time.sleep(0.01)
+
+    stream.close()
+    playback.terminate()
+
+
 def transmitter_demonstration(transmitter: Transmitter):
     while True:
         message = input("Enter Message: ")
-        message_signal = transmitter.transmit_buffer(message.encode('ascii'))
-        play_pcm(signal_to_pcm(message_signal), default_sample_rate_hz)
+        play_message_stream(transmitter, message.encode('ascii'), default_sample_rate_hz)
 
 
 def generate_graphs_for_project(transmitter: Transmitter):
@@ -132,7 +197,6 @@ def generate_graphs_for_project(transmitter: Transmitter):
 
 def main():
     symbol_map = SymbolMap(default_symbol_size, default_symbol_weight)
-    ecc_codec = reedsolo.RSCodec(default_nsym, default_nsize)
     receiver = Receiver(default_symbol_weight,
                         default_symbol_size,
                         default_samples_per_symbol,
@@ -155,7 +219,7 @@ def main():
                               snr_threshold=1.5)
 
     message = "To go"
-    print(transmitter._ecc_codec.encode(message.encode('ascii')))
+    print(transmitter._message_codec.encode(message.encode('ascii')))
     message_signal = transmitter.transmit_buffer(message.encode('ascii'))
     # play_pcm(signal_to_pcm(message_signal), 16000)
     # store_audio_file("samples\\sample25.wav", signal_to_pcm(message_signal))
@@ -165,6 +229,7 @@ def main():
 
     test_recorded_file(receiver, symbol_map, "samples/sample25.wav")
     # test_receiver_live(receiver)
+    # import asyncio; asyncio.run(test_receiver_live_async(receiver))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,135 @@
+from functools import lru_cache
+from typing import List, Sequence, Set, Tuple
+
+import numpy as np
+from reedsolo import RSCodec, ReedSolomonError
+
+from utils import CRC_SIZE, crc_checksum_bytes
+
+DecodedMessage = Tuple[bytes, Set[int], bool]
+
+
+class MessageCodec(object):
+    """
+    CRC + Reed-Solomon framing of a message. Use get_message_codec to share one instance
+    (and its generator polynomials) per ECC configuration.
+    """
+
+    def __init__(self, ecc_symbols: int, ecc_block: int):
+        self._ecc_symbols = ecc_symbols
+        self._ecc_block = ecc_block
+        self._ecc_codec = RSCodec(ecc_symbols, ecc_block)
+
+    @property
+    def ecc_symbols(self) -> int:
+        return self._ecc_symbols
+
+    @property
+    def ecc_block(self) -> int:
+        return self._ecc_block
+
+    def is_valid_length(self, encoded_length: int) -> bool:
+        """
+        :return: whether encode can output encoded_length bytes, every Reed-Solomon block holds data and ECC symbols.
+        """
+        last_block_length = encoded_length % self._ecc_block
+        return encoded_length > 0 and (last_block_length == 0 or last_block_length > self._ecc_symbols)
+
+    def encoded_length(self, message_length: int) -> int:
+        """
+        :return: the length of the encoding of a message_length bytes message.
+        """
+        data_length = message_length + CRC_SIZE
+        block_count = -(-data_length // (self._ecc_block - self._ecc_symbols))
+        return data_length + block_count * self._ecc_symbols
+
+    def encode(self, message: bytes) -> bytes:
+        return bytes(self._ecc_codec.encode(message + crc_checksum_bytes(message)))
+
+    def _correct(self, encoded_data: bytes, erasures: Set[int]) -> Tuple[bytes, Set[int], bool]:
+        # An erasure-only decode is cheap (clean frames stop at the syndrome check), and when it succeeds it is
+        # the result we want, so the full errors-and-erasures decode only runs when it fails.
+        try:
+            corrected_message, _, errata = self._ecc_codec.decode(encoded_data, erase_pos=erasures,
+                                                                  only_erasures=True)
+            return corrected_message, errata, True
+        except ReedSolomonError:
+            pass
+
+        return self._correct_errors(encoded_data, erasures)
+
+    def _correct_errors(self, encoded_data: bytes, erasures: Set[int]) -> Tuple[bytes, Set[int], bool]:
+        try:
+            corrected_message, _, errata = self._ecc_codec.decode(encoded_data, erase_pos=erasures)
+            return corrected_message, errata, True
+        except ReedSolomonError:
+            return encoded_data, erasures, False
+
+    def decode(self, encoded_data: bytes, erasures: Set[int]) -> DecodedMessage:
+        corrected_message, errata, is_message_valid = self._correct(encoded_data, erasures)
+        return self._check_crc(corrected_message, errata, is_message_valid)
+
+    @staticmethod
+    def _check_crc(corrected_message: bytes, errata: Set[int], is_message_valid: bool) -> DecodedMessage:
+        if is_message_valid:
+            corrected_message_crc = corrected_message[-CRC_SIZE:]
+            corrected_message = corrected_message[:-CRC_SIZE]
+            is_message_valid = corrected_message_crc == crc_checksum_bytes(corrected_message)
+
+        return corrected_message, errata, is_message_valid
+
+    def _erasure_counts(self, initial_erasure_count: int) -> List[int]:
+        """
+        Generalized minimum distance schedule: start from the hard decision erasures (within the budget),
+        then trade errors for erasures two at a time, up to the whole budget and down to no erasures.
+        """
+        first_count = min(initial_erasure_count, self._ecc_symbols)
+        return ([first_count] +
+                list(range(first_count + 2, self._ecc_symbols + 1, 2)) +
+                list(range(first_count - 2, -1, -2)))
+
+    def _correct_soft(self, encoded_data: bytes, erasures: Set[int],
+                      confidences: np.ndarray) -> Tuple[bytes, Set[int], bool]:
+        corrected_message = bytearray()
+        all_errata = bytearray()
+        for chunk_start in range(0, len(encoded_data), self._ecc_block):
+            chunk = encoded_data[chunk_start:chunk_start + self._ecc_block]
+            # Least confident symbols first, a stable sort keeps equally unknown symbols in order
+            erasure_order = np.argsort(confidences[chunk_start:chunk_start + len(chunk)], kind='stable')
+            chunk_erasure_count = sum(chunk_start <= location < chunk_start + len(chunk) for location in erasures)
+
+            for attempt, erasure_count in enumerate(self._erasure_counts(chunk_erasure_count)):
+                chunk_erasures = erasure_order[:erasure_count].tolist()
+                if attempt == 0:
+                    chunk_message, chunk_errata, is_chunk_valid = self._correct(chunk, chunk_erasures)
+                else:
+                    chunk_message, chunk_errata, is_chunk_valid = self._correct_errors(chunk, chunk_erasures)
+                if is_chunk_valid:
+                    break
+            else:
+                return encoded_data, erasures, False
+
+            corrected_message += chunk_message
+            all_errata += bytearray(chunk_errata)
+
+        return corrected_message, all_errata, True
+
+    def decode_soft(self, encoded_data: bytes, erasures: Set[int], confidences: np.ndarray) -> DecodedMessage:
+        """
+        Decode using the confidence of every byte: each Reed-Solomon block is first decoded with the hard
+        decision erasures, capped to the least confident ones the ECC budget can take. Only when that fails
+        are more or fewer of its least confident bytes erased.
+        """
+        corrected_message, errata, is_message_valid = self._correct_soft(encoded_data, erasures, confidences)
+        return self._check_crc(corrected_message, errata, is_message_valid)
+
+    def decode_batch(self, frames: Sequence[Tuple[bytes, Set[int]]]) -> List[DecodedMessage]:
+        return [self.decode(encoded_data, erasures) for encoded_data, erasures in frames]
+
+    def decode_soft_batch(self, frames: Sequence[Tuple[bytes, Set[int], np.ndarray]]) -> List[DecodedMessage]:
+        return [self.decode_soft(encoded_data, erasures, confidences) for encoded_data, erasures, confidences in frames]
+
+
+@lru_cache(maxsize=None)
+def get_message_codec(ecc_symbols: int, ecc_block: int) -> MessageCodec:
+    return MessageCodec(ecc_symbols, ecc_block)
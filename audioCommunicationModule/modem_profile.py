@@ -0,0 +1,121 @@
+import argparse
+import json
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+PROFILE_FORMAT_VERSION = 1
+
+
+class ModemProfile(object):
+    """
+    The precomputed tables of a modem configuration: the subcarrier frequency grid, the sync chirp, the subcarrier
+    indices of every constant weight symbol and optionally the padded waveform of every symbol.
+    Build one with OFDM.to_profile, save it once and pass it to OFDM / Transmitter / Receiver (modem_profile=...)
+    to skip computing the tables at every start.
+    """
+
+    def __init__(self,
+                 configuration: Dict[str, Any],
+                 frequencies_hz: np.ndarray,
+                 sync_preamble: np.ndarray,
+                 symbol_indices: np.ndarray,
+                 waveform_table: Optional[np.ndarray] = None):
+        """
+        :param configuration: the OFDM arguments the tables were computed for, see OFDM.configuration.
+        """
+        self._configuration = dict(configuration)
+        self._frequencies_hz = np.asarray(frequencies_hz, dtype=np.float64)
+        self._sync_preamble = np.asarray(sync_preamble, dtype=np.float64)
+        self._symbol_indices = np.asarray(symbol_indices, dtype=np.intp)
+        self._waveform_table = waveform_table
+
+    @property
+    def configuration(self) -> Dict[str, Any]:
+        return dict(self._configuration)
+
+    @property
+    def frequencies_hz(self) -> np.ndarray:
+        return self._frequencies_hz
+
+    @property
+    def sync_preamble(self) -> np.ndarray:
+        return self._sync_preamble
+
+    @property
+    def symbol_indices(self) -> np.ndarray:
+        return self._symbol_indices
+
+    @property
+    def waveform_table(self) -> Optional[np.ndarray]:
+        return self._waveform_table
+
+    def check_configuration(self, configuration: Dict[str, Any]):
+        if configuration != self._configuration:
+            raise ValueError(f'The modem profile was computed for {self._configuration}, not for {configuration}')
+
+    def save(self, path: str):
+        arrays = dict(format_version=np.array(PROFILE_FORMAT_VERSION),
+                      configuration=np.array(json.dumps(self._configuration, sort_keys=True)),
+                      frequencies_hz=self._frequencies_hz,
+                      sync_preamble=self._sync_preamble,
+                      symbol_indices=self._symbol_indices)
+        if self._waveform_table is not None:
+            arrays['waveform_table'] = self._waveform_table
+
+        with open(path, 'wb') as profile_file:
+            np.savez(profile_file, **arrays)
+
+    @classmethod
+    def load(cls, path: str, load_waveforms: bool = True) -> 'ModemProfile':
+        """
+        :param load_waveforms: whether to read the waveform table, which only the transmitter uses.
+        """
+        with np.load(path, allow_pickle=False) as profile_file:
+            format_version = int(profile_file['format_version'])
+            if format_version != PROFILE_FORMAT_VERSION:
+                raise ValueError(f'{path} is a version {format_version} modem profile, '
+                                 f'expected version {PROFILE_FORMAT_VERSION}')
+
+            waveform_table = None
+            if load_waveforms and 'waveform_table' in profile_file.files:
+                waveform_table = profile_file['waveform_table']
+
+            return cls(json.loads(str(profile_file['configuration'])),
+                       profile_file['frequencies_hz'],
+                       profile_file['sync_preamble'],
+                       profile_file['symbol_indices'],
+                       waveform_table)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description='Precompute the tables of a modem configuration into a .npz profile.')
+    parser.add_argument('output')
+    parser.add_argument('--symbol-weight', type=int, default=3)
+    parser.add_argument('--symbol-size', type=int, default=16)
+    parser.add_argument('--samples-per-symbol', type=int, default=4096)
+    parser.add_argument('--sample-rate-hz', type=float, default=16_000)
+    parser.add_argument('--frequency-range-start-hz', type=float, default=2_000)
+    parser.add_argument('--frequency-range-end-hz', type=float, default=4_000)
+    parser.add_argument('--cyclic-prefix-length', type=int, default=None)
+    parser.add_argument('--sub-band-count', type=int, default=1)
+    parser.add_argument('--sub-band-index', type=int, default=0)
+    parser.add_argument('--no-waveforms', action='store_true', help='Leave out the waveform table (receiver only)')
+    arguments = parser.parse_args(argv)
+
+    from OFDM import OFDM
+
+    modulation = OFDM(arguments.symbol_weight,
+                      arguments.symbol_size,
+                      arguments.samples_per_symbol,
+                      arguments.sample_rate_hz,
+                      arguments.frequency_range_start_hz,
+                      arguments.frequency_range_end_hz,
+                      cyclic_prefix_length=arguments.cyclic_prefix_length,
+                      sub_band_count=arguments.sub_band_count,
+                      sub_band_index=arguments.sub_band_index)
+    modulation.to_profile(include_waveforms=not arguments.no_waveforms).save(arguments.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+from typing import Tuple
+
+import numpy as np
+
+from demodulator import BatchDemodulator
+from synthesizer import SymbolSynthesizer
+
+
+def _gray_code(values: np.ndarray) -> np.ndarray:
+    return np.bitwise_xor(values, np.right_shift(values, 1))
+
+
+class DifferentialPhaseKeying(object):
+    """
+    Every subcarrier of every symbol is on, and each digit is keyed into the phase (and optionally the amplitude)
+    difference between a subcarrier and the one below it in the same symbol.
+    Keying across frequency instead of time makes the decision insensitive to the timing offset of a symbol window,
+    which only adds a small phase slope between neighbouring subcarriers, and to the phase response of the channel.
+    """
+    # Amplitude ratio between the two levels of the amplitude keyed bit
+    AMPLITUDE_RATIO = 2.0
+
+    def __init__(self,
+                 synthesizer: SymbolSynthesizer,
+                 demodulator: BatchDemodulator,
+                 phase_bits: int,
+                 amplitude_bits: int = 0):
+        if phase_bits <= 0:
+            raise ValueError(f'At least one phase bit is needed, got {phase_bits}')
+        if amplitude_bits not in (0, 1):
+            raise ValueError(f'Only 0 or 1 amplitude bits are supported, got {amplitude_bits}')
+
+        self._synthesizer = synthesizer
+        self._demodulator = demodulator
+        self._phase_bits = phase_bits
+        self._amplitude_bits = amplitude_bits
+        self._phase_count = 1 << phase_bits
+        self._phase_step = 2 * np.pi / self._phase_count
+        # Gray coded constellation, neighbouring phases differ by a single bit
+        self._phase_of_digit: np.ndarray = np.argsort(_gray_code(np.arange(self._phase_count)))
+        self._subcarrier_count = len(demodulator.subcarrier_bins)
+
+        # The spectrum of every unit subcarrier at its bin, divides out the phase of the window position
+        unit_symbols = synthesizer.coefficients_to_signal(np.eye(self._subcarrier_count, dtype=np.complex128))
+        self._reference: np.ndarray = np.diagonal(demodulator.spectrum(unit_symbols)).copy()
+
+    @property
+    def bits_per_digit(self) -> int:
+        return self._phase_bits + self._amplitude_bits
+
+    @property
+    def digits_per_symbol(self) -> int:
+        return self._subcarrier_count - 1
+
+    def digits_to_signal(self, digits: np.ndarray) -> np.ndarray:
+        """
+        Synthesize a (n_symbols, digits_per_symbol) matrix of digits into a flat signal, guards included.
+        Every symbol is scaled to a peak amplitude of 1.
+        """
+        digits = np.asarray(digits, dtype=np.int64).reshape(-1, self.digits_per_symbol)
+        if len(digits) == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        first_subcarrier = np.zeros((len(digits), 1), dtype=np.int64)
+        phase_steps = self._phase_of_digit[np.right_shift(digits, self._amplitude_bits)]
+        phases = self._phase_step * np.cumsum(np.hstack((first_subcarrier, phase_steps)), axis=1)
+        # An amplitude bit of 1 switches between the two levels
+        amplitude_switches = np.bitwise_and(digits, (1 << self._amplitude_bits) - 1)
+        levels = np.cumsum(np.hstack((first_subcarrier, amplitude_switches)), axis=1) % 2
+        coefficients = self.AMPLITUDE_RATIO ** -levels * np.exp(1j * phases)
+
+        signal = self._synthesizer.coefficients_to_signal(coefficients)
+        signal /= np.max(np.abs(signal), axis=1, keepdims=True)
+
+        return signal.reshape(-1)
+
+    def equalize(self, spectrum: np.ndarray) -> np.ndarray:
+        """
+        :param spectrum: the (n_symbols, symbol_size) spectrum of the symbol windows at the subcarrier bins.
+        :return: the complex amplitude of every subcarrier.
+        """
+        return spectrum / self._reference
+
+    def decide(self, spectrum: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the (n_symbols, digits_per_symbol) digits, and the confidence of every digit:
+                the log ratio of its distance to the second closest constellation point to its distance
+                to the closest one, so that it is comparable to BatchDemodulator.soft_decide.
+        """
+        differences = spectrum[:, 1:] * np.conj(spectrum[:, :-1])
+        phase_positions = np.angle(differences) / self._phase_step
+        closest_phases = np.rint(phase_positions)
+        phase_errors = np.abs(phase_positions - closest_phases)
+        digits = _gray_code(closest_phases.astype(np.int64) % self._phase_count)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            confidences = np.log(1 - phase_errors) - np.log(phase_errors)
+
+            if self._amplitude_bits > 0:
+                log_ratios = np.abs(np.log(np.abs(spectrum[:, 1:])) - np.log(np.abs(spectrum[:, :-1])))
+                switch_distances = np.abs(log_ratios - np.log(self.AMPLITUDE_RATIO))
+                is_switch = switch_distances < log_ratios
+                digits = np.left_shift(digits, 1) | is_switch
+                amplitude_confidences = (np.log(np.maximum(log_ratios, switch_distances)) -
+                                         np.log(np.minimum(log_ratios, switch_distances)))
+                confidences = np.minimum(confidences, amplitude_confidences)
+
+        # Silent subcarriers carry no information at all
+        confidences[np.isnan(confidences) | (differences == 0)] = -np.inf
+
+        return digits, confidences
@@ -1,8 +1,5 @@
-from matplotlib import pyplot as plt
 from utils import *
 
-plt.figure(figsize=(50, 10))
-
 title_font = {
     "weight": "bold",
     "size": 22
@@ -14,6 +11,8 @@ label_font = {
 }
 
 def plot_signal(signal: List[float], sample_rate_hz: float, title: str = 'Signal'):
+    from matplotlib import pyplot as plt
+
     t = np.linspace(0, len(signal) / sample_rate_hz, len(signal), endpoint=False)
     plt.figure(figsize=(40, 10))
     plt.plot(t, signal)
@@ -25,6 +24,8 @@ def plot_signal(signal: List[float], sample_rate_hz: float, title: str = 'Signal
 
 
 def plot_signal_fft(signal: List[float], sample_rate_hz: float, title: str):
+    from matplotlib import pyplot as plt
+
     f, fft = list(zip(*signal_fft(signal, sample_rate_hz)))
     plt.figure(figsize=(15, 10))
     plt.plot(f, fft)
@@ -1,14 +1,34 @@
-from typing import List, Optional, Tuple, Union, Set
+from collections import deque
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union, Set
 
-from OFDM import OFDM
+from OFDM import CONSTANT_WEIGHT_MODE, OFDM
 import numpy as np
+from demodulator import AUTO_DETECTOR, SharedSpectrum
+from framing import DEFAULT_MAX_FRAME_PAYLOAD, FRAME_HEADER_SIZE, PayloadAssembler, is_last_frame
+from instrumentation import DEFAULT_SCORE_BUCKETS, Instrumentation
+from sample_buffer import SampleBuffer
+from streaming_correlator import StreamingCorrelator
 from symbol import OFDMSymbol
-from reedsolo import RSCodec, ReedSolomonError
+from timing_recovery import SymbolTracker, TimingRecovery
+from message_codec import get_message_codec
+from modem_profile import ModemProfile
 from utils import *
 
 import pdb
 
+MessageEntry = Tuple[bytes, Set[int], bytes, bool]
+
+# What a receiver does with a message that runs past max_message_symbols without a terminating preamble
+RESYNC_ON_OVERFLOW = 'resync'
+TERMINATE_ON_OVERFLOW = 'terminate'
+OVERFLOW_POLICIES = (RESYNC_ON_OVERFLOW, TERMINATE_ON_OVERFLOW)
+
+
 class Receiver(object):
+    CORRELATION_TAIL_LENGTH = 2
+
     def __init__(self,
                  symbol_weight: int,
                  symbol_size: int,
@@ -19,7 +39,53 @@ class Receiver(object):
                  ecc_symbols: int,
                  ecc_block: int,
                  snr_threshold: float = 1,
-                 correlation_threshold: float = 0.7):
+                 correlation_threshold: float = 0.7,
+                 soft_decision: bool = True,
+                 instrumentation: Optional[Instrumentation] = None,
+                 reassemble_frames: bool = False,
+                 max_frame_payload: int = DEFAULT_MAX_FRAME_PAYLOAD,
+                 modulation_mode: str = CONSTANT_WEIGHT_MODE,
+                 cyclic_prefix_length: Optional[int] = None,
+                 modem_profile: Optional[ModemProfile] = None,
+                 sub_band_count: int = 1,
+                 sub_band_index: int = 0,
+                 shared_spectrum: Optional[SharedSpectrum] = None,
+                 detector: str = AUTO_DETECTOR,
+                 max_message_symbols: Optional[int] = None,
+                 overflow_policy: str = RESYNC_ON_OVERFLOW,
+                 max_history_length: Optional[int] = None,
+                 message_callback: Optional[Callable[[MessageEntry], None]] = None):
+        """
+        :param soft_decision: pick the Reed-Solomon erasures from the confidence of every symbol,
+                              instead of only erasing the symbols under the snr threshold.
+        :param instrumentation: where to record the stage timings and the per message statistics, disabled if None.
+        :param reassemble_frames: treat the messages as the frames of Transmitter.transmit_payload, and reassemble them.
+        :param max_frame_payload: the max_frame_payload of the transmitter. A frame that follows another one without a
+                terminating preamble after that many bytes (e.g. the closing preamble of a corrupted last frame)
+                is dropped and the receiver resyncs, whatever max_message_symbols is.
+        :param modulation_mode: one of OFDM.MODULATION_MODES, must match the transmitter.
+        :param cyclic_prefix_length: the cyclic prefix of the transmitter (see OFDM), None for silent guards.
+        :param modem_profile: precomputed tables of this configuration, the receiver does not need its waveforms.
+        :param sub_band_count: the number of sub-bands of the frequency range (see OFDM), this receiver only listens
+                to the sub-band sub_band_index.
+        :param shared_spectrum: share the FFT of the symbol windows with the receivers of the other sub-bands,
+                see MultiBandReceiver.
+        :param detector: how the spectrum of the symbol windows is computed, one of demodulator.DETECTORS.
+        :param max_message_symbols: the longest message, in symbols. Once a message runs past it without a terminating
+                preamble (a missed preamble or a false sync), the receiver either resyncs and drops what it received
+                (RESYNC_ON_OVERFLOW), or decodes the first max_message_symbols symbols as the message
+                (TERMINATE_ON_OVERFLOW). This bounds the buffered samples. Unlimited if None.
+        :param max_history_length: keep only the last max_history_length messages (and reassembled payloads)
+                in the history, unlimited if None. Use message_count / messages_since or message_callback
+                to consume the messages as they are decoded.
+        :param message_callback: called with every message history entry as it is decoded.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow_policy!r}, expected one of {OVERFLOW_POLICIES}')
+        if max_message_symbols is not None and max_message_symbols <= 0:
+            raise ValueError(f'The message length limit must be positive, got {max_message_symbols}')
+
+        self._instrumentation = instrumentation
 
         self._modulation = OFDM(symbol_weight,
                                 symbol_size,
@@ -27,19 +93,55 @@ class Receiver(object):
                                 sample_rate_hz,
                                 frequency_range_start_hz,
                                 frequency_range_end_hz,
-                                snr_threshold)
+                                snr_threshold,
+                                instrumentation=instrumentation,
+                                modulation_mode=modulation_mode,
+                                cyclic_prefix_length=cyclic_prefix_length,
+                                modem_profile=modem_profile,
+                                sub_band_count=sub_band_count,
+                                sub_band_index=sub_band_index,
+                                shared_spectrum=shared_spectrum,
+                                detector=detector)
         self._is_synced: bool = False
-        self._buffer: List[float] = []
-        self._preamble_offset: int = 0
-        self._last_sync_location: int = 0
+        self._buffer: SampleBuffer = SampleBuffer()
+        self._correlator: StreamingCorrelator = StreamingCorrelator(self._modulation.sync_preamble)
+        self._correlation_tail: np.ndarray = np.zeros(0, dtype=np.float64)
+        # Absolute sample positions (counted from the first received sample) of the start preamble,
+        # and of the first correlation window that may hold the next preamble
+        self._message_start: float = 0
+        self._search_position: float = 0
         self._sync_score: int = 0
         self._correlation_threshold: float = correlation_threshold
         self._preamble_retries = 0
-        self._ecc_codec = RSCodec(ecc_symbols, ecc_block)
-        self._message_history: List[Tuple[bytes, Set[int], bytes, bool]] = []
+        self._message_codec = get_message_codec(ecc_symbols, ecc_block)
+        self._soft_decision = soft_decision
+        self._max_message_symbols = max_message_symbols
+        self._max_frame_symbols = self._modulation.symbol_count(
+            self._message_codec.encoded_length(FRAME_HEADER_SIZE + max_frame_payload))
+        # Whether the current message was synced on the terminating preamble of a frame
+        self._is_chained_frame = False
+        self._overflow_policy = overflow_policy
+        self._max_history_length = max_history_length
+        self._message_callback = message_callback
+        self._message_history: Deque[MessageEntry] = deque(maxlen=max_history_length)
+        self._payload_assembler: Optional[PayloadAssembler] = PayloadAssembler() if reassemble_frames else None
+        self._payload_history: Deque[Tuple[int, bytes]] = deque(maxlen=max_history_length)
+        self._message_count = 0
+        self._evicted_messages = 0
+        self._evicted_payloads = 0
+        self._forced_terminations = 0
+        self._overflow_resyncs = 0
+        # The symbol windows of the current message that were demodulated as soon as they arrived
+        self._symbol_tracker: Optional[SymbolTracker] = None
+        self._early_window_starts: List[int] = []
+        self._early_decisions: List[Tuple[np.ndarray, ...]] = []
 
     @property
-    def sync_preamble(self) -> List[float]:
+    def instrumentation(self) -> Optional[Instrumentation]:
+        return self._instrumentation
+
+    @property
+    def sync_preamble(self) -> np.ndarray:
         return self._modulation.sync_preamble
 
     @property
@@ -47,124 +149,492 @@ class Receiver(object):
         if not self._is_synced or len(self._buffer) < 4096:
             return None
 
-        return self._modulation.signal_to_symbols(self._buffer[-4096:])[0]
+        return self._modulation.signal_to_symbols(self._buffer.tail(4096))[0]
+
+    @property
+    def samples_per_symbol(self) -> int:
+        return self._modulation.samples_per_symbol
+
+    @property
+    def sample_rate_hz(self) -> float:
+        return self._modulation.sample_rate_hz
+
+    @property
+    def timing_recovery(self) -> TimingRecovery:
+        return self._modulation.timing_recovery
+
+    @property
+    def correlation_threshold(self) -> float:
+        return self._correlation_threshold
+
+    @property
+    def max_message_symbols(self) -> Optional[int]:
+        return self._max_message_symbols
 
     @property
-    def message_history(self):
+    def max_frame_symbols(self) -> int:
+        """
+        The symbol count of the longest frame, see max_frame_payload.
+        """
+        return self._max_frame_symbols
+
+    @property
+    def message_history(self) -> Deque[MessageEntry]:
+        """
+        The last max_history_length messages, oldest first.
+        """
         return self._message_history
 
+    @property
+    def message_count(self) -> int:
+        """
+        The number of messages decoded since the start, evicted ones included.
+        """
+        return self._message_count
+
+    def messages_since(self, message_count: int) -> List[MessageEntry]:
+        """
+        :return: the messages decoded after the first message_count ones, except those already evicted
+                from the history.
+        """
+        first_retained = self._message_count - len(self._message_history)
+        return list(islice(self._message_history, max(0, message_count - first_retained), None))
+
+    @property
+    def history_stats(self) -> Dict[str, int]:
+        return {
+            'messages': self._message_count,
+            'retained_messages': len(self._message_history),
+            'evicted_messages': self._evicted_messages,
+            'retained_payloads': len(self._payload_history),
+            'evicted_payloads': self._evicted_payloads,
+            'forced_terminations': self._forced_terminations,
+            'overflow_resyncs': self._overflow_resyncs,
+        }
+
     @property
     def is_synchronised(self):
         return self._is_synced
 
-    def _detect_preamble(self) -> Union[Tuple[int, float], Tuple[None, None]]:
-        return self._detect_preamble_in_buffer(self._buffer[self._last_sync_location:])
+    @property
+    def message_start_position(self) -> Optional[float]:
+        """
+        The absolute sample position of the start preamble of the message being received, None when not synchronised.
+        """
+        return self._message_start if self._is_synced else None
 
-    def _try_sync(self):
-        if self._is_synced:
-            return
+    @property
+    def payload_history(self) -> Deque[Tuple[int, bytes]]:
+        """
+        The (payload id, payload) of the last max_history_length reassembled payloads, when reassembling frames.
+        """
+        return self._payload_history
 
-        preamble_location, sync_score = self._detect_preamble()
-        if preamble_location is None:
-            if not self._is_synced:
-                buffer_size_to_keep = 2 * self._modulation.samples_per_symbol
-                self._buffer = self._buffer[-buffer_size_to_keep:]
+    def missing_frames(self) -> Dict[int, List[int]]:
+        """
+        :return: the sequence numbers of the missing frames of every incomplete payload, by payload id.
+        """
+        if self._payload_assembler is None:
+            return {}
 
-            return
+        return self._payload_assembler.missing_frames()
+
+    @property
+    def _buffer_position(self) -> int:
+        return self._correlator.samples_processed - len(self._buffer)
 
+    def _sync(self, preamble_position: float, sync_score: float):
         self._is_synced = True
+        self._is_chained_frame = False
         self._sync_score = sync_score
-        self._preamble_offset = preamble_location + len(self._modulation.sync_preamble) - len(self._buffer)
-        self._buffer = self._buffer[preamble_location + len(self._modulation.sync_preamble):]
+        self._message_start = preamble_position
+        self._search_position = preamble_position + len(self._modulation.sync_preamble) // 2
+        self._buffer.discard(int(np.floor(preamble_position)) - self._buffer_position)
+        self._symbol_tracker = SymbolTracker(self._modulation.timing_recovery,
+                                             preamble_position + len(self._modulation.sync_preamble))
+        self._early_window_starts = []
+        self._early_decisions = []
+
+        if self._instrumentation is not None:
+            self._instrumentation.count('syncs')
+            self._instrumentation.observe('sync_score', sync_score, DEFAULT_SCORE_BUCKETS)
 
     def _decode_message(self, encoded_data: bytes, erasures: Set[int]):
-        corrected_message = encoded_data
-        errata = erasures
-        is_message_valid = False
-        try:
-            corrected_message, _, errata = self._ecc_codec.decode(encoded_data, erase_pos=erasures)
-            is_message_valid = True
-        except ReedSolomonError:
-            pass
+        return self._message_codec.decode(encoded_data, erasures)
 
-        try:
-            corrected_message, _, errata = self._ecc_codec.decode(encoded_data, erase_pos=erasures, only_erasures=True)
-            is_message_valid = True
-        except ReedSolomonError:
-            pass
-
-        if is_message_valid:
-            corrected_message_crc = corrected_message[-CRC_SIZE:]
-            corrected_message = corrected_message[:-CRC_SIZE]
-            is_message_valid = corrected_message_crc == crc_checksum_bytes(corrected_message)
+    def _message_signal(self, message_end: float) -> np.ndarray:
+        """
+        :return: the symbol windows received since the start preamble, aligned by the timing recovery.
+        """
+        start_time = perf_counter() if self._instrumentation is not None else 0
+        buffer_position = self._buffer_position
+        data_start = self._message_start + len(self._modulation.sync_preamble) - buffer_position
+        signal = self._modulation.timing_recovery.align(self._buffer.view(), data_start, message_end - buffer_position)
 
-        # if not is_message_valid:
-        #     pdb.set_trace()
-        return corrected_message, errata, is_message_valid
+        if self._instrumentation is not None:
+            self._instrumentation.observe_stage('timing_recovery', perf_counter() - start_time)
+        return signal
 
     def get_message_symbols(self) -> List[OFDMSymbol]:
         if not self._is_synced:
             return list()
 
-        return self._modulation.signal_to_symbols(list(self._buffer))
+        return self._modulation.signal_to_symbols(self._message_signal(self._correlator.samples_processed))
 
     def get_message_data(self) -> Tuple[bytes, Set[int], bytes, bool]:
         if not self._is_synced:
             return bytes(), set(), bytes(), False
 
-        raw_message, errors = self._modulation.signal_to_data(list(self._buffer))
-        decoded_message, errata, is_message_valid = self._decode_message(raw_message, errors)
+        return self.decode_message_signal(self._message_signal(self._correlator.samples_processed))
+
+    def decode_message_signal(self, signal: Union[np.ndarray, List[float]]) -> Tuple[bytes, Set[int], bytes, bool]:
+        return self.decode_message_signals([signal])[0]
 
-        return raw_message, errata, decoded_message, is_message_valid
+    def decode_message_signals(self, signals: List[Union[np.ndarray, List[float]]]) -> List[Tuple[bytes, Set[int], bytes, bool]]:
+        return self._decode_message_signals(signals)[0]
 
-    def _truncate_buffer_to_whole_samples(self):
-        rounded_length = round(len(self._buffer) / self._modulation.samples_per_symbol) * self._modulation.samples_per_symbol
-        if len(self._buffer) < rounded_length:
-            self._buffer.extend([0] * (rounded_length - len(self._buffer)))
+    def _decode_message_signals(self, signals: List[Union[np.ndarray, List[float]]]) -> Tuple[List[Tuple[bytes, Set[int], bytes, bool]], List[int]]:
+        """
+        :return: the message history entries, and the number of erasures of every message before decoding.
+        """
+        decisions = [self._modulation.spectrum_to_decisions(self._modulation.spectrum(signal), self._soft_decision)
+                     for signal in signals]
+
+        return self._decode_decisions(decisions)
+
+    def _decode_decisions(self, decisions: List[Tuple[np.ndarray, ...]]) -> Tuple[List[Tuple[bytes, Set[int], bytes, bool]], List[int]]:
+        """
+        :param decisions: the symbol decisions of every message, see OFDM.spectrum_to_decisions.
+        :return: the message history entries, and the number of erasures of every message before decoding.
+        """
+        raw_messages = [self._modulation.decisions_to_data(message_decisions, self._soft_decision)
+                        for message_decisions in decisions]
+        if self._soft_decision:
+            decode_batch = self._message_codec.decode_soft_batch
         else:
-            self._buffer = self._buffer[:rounded_length]
-
-    def receive_buffer(self, signal: List[float]) -> None:
-        if self._preamble_offset > 0:
-            signal = signal[self._preamble_offset:]
-            self._preamble_offset = 0
-        self._buffer.extend(signal)
-
-        potential_termination_index = - 2 * len(self.sync_preamble)
-        termination_location, _ = self._detect_preamble_in_buffer(self._buffer[potential_termination_index:])
-        if self._is_synced and termination_location is not None:
-            self._buffer = self._buffer[: potential_termination_index + termination_location]
-            self._truncate_buffer_to_whole_samples()
-            self._terminate_message()
-
-        self._try_sync()
-
-    def receive_pcm16_buffer(self, pcm_data: List[int]) -> None:
-        pcm_data_bytes = np.array(pcm_data, dtype=np.int16).tobytes()
-        return self.receive_buffer(pcm_to_signal(pcm_data_bytes))
-
-    def _terminate_message(self):
-        current_message, current_errors, decoded_message, is_message_valid = self.get_message_data()
-        self._message_history.append(
-            (current_message,
-             current_errors,
-             decoded_message,
-             is_message_valid)
-        )
-        self._preamble_offset = 0
-        self._preamble_retries = 0
-        self._last_sync_location = 0
-        self._buffer = []
+            decode_batch = self._message_codec.decode_batch
+
+        candidates = [self._raw_message_candidates(raw_message, len(message_decisions[0]))
+                      for raw_message, message_decisions in zip(raw_messages, decisions)]
+        if self._instrumentation is None and all(len(message_candidates) == 1 for message_candidates in candidates):
+            raw_messages = [message_candidates[0] for message_candidates in candidates]
+            decoded_messages = decode_batch(raw_messages)
+        else:
+            raw_messages = []
+            decoded_messages = []
+            for message_candidates in candidates:
+                start_time = perf_counter()
+                raw_message, decoded_message = self._decode_candidates(message_candidates, decode_batch)
+                raw_messages.append(raw_message)
+                decoded_messages.append(decoded_message)
+                if self._instrumentation is not None:
+                    self._instrumentation.observe_stage('decode_message', perf_counter() - start_time)
+
+        messages = [(raw_message, errata, decoded_message, is_message_valid)
+                    for (raw_message, *_), (decoded_message, errata, is_message_valid)
+                    in zip(raw_messages, decoded_messages)]
+        erasure_counts = [len(erasures) for _, erasures, *_ in raw_messages]
+
+        if self._instrumentation is not None:
+            for (_, errata, _, is_message_valid), erasure_count in zip(messages, erasure_counts):
+                self._instrumentation.count('messages_decoded')
+                self._instrumentation.count('messages_valid', int(bool(is_message_valid)))
+                self._instrumentation.observe('erasures', erasure_count)
+                self._instrumentation.observe('errata', len(errata))
+
+        return messages, erasure_counts
+
+    def _raw_message_candidates(self, raw_message: tuple, symbol_count: int) -> List[tuple]:
+        """
+        :return: the raw message cut to every valid encoded length that fills symbol_count symbols, longest first.
+        """
+        data, erasures, *confidences = raw_message
+        data_lengths = [data_length for data_length in reversed(self._modulation.data_lengths(symbol_count))
+                        if data_length <= len(data) and self._message_codec.is_valid_length(data_length)]
+        if len(data_lengths) == 0 or data_lengths == [len(data)]:
+            return [raw_message]
+
+        return [(data[:data_length],
+                 {location for location in erasures if location < data_length},
+                 *(confidence[:data_length] for confidence in confidences))
+                for data_length in data_lengths]
+
+    @staticmethod
+    def _decode_candidates(candidates: List[tuple], decode_batch) -> Tuple[tuple, tuple]:
+        """
+        :return: the first candidate that decodes into a valid message (or the first one), and its decoding.
+        """
+        first_decoding = None
+        for candidate in candidates:
+            decoded_message = decode_batch([candidate])[0]
+            if decoded_message[2]:
+                return candidate, decoded_message
+            first_decoding = first_decoding or (candidate, decoded_message)
+
+        return first_decoding
+
+    def receive_buffer(self, signal: Union[np.ndarray, List[float]]) -> None:
+        start_time = perf_counter() if self._instrumentation is not None else 0
+        self._buffer.append(signal)
+        correlation_position, correlation = self._correlator.process(signal)
+        if self._instrumentation is not None:
+            self._instrumentation.observe_stage('correlation', perf_counter() - start_time)
+            if len(correlation) > 0:
+                self._instrumentation.observe('correlation_peak', float(np.max(correlation)), DEFAULT_SCORE_BUCKETS)
+        # The last windows of the previous block are the neighbours of a peak at the start of this one
+        correlation_position -= len(self._correlation_tail)
+        correlation = np.concatenate((self._correlation_tail, correlation))
+
+        # A block can hold the end of a message and the start of the next one
+        while True:
+            # Only correlation windows that start inside the buffered samples can be acted upon
+            search_position = max(self._search_position, self._buffer_position)
+            detection_time = perf_counter() if self._instrumentation is not None else 0
+            preamble_position, preamble_score = self._find_preamble(correlation, correlation_position, search_position)
+            if self._instrumentation is not None:
+                self._instrumentation.observe_stage('detect_preamble', perf_counter() - detection_time)
+            if preamble_position is None:
+                break
+
+            if self._is_synced:
+                self._terminate_message(preamble_position, preamble_score)
+            else:
+                self._sync(preamble_position, preamble_score)
+
+        if self._is_synced and self._is_message_overflowing():
+            self._handle_overflow()
+
+        if self._is_synced:
+            self._demodulate_arrived_windows()
+        else:
+            buffer_size_to_keep = 2 * self._modulation.samples_per_symbol
+            self._buffer.keep_last(buffer_size_to_keep)
+
+        tail_length = min(len(correlation), self.CORRELATION_TAIL_LENGTH)
+        self._correlation_tail = correlation[len(correlation) - tail_length:]
+
+        if self._instrumentation is not None:
+            self._instrumentation.count('blocks_received')
+            self._instrumentation.count('samples_received', len(signal))
+            self._instrumentation.set_gauge('buffer_samples', len(self._buffer))
+            self._instrumentation.set_gauge('buffer_capacity', self._buffer.capacity)
+            self._instrumentation.observe_stage('receive_buffer', perf_counter() - start_time)
+
+    def receive_pcm16_buffer(self, pcm_data: PCM16Data) -> None:
+        return self.receive_buffer(pcm_to_signal(pcm_data, dtype=np.float32))
+
+    def _message_symbol_limit(self) -> Optional[int]:
+        if self._is_chained_frame:
+            return min(self._max_frame_symbols, self._max_message_symbols or self._max_frame_symbols)
+
+        return self._max_message_symbols
+
+    def _overflow_position(self) -> float:
+        """
+        :return: where the current message ends once it holds the most symbols it can hold.
+        """
+        data_start = self._message_start + len(self._modulation.sync_preamble)
+        return data_start + self._message_symbol_limit() * self._modulation.samples_per_symbol
+
+    def _is_message_overflowing(self) -> bool:
+        if self._message_symbol_limit() is None:
+            return False
+
+        # Leave the terminating preamble of a message of the longest length (and some clock drift) time to be found
+        margin = len(self._modulation.sync_preamble) + self._modulation.samples_per_symbol
+        return self._correlator.samples_processed > self._overflow_position() + margin
+
+    def _handle_overflow(self):
+        # A frame longer than any frame is not one, there is nothing worth decoding
+        if self._overflow_policy == TERMINATE_ON_OVERFLOW and not self._is_chained_frame:
+            self._forced_terminations += 1
+            if self._instrumentation is not None:
+                self._instrumentation.count('forced_terminations')
+            self._terminate_message(self._overflow_position(), 0.0, is_forced=True)
+            return
+
+        self._overflow_resyncs += 1
+        if self._instrumentation is not None:
+            self._instrumentation.count('overflow_resyncs')
+        # Only the correlation of the current block is kept, so the detection resumes from the current block.
+        # No preamble was found in the span of the dropped message anyway.
+        self._search_position = self._message_start + len(self._modulation.sync_preamble) // 2
+        self._clear_message()
+
+    def _clear_message(self):
         self._is_synced = False
+        self._symbol_tracker = None
+        self._early_window_starts = []
+        self._early_decisions = []
+
+    def _demodulate_arrived_windows(self):
+        """
+        Demodulate and map the symbol windows of the message whose samples arrived, so that only the error correction
+        is left to do once the terminating preamble is found.
+        """
+        start_time = perf_counter() if self._instrumentation is not None else 0
+        buffer = self._buffer.view()
+        buffer_position = self._buffer_position
+        window_positions = []
+        while True:
+            window_position = self._symbol_tracker.place_window(buffer, buffer_position)
+            if window_position is None:
+                break
+            window_positions.append(window_position)
+        if len(window_positions) == 0:
+            return
 
-    def _detect_preamble_in_buffer(self, buffer: List[float]) -> Union[Tuple[int, float], Tuple[None, None]]:
-        correlation = normalized_correlation(buffer,
-                                             self._modulation.sync_preamble)
-        if len(correlation) == 0:
+        symbol_positions = np.asarray(window_positions) - buffer_position
+        window_starts = np.rint(symbol_positions).astype(np.int64) + buffer_position
+        signal = self._modulation.timing_recovery.extract_symbols(buffer, symbol_positions)
+        spectrum = self._modulation.spectrum(signal, window_starts)
+        self._early_decisions.append(self._modulation.spectrum_to_decisions(spectrum, self._soft_decision))
+        self._early_window_starts.extend(window_starts.tolist())
+
+        if self._instrumentation is not None:
+            self._instrumentation.observe_stage('early_demodulation', perf_counter() - start_time)
+
+    def _message_decisions(self, message_end: float) -> Tuple[np.ndarray, ...]:
+        """
+        :return: the symbol decisions of the message, see OFDM.spectrum_to_decisions. The windows demodulated
+                as they arrived are used wherever the timing recovery places the windows at the same positions.
+        """
+        start_time = perf_counter() if self._instrumentation is not None else 0
+        timing_recovery = self._modulation.timing_recovery
+        data_start = self._message_start + len(self._modulation.sync_preamble)
+        early_decisions = tuple(np.concatenate(arrays) for arrays in zip(*self._early_decisions))
+
+        tolerance = self._modulation.window_position_tolerance
+        symbol_count = timing_recovery.symbol_count(data_start, message_end)
+        pitch_drift = abs(message_end - data_start - symbol_count * self._modulation.samples_per_symbol)
+        if (len(self._early_decisions) > 0 and len(self._early_window_starts) >= symbol_count and
+                pitch_drift <= tolerance):
+            # The preambles are as far apart as the early windows assumed, they are all in place
+            if self._instrumentation is not None:
+                self._instrumentation.count('early_windows', symbol_count)
+            return tuple(decision[:symbol_count] for decision in early_decisions)
+
+        buffer = self._buffer.view()
+        buffer_position = self._buffer_position
+        symbol_positions = timing_recovery.symbol_positions(buffer,
+                                                            data_start - buffer_position,
+                                                            message_end - buffer_position)
+        window_starts = np.rint(symbol_positions).astype(np.int64) + buffer_position
+        if self._instrumentation is not None:
+            self._instrumentation.observe_stage('timing_recovery', perf_counter() - start_time)
+
+        early_count = min(len(self._early_window_starts), len(window_starts))
+        is_early = np.zeros(len(window_starts), dtype=bool)
+        is_early[:early_count] = (np.abs(np.asarray(self._early_window_starts[:early_count]) -
+                                         window_starts[:early_count]) <= tolerance)
+        early_rows = np.flatnonzero(is_early)
+        late_rows = np.flatnonzero(~is_early)
+
+        late_signal = timing_recovery.extract_symbols(buffer, symbol_positions[late_rows])
+        late_decisions = self._modulation.spectrum_to_decisions(
+            self._modulation.spectrum(late_signal, window_starts[late_rows]), self._soft_decision)
+        if self._instrumentation is not None:
+            self._instrumentation.count('early_windows', len(early_rows))
+            self._instrumentation.count('late_windows', len(late_rows))
+        if len(early_rows) == 0:
+            return late_decisions
+
+        decisions = []
+        for early_decision, late_decision in zip(early_decisions, late_decisions):
+            decision = np.empty((len(window_starts),) + late_decision.shape[1:], dtype=late_decision.dtype)
+            decision[early_rows] = early_decision[early_rows]
+            decision[late_rows] = late_decision
+            decisions.append(decision)
+
+        return tuple(decisions)
+
+    def _terminate_message(self, termination_position: float, termination_score: float, is_forced: bool = False):
+        """
+        :param is_forced: the message is cut at max_message_symbols, there is no preamble at termination_position.
+        """
+        start_time = perf_counter() if self._instrumentation is not None else 0
+        decisions = self._message_decisions(termination_position)
+        messages, (erasure_count,) = self._decode_decisions([decisions])
+        current_message, current_errors, decoded_message, is_message_valid = messages[0]
+        self._record_message((current_message, current_errors, decoded_message, is_message_valid))
+
+        if self._instrumentation is not None:
+            self._instrumentation.record_message(start_sample=self._message_start,
+                                                 end_sample=termination_position,
+                                                 sync_score=self._sync_score,
+                                                 termination_score=termination_score,
+                                                 buffer_samples=len(self._buffer),
+                                                 symbol_count=len(decisions[0]),
+                                                 erasures=erasure_count,
+                                                 errata=len(current_errors),
+                                                 is_valid=bool(is_message_valid),
+                                                 decode_seconds=perf_counter() - start_time)
+        self._preamble_retries = 0
+
+        if (self._payload_assembler is not None and self._add_frame(decoded_message, is_message_valid) and
+                not is_forced):
+            # Frames are sent back to back, the terminating preamble is the start preamble of the next frame
+            self._sync(termination_position, termination_score)
+            self._is_chained_frame = True
+            return
+
+        preamble_length = len(self._modulation.sync_preamble) if not is_forced else 0
+        self._search_position = termination_position + preamble_length // 2
+        # Keep what follows the terminating preamble, the next message can start right after it
+        self._buffer.discard(int(np.floor(termination_position)) + preamble_length - self._buffer_position)
+        self._clear_message()
+
+    def _record_message(self, message: MessageEntry):
+        if len(self._message_history) == self._message_history.maxlen:
+            self._evicted_messages += 1
+            if self._instrumentation is not None:
+                self._instrumentation.count('messages_evicted')
+        self._message_history.append(message)
+        self._message_count += 1
+
+        if self._message_callback is not None:
+            self._message_callback(message)
+
+    def _add_frame(self, frame: bytes, is_frame_valid: bool) -> bool:
+        """
+        :return: whether another frame should follow this one.
+        """
+        if not is_frame_valid:
+            # Without a header it is unknown, keep receiving frames
+            return True
+
+        try:
+            completed_payload = self._payload_assembler.add_frame(frame)
+        except ValueError:
+            # A message that is not a frame
+            return False
+
+        if completed_payload is not None:
+            if len(self._payload_history) == self._payload_history.maxlen:
+                self._evicted_payloads += 1
+            self._payload_history.append(completed_payload)
+        return not is_last_frame(frame)
+
+    def _find_preamble(self,
+                       correlation: np.ndarray,
+                       correlation_position: int,
+                       search_position: float) -> Union[Tuple[float, float], Tuple[None, None]]:
+        """
+        Find the first preamble whose correlation peak starts at or after search_position.
+        :return: the sub-sample position of the preamble and its correlation score.
+        """
+        first_window = max(0, int(np.ceil(search_position)) - correlation_position)
+        above_threshold = np.flatnonzero(correlation[first_window:] > self._correlation_threshold)
+        if len(above_threshold) == 0:
             return None, None
-        peak_value = abs(np.max(correlation))
 
-        if peak_value > self._correlation_threshold:
-            return np.argmax(correlation), max(correlation)
+        # The peak is the strongest window of the main lobe that starts at the first crossing
+        lobe_start = first_window + int(above_threshold[0])
+        lobe_end = min(len(correlation), lobe_start + len(self._modulation.sync_preamble) // 2)
+        peak_index = lobe_start + int(np.argmax(correlation[lobe_start:lobe_end]))
+        if peak_index == len(correlation) - 1:
+            # The peak may still be rising, wait for the next block
+            return None, None
 
-        return None, None
+        peak_position = correlation_position + self._modulation.timing_recovery.interpolate_peak(correlation, peak_index)
+        return peak_position, float(correlation[peak_index])
@@ -0,0 +1,269 @@
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from receiver import Receiver
+from utils import PCM16Data, pcm16_array, pcm_to_signal
+
+MessageEntry = Tuple[bytes, set, bytes, bool]
+
+_STOP = None
+
+
+def _worker_main(worker_index: int,
+                 channels: List[int],
+                 shared_slots,
+                 slot_count: int,
+                 slot_capacity: int,
+                 receiver_args: Tuple[Any, ...],
+                 receiver_kwargs: Dict[str, Any],
+                 task_queue,
+                 result_queue):
+    slots = np.frombuffer(shared_slots, dtype=np.float32).reshape(slot_count, slot_capacity)
+    receivers = {channel: Receiver(*receiver_args, **receiver_kwargs) for channel in channels}
+
+    while True:
+        task = task_queue.get()
+        if task is _STOP:
+            return
+
+        channel, slot, length = task
+        try:
+            receiver = receivers[channel]
+            message_count = receiver.message_count
+            receiver.receive_buffer(slots[slot, :length])
+            new_messages = receiver.messages_since(message_count)
+        except Exception:
+            result_queue.put(('error', worker_index, slot, channel, traceback.format_exc()))
+            continue
+
+        result_queue.put(('done', worker_index, slot, channel, new_messages))
+
+
+class ReceiverPool(object):
+    """
+    Runs one Receiver per channel, with the channels sharded over a pool of worker processes.
+    Audio blocks are handed to the workers through shared-memory slots, and decoded messages come back
+    in order for each channel.
+    """
+    DEFAULT_SLOTS_PER_WORKER = 16
+    DEFAULT_SLOT_CAPACITY = 1 << 14
+    # How often a blocking wait for results checks that the workers are still alive
+    LIVENESS_CHECK_INTERVAL_SEC = 1.0
+
+    def __init__(self,
+                 channel_count: int,
+                 receiver_args: Sequence[Any],
+                 receiver_kwargs: Optional[Dict[str, Any]] = None,
+                 worker_count: Optional[int] = None,
+                 slots_per_worker: int = DEFAULT_SLOTS_PER_WORKER,
+                 slot_capacity: int = DEFAULT_SLOT_CAPACITY):
+        if channel_count < 1:
+            raise ValueError(f'The pool needs at least one channel, got {channel_count}')
+
+        if worker_count is None:
+            worker_count = os.cpu_count() or 1
+        worker_count = max(1, min(worker_count, channel_count))
+
+        self._channel_count = channel_count
+        self._worker_count = worker_count
+        self._slots_per_worker = slots_per_worker
+        self._slot_capacity = slot_capacity
+        # Bounded like the history of the receivers (max_history_length)
+        history_length = (receiver_kwargs or {}).get('max_history_length')
+        self._message_histories: List[Deque[MessageEntry]] = [deque(maxlen=history_length)
+                                                              for _ in range(channel_count)]
+        self._pending_blocks = 0
+        self._is_closed = False
+
+        context = multiprocessing.get_context()
+        self._result_queue = context.Queue()
+        self._task_queues = []
+        self._slots: List[np.ndarray] = []
+        self._free_slots: List[List[int]] = []
+        self._workers = []
+        for worker_index in range(worker_count):
+            shared_slots = context.RawArray('f', slots_per_worker * slot_capacity)
+            task_queue = context.Queue()
+            worker = context.Process(
+                target=_worker_main,
+                args=(worker_index,
+                      list(range(worker_index, channel_count, worker_count)),
+                      shared_slots,
+                      slots_per_worker,
+                      slot_capacity,
+                      tuple(receiver_args),
+                      dict(receiver_kwargs or {}),
+                      task_queue,
+                      self._result_queue),
+                daemon=True)
+            worker.start()
+
+            self._task_queues.append(task_queue)
+            self._slots.append(np.frombuffer(shared_slots, dtype=np.float32).reshape(slots_per_worker, slot_capacity))
+            self._free_slots.append(list(range(slots_per_worker)))
+            self._workers.append(worker)
+
+    @property
+    def channel_count(self) -> int:
+        return self._channel_count
+
+    @property
+    def worker_count(self) -> int:
+        return self._worker_count
+
+    def message_history(self, channel: int) -> Deque[MessageEntry]:
+        return self._message_histories[channel]
+
+    def _worker_of(self, channel: int) -> int:
+        if not 0 <= channel < self._channel_count:
+            raise IndexError(f'Channel {channel} is out of range (0-{self._channel_count - 1})')
+        return channel % self._worker_count
+
+    def _worker_channels(self, worker_index: int) -> List[int]:
+        return list(range(worker_index, self._channel_count, self._worker_count))
+
+    def _check_workers(self):
+        """
+        Raise if a worker that still has blocks to process died without reporting them (e.g. killed).
+        """
+        for worker_index, worker in enumerate(self._workers):
+            has_pending_blocks = len(self._free_slots[worker_index]) < self._slots_per_worker
+            if has_pending_blocks and not worker.is_alive():
+                raise RuntimeError(f'The worker of channels {self._worker_channels(worker_index)} died '
+                                   f'(exit code {worker.exitcode})')
+
+    def _get_result(self, timeout_sec: Optional[float]):
+        """
+        Wait for the next result, None waits until one arrives unless a worker dies.
+        """
+        if timeout_sec is not None and timeout_sec <= 0:
+            return self._result_queue.get(block=False)
+
+        deadline = None if timeout_sec is None else time.monotonic() + timeout_sec
+        while True:
+            wait_sec = self.LIVENESS_CHECK_INTERVAL_SEC
+            if deadline is not None:
+                wait_sec = min(wait_sec, max(0.0, deadline - time.monotonic()))
+            try:
+                return self._result_queue.get(timeout=wait_sec)
+            except queue.Empty:
+                self._check_workers()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    def _handle_result(self, result) -> List[Tuple[int, MessageEntry]]:
+        status, worker_index, slot, channel, payload = result
+        self._free_slots[worker_index].append(slot)
+        self._pending_blocks -= 1
+
+        if status == 'error':
+            raise RuntimeError(f'Receiver of channel {channel} failed:\n{payload}')
+
+        self._message_histories[channel].extend(payload)
+        return [(channel, message) for message in payload]
+
+    def poll(self, timeout_sec: Optional[float] = 0) -> List[Tuple[int, MessageEntry]]:
+        """
+        Collect the results the workers finished so far.
+        :param timeout_sec: how long to wait for the first result, None waits until one arrives.
+        :return: the (channel, message) pairs decoded since the last poll.
+        """
+        new_messages = []
+        while self._pending_blocks > 0:
+            try:
+                result = self._get_result(timeout_sec)
+            except queue.Empty:
+                break
+            new_messages += self._handle_result(result)
+            timeout_sec = 0
+
+        return new_messages
+
+    def submit(self, channel: int, signal: Union[np.ndarray, List[float]]) -> List[Tuple[int, MessageEntry]]:
+        """
+        Queue a block of the channel's signal for decoding. Blocks while all the worker's slots are in use.
+        :return: the (channel, message) pairs collected while waiting for free slots.
+        """
+        return self._submit_blocks(channel, np.asarray(signal, dtype=np.float32), np.copyto)
+
+    def submit_pcm16(self, channel: int, pcm_data: PCM16Data) -> List[Tuple[int, MessageEntry]]:
+        """
+        Like submit, but the PCM16 samples are scaled straight into the shared slots.
+        """
+        return self._submit_blocks(channel, pcm16_array(pcm_data),
+                                   lambda slot_signal, block: pcm_to_signal(block, out=slot_signal))
+
+    def _submit_blocks(self,
+                       channel: int,
+                       samples: np.ndarray,
+                       copy_block: Callable[[np.ndarray, np.ndarray], Any]) -> List[Tuple[int, MessageEntry]]:
+        if self._is_closed:
+            raise RuntimeError('The receiver pool is closed')
+
+        worker_index = self._worker_of(channel)
+        new_messages = []
+        for block_index in range(0, len(samples), self._slot_capacity):
+            block = samples[block_index:block_index + self._slot_capacity]
+            while len(self._free_slots[worker_index]) == 0:
+                new_messages += self.poll(timeout_sec=None)
+
+            slot = self._free_slots[worker_index].pop()
+            copy_block(self._slots[worker_index][slot, :len(block)], block)
+            self._pending_blocks += 1
+            self._task_queues[worker_index].put((channel, slot, len(block)))
+
+        return new_messages
+
+    def flush(self) -> List[Tuple[int, MessageEntry]]:
+        new_messages = []
+        while self._pending_blocks > 0:
+            new_messages += self.poll(timeout_sec=None)
+
+        return new_messages
+
+    def process_streams(self,
+                        streams: Sequence[Union[np.ndarray, List[float]]],
+                        block_size: int) -> List[Deque[MessageEntry]]:
+        """
+        Decode one complete signal per channel, interleaving their blocks across the workers.
+        :return: the message history of every channel.
+        """
+        if len(streams) > self._channel_count:
+            raise ValueError(f'Got {len(streams)} streams for {self._channel_count} channels')
+
+        longest_stream = max((len(stream) for stream in streams), default=0)
+        for block_index in range(0, longest_stream, block_size):
+            for channel, stream in enumerate(streams):
+                block = stream[block_index:block_index + block_size]
+                if len(block) > 0:
+                    self.submit(channel, block)
+        self.flush()
+
+        return [self.message_history(channel) for channel in range(len(streams))]
+
+    def close(self):
+        if self._is_closed:
+            return
+
+        self._is_closed = True
+        try:
+            # Workers can only exit once their results were drained from the queue
+            self.flush()
+        finally:
+            for task_queue in self._task_queues:
+                task_queue.put(_STOP)
+            for worker in self._workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,78 @@
+from typing import List, Union
+
+import numpy as np
+
+
+class SampleBuffer(object):
+    """
+    Growable array of samples with cheap removal from both ends.
+    Views returned by this class share memory with the buffer and are only valid until the next append.
+    """
+    DEFAULT_INITIAL_CAPACITY = 1 << 16
+
+    def __init__(self, initial_capacity: int = DEFAULT_INITIAL_CAPACITY, dtype: np.dtype = np.float32):
+        self._storage: np.ndarray = np.zeros(max(1, initial_capacity), dtype=dtype)
+        self._start: int = 0
+        self._end: int = 0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def capacity(self) -> int:
+        return len(self._storage)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._storage.dtype
+
+    def view(self) -> np.ndarray:
+        return self._storage[self._start:self._end]
+
+    def tail(self, length: int) -> np.ndarray:
+        return self._storage[max(self._start, self._end - length):self._end]
+
+    def _reserve(self, extra_length: int):
+        if self._end + extra_length <= len(self._storage):
+            return
+
+        length = len(self)
+        required_length = length + extra_length
+        if required_length > len(self._storage) // 2:
+            storage = np.zeros(max(2 * len(self._storage), 2 * required_length), dtype=self._storage.dtype)
+            storage[:length] = self.view()
+            self._storage = storage
+        else:
+            self._storage[:length] = self.view()
+
+        self._start = 0
+        self._end = length
+
+    def append(self, samples: Union[np.ndarray, List[float]]):
+        samples = np.asarray(samples)
+        self._reserve(len(samples))
+        self._storage[self._end:self._end + len(samples)] = samples
+        self._end += len(samples)
+
+    def discard(self, length: int):
+        self._start = min(self._end, self._start + max(0, length))
+
+    def keep_last(self, length: int):
+        self._start = max(self._start, self._end - max(0, length))
+
+    def resize(self, length: int):
+        """
+        Truncate the buffer to the given length, or pad it with zeros up to it.
+        """
+        if length <= len(self):
+            self._end = self._start + max(0, length)
+            return
+
+        padding_length = length - len(self)
+        self._reserve(padding_length)
+        self._storage[self._end:self._end + padding_length] = 0
+        self._end += padding_length
+
+    def clear(self):
+        self._start = 0
+        self._end = 0
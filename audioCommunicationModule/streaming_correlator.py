@@ -0,0 +1,93 @@
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+
+class StreamingCorrelator(object):
+    """
+    Normalized correlation of a sample stream against a fixed preamble (same values as utils.normalized_correlation),
+    computed block by block with FFT overlap-save. Only the last len(preamble) - 1 samples are kept between calls,
+    and every correlation window is evaluated exactly once.
+    """
+    SEGMENT_LENGTH_FACTOR = 4
+
+    def __init__(self, preamble: Union[np.ndarray, List[float]]):
+        preamble = np.asarray(preamble, dtype=np.float64)
+        if len(preamble) < 2:
+            raise ValueError(f'The preamble must be at least 2 samples long, got {len(preamble)}')
+
+        self._preamble_length = len(preamble)
+        self._normalized_preamble = preamble / np.std(preamble)
+        self._max_block_length = self.SEGMENT_LENGTH_FACTOR * self._preamble_length
+        self._preamble_spectra: Dict[int, np.ndarray] = {}
+
+        self._history = np.zeros(0, dtype=np.float64)
+        # Running sums of samples and squared samples at each history sample boundary
+        self._prefix_sums = np.zeros((2, 1), dtype=np.float64)
+        self._samples_processed = 0
+
+    @property
+    def preamble_length(self) -> int:
+        return self._preamble_length
+
+    @property
+    def samples_processed(self) -> int:
+        return self._samples_processed
+
+    def _preamble_spectrum(self, fft_length: int) -> np.ndarray:
+        if fft_length not in self._preamble_spectra:
+            self._preamble_spectra[fft_length] = np.conj(np.fft.rfft(self._normalized_preamble, fft_length))
+        return self._preamble_spectra[fft_length]
+
+    def _process_segment(self, block: np.ndarray) -> np.ndarray:
+        segment = np.concatenate((self._history, block))
+        window_count = len(segment) - self._preamble_length + 1
+
+        block_prefix_sums = self._prefix_sums[:, -1:] + np.cumsum(np.stack((block, block * block)), axis=1)
+        prefix_sums = np.concatenate((self._prefix_sums, block_prefix_sums), axis=1)
+
+        history_length = min(len(segment), self._preamble_length - 1)
+        self._history = segment[len(segment) - history_length:]
+        first_kept_boundary = prefix_sums.shape[1] - history_length - 1
+        kept_prefix_sums = prefix_sums[:, first_kept_boundary:]
+        self._prefix_sums = kept_prefix_sums - kept_prefix_sums[:, :1]
+        self._samples_processed += len(block)
+
+        if window_count <= 0:
+            return np.zeros(0, dtype=np.float64)
+
+        fft_length = 1 << (len(segment) - 1).bit_length()
+        correlation = np.fft.irfft(np.fft.rfft(segment, fft_length) * self._preamble_spectrum(fft_length),
+                                   fft_length)[:window_count]
+
+        window_sums = prefix_sums[:, self._preamble_length:] - prefix_sums[:, :window_count]
+        window_means = window_sums / self._preamble_length
+        window_variance = window_means[1] - window_means[0] * window_means[0]
+        window_std = np.sqrt(np.maximum(window_variance, 0))
+
+        normalized_correlation = np.zeros(window_count, dtype=np.float64)
+        np.divide(correlation, window_std * self._preamble_length,
+                  out=normalized_correlation, where=window_std > 0)
+
+        return normalized_correlation
+
+    def process(self, block: Union[np.ndarray, List[float]]) -> Tuple[int, np.ndarray]:
+        """
+        Feed the next block of the stream.
+        :return: the stream position of the first window completed by this block,
+                and the normalized correlation of every window completed by this block.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        first_window_position = self._samples_processed - len(self._history)
+
+        correlations = [self._process_segment(block[block_index:block_index + self._max_block_length])
+                        for block_index in range(0, len(block), self._max_block_length)]
+        if len(correlations) == 0:
+            return first_window_position, np.zeros(0, dtype=np.float64)
+
+        return first_window_position, np.concatenate(correlations)
+
+    def reset(self):
+        self._history = np.zeros(0, dtype=np.float64)
+        self._prefix_sums = np.zeros((2, 1), dtype=np.float64)
+        self._samples_processed = 0
@@ -0,0 +1,143 @@
+from typing import Deque, List, Optional, Sequence, Tuple, Union, Set
+
+import numpy as np
+
+from demodulator import AUTO_DETECTOR, SharedSpectrum
+from receiver import Receiver
+from transmitter import Transmitter
+from utils import PCM16Data, pcm_to_signal, signal_to_pcm
+
+MessageEntry = Tuple[bytes, Set[int], bytes, bool]
+
+
+class MultiBandTransmitter(object):
+    """
+    Sends up to sub_band_count messages at once from a single audio output, one per sub-band of the frequency range
+    (see OFDM.get_sub_band_range). Each sub-band has its own subcarriers, symbol map and chirp.
+    """
+
+    def __init__(self,
+                 symbol_weight: int,
+                 symbol_size: int,
+                 samples_per_symbol: int,
+                 sample_rate_hz: float,
+                 frequency_range_start_hz: float,
+                 frequency_range_end_hz: float,
+                 ecc_symbols: int,
+                 ecc_block: int,
+                 sub_band_count: int,
+                 **transmitter_kwargs):
+        """
+        :param transmitter_kwargs: the other arguments of every Transmitter.
+        """
+        self._transmitters = [Transmitter(symbol_weight,
+                                          symbol_size,
+                                          samples_per_symbol,
+                                          sample_rate_hz,
+                                          frequency_range_start_hz,
+                                          frequency_range_end_hz,
+                                          ecc_symbols,
+                                          ecc_block,
+                                          sub_band_count=sub_band_count,
+                                          sub_band_index=sub_band_index,
+                                          **transmitter_kwargs)
+                              for sub_band_index in range(sub_band_count)]
+
+    @property
+    def sub_band_count(self) -> int:
+        return len(self._transmitters)
+
+    @property
+    def transmitters(self) -> List[Transmitter]:
+        return self._transmitters
+
+    def transmit_buffers(self, buffers: Sequence[Optional[bytes]]) -> np.ndarray:
+        """
+        :param buffers: the message of every sub-band, None leaves a sub-band silent.
+        :return: the sum of the message signals, which all start at the same sample. It is divided by the number of
+                messages to stay within [-1, 1].
+        """
+        if len(buffers) > len(self._transmitters):
+            raise ValueError(f'Got {len(buffers)} messages for {len(self._transmitters)} sub-bands')
+
+        message_signals = [transmitter.transmit_buffer(buffer)
+                           for transmitter, buffer in zip(self._transmitters, buffers) if buffer is not None]
+        signal = np.zeros(max((len(message_signal) for message_signal in message_signals), default=0))
+        for message_signal in message_signals:
+            signal[:len(message_signal)] += message_signal
+        if len(message_signals) > 1:
+            signal /= len(message_signals)
+
+        return signal
+
+    def transmit_pcm_data(self, buffers: Sequence[Optional[bytes]]) -> bytes:
+        return signal_to_pcm(self.transmit_buffers(buffers), overwrite_signal=True)
+
+
+class MultiBandReceiver(object):
+    """
+    Receives every sub-band of the frequency range at once. There is one Receiver per sub-band, with its own chirp
+    detection, symbol map and message history, and all of them are fed the same audio blocks.
+    The receivers share the spectrum of their symbol windows (see SharedSpectrum): the sub-bands of a
+    MultiBandTransmitter start together, so their messages cost a single FFT per symbol window.
+    Messages sent on the other sub-bands lower the normalized correlation of a chirp to about one over the square root
+    of the number of busy sub-bands, the correlation threshold must stay under it.
+    """
+
+    def __init__(self,
+                 symbol_weight: int,
+                 symbol_size: int,
+                 samples_per_symbol: int,
+                 sample_rate_hz: float,
+                 frequency_range_start_hz: float,
+                 frequency_range_end_hz: float,
+                 ecc_symbols: int,
+                 ecc_block: int,
+                 sub_band_count: int,
+                 **receiver_kwargs):
+        """
+        :param receiver_kwargs: the other arguments of every Receiver.
+        """
+        self._shared_spectrum = SharedSpectrum(detector=receiver_kwargs.get('detector', AUTO_DETECTOR))
+        self._receivers = [Receiver(symbol_weight,
+                                    symbol_size,
+                                    samples_per_symbol,
+                                    sample_rate_hz,
+                                    frequency_range_start_hz,
+                                    frequency_range_end_hz,
+                                    ecc_symbols,
+                                    ecc_block,
+                                    sub_band_count=sub_band_count,
+                                    sub_band_index=sub_band_index,
+                                    shared_spectrum=self._shared_spectrum,
+                                    **receiver_kwargs)
+                           for sub_band_index in range(sub_band_count)]
+
+    @property
+    def sub_band_count(self) -> int:
+        return len(self._receivers)
+
+    @property
+    def receivers(self) -> List[Receiver]:
+        return self._receivers
+
+    @property
+    def shared_spectrum(self) -> SharedSpectrum:
+        return self._shared_spectrum
+
+    def message_history(self, sub_band_index: int) -> Deque[MessageEntry]:
+        return self._receivers[sub_band_index].message_history
+
+    def receive_buffer(self, signal: Union[np.ndarray, List[float]]) -> None:
+        signal = np.asarray(signal)
+        for receiver in self._receivers:
+            receiver.receive_buffer(signal)
+
+        # Windows are demodulated as they arrive, but a terminated message re-demodulates the windows that the timing
+        # recovery moved, which can be any window since its start
+        message_starts = [receiver.message_start_position for receiver in self._receivers
+                          if receiver.message_start_position is not None]
+        self._shared_spectrum.discard_before(min(message_starts, default=np.inf))
+
+    def receive_pcm16_buffer(self, pcm_data: PCM16Data) -> None:
+        return self.receive_buffer(pcm_to_signal(pcm_data, dtype=np.float32))
@@ -1,9 +1,29 @@
-from typing import Set, List
+from typing import Iterable, List, Tuple
 
 
 class OFDMSymbol(object):
-    def __init__(self, indices: Set[int]):
-        self._indices = indices
+    __slots__ = ('_indices', '_mask')
+
+    def __init__(self, indices: Iterable[int]):
+        # Iteration order of the indices is kept, since it determines the summation order during synthesis
+        unique_indices = tuple(dict.fromkeys(int(index) for index in indices))
+        mask = 0
+        for index in unique_indices:
+            mask |= 1 << index
+
+        object.__setattr__(self, '_indices', unique_indices)
+        object.__setattr__(self, '_mask', mask)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    @property
+    def indices(self) -> Tuple[int, ...]:
+        return self._indices
+
+    @property
+    def mask(self) -> int:
+        return self._mask
 
     @property
     def weight(self):
@@ -16,4 +36,10 @@ class OFDMSymbol(object):
         if not isinstance(other, OFDMSymbol):
             return False
 
-        return self._indices == other._indices
+        return self._mask == other._mask
+
+    def __hash__(self):
+        return hash(self._mask)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({sorted(self._indices)})'
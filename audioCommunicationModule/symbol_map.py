@@ -1,12 +1,15 @@
 from itertools import combinations
 
-from typing import List, Union, Optional, Tuple, Set
+from typing import List, Union, Optional, Tuple, Set, Dict
+
+import numpy as np
 
 from symbol import OFDMSymbol
 
 
 class SymbolMap:
     UNRECOGNISED_SYMBOL = 0xFF
+    UNKNOWN_VALUE = -1
     """
     construct the mapping between bytes and symbols.
     :param symbol_size: is the size of the symbol binary vector
@@ -19,21 +22,49 @@ class SymbolMap:
             self,
             symbol_size: int,
             symbol_weight: int,
-            character_space_size: int = 256):
+            character_space_size: int = 256,
+            symbol_indices: Optional[np.ndarray] = None):
+        """
+        :param symbol_indices: the (symbol_count, symbol_weight) subcarrier indices of every symbol
+                as given by the symbol_indices property, instead of enumerating the combinations again.
+        """
 
         # CR: Add type hints to members of class
         self._symbol_size = symbol_size
         self._symbol_weight = symbol_weight
-        self._symbol_map = SymbolMap._create_mapping(
-            symbol_size,
-            symbol_weight)
+        if symbol_indices is None:
+            self._symbol_map = SymbolMap._create_mapping(
+                symbol_size,
+                symbol_weight)
+        else:
+            self._symbol_map = [OFDMSymbol(indices) for indices in np.asarray(symbol_indices).tolist()]
         self._character_space_size = character_space_size
-        self._termination_symbol = self._symbol_map[character_space_size + 1]
+        self._termination_value = character_space_size + 1
+        self._termination_symbol = self._symbol_map[self._termination_value]
+        self._value_of_symbol: Dict[OFDMSymbol, int] = {
+            symbol: value for value, symbol in enumerate(self._symbol_map)}
+
+        # Symbol bitmasks sorted for vectorized reverse lookup of whole symbol streams
+        symbol_masks = np.array([symbol.mask for symbol in self._symbol_map], dtype=np.int64)
+        self._mask_order: np.ndarray = np.argsort(symbol_masks)
+        self._sorted_masks: np.ndarray = symbol_masks[self._mask_order]
 
     @property
     def termination_symbol(self):
         return self._termination_symbol
 
+    @property
+    def termination_value(self) -> int:
+        return self._termination_value
+
+    @property
+    def symbol_count(self) -> int:
+        return len(self._symbol_map)
+
+    @property
+    def symbol_indices(self) -> np.ndarray:
+        return np.array([symbol.indices for symbol in self._symbol_map], dtype=np.intp)
+
     @staticmethod
     def _create_mapping(
             symbol_size: int,
@@ -51,24 +82,42 @@ class SymbolMap:
         return self._symbol_map[byte]
 
     def _symbol_to_value(self, symbol: Optional[OFDMSymbol]) -> Optional[int]:
-        if symbol not in self._symbol_map:
-            return None
-        return self._symbol_map.index(symbol)
+        return self._value_of_symbol.get(symbol)
+
+    def indices_to_values(self, symbol_indices: np.ndarray) -> np.ndarray:
+        """
+        Reverse lookup of a (n_symbols, symbol_weight) matrix of subcarrier indices.
+        Unknown combinations map to UNKNOWN_VALUE.
+        """
+        symbol_masks = np.bitwise_or.reduce(np.left_shift(np.int64(1), symbol_indices.astype(np.int64)), axis=1)
+        positions = np.minimum(np.searchsorted(self._sorted_masks, symbol_masks), len(self._sorted_masks) - 1)
+        is_known = self._sorted_masks[positions] == symbol_masks
+
+        return np.where(is_known, self._mask_order[positions], self.UNKNOWN_VALUE)
 
     def bytes_to_symbols(self, data: bytes) -> List[OFDMSymbol]:
         return [self._byte_to_symbol(byte) for byte in data]
 
+    def bytes_to_values(self, data: bytes) -> np.ndarray:
+        values = np.frombuffer(bytes(data), dtype=np.uint8)
+        if np.any(values >= self._character_space_size):
+            raise ValueError(f'Data contains values outside of the character space '
+                             f'(size {self._character_space_size})')
+
+        return values
+
     def _symbols_to_raw_values(self, symbols: List[OFDMSymbol]) -> List[int]:
         return [self._symbol_to_value(symbol) for symbol in symbols]
 
-    def symbols_to_bytes(self, symbols: List[OFDMSymbol]) -> Tuple[bytes, Set[int]]:
-        raw_values = self._symbols_to_raw_values(symbols)
-        byte_values = bytes([value if value is not None and value < self._character_space_size
-                             else self.UNRECOGNISED_SYMBOL
-                             for value
-                             in raw_values])
-
-        erasure_locations = set(index for index, value in enumerate(raw_values) if value is None
-                                or value >= self._character_space_size)
+    def values_to_bytes(self, values: np.ndarray) -> Tuple[bytes, Set[int]]:
+        is_erasure = (values < 0) | (values >= self._character_space_size)
+        byte_values = np.where(is_erasure, self.UNRECOGNISED_SYMBOL, values).astype(np.uint8).tobytes()
+        erasure_locations = set(np.flatnonzero(is_erasure).tolist())
 
         return byte_values, erasure_locations
+
+    def symbols_to_bytes(self, symbols: List[OFDMSymbol]) -> Tuple[bytes, Set[int]]:
+        raw_values = np.array([self.UNKNOWN_VALUE if value is None else value
+                               for value in self._symbols_to_raw_values(symbols)], dtype=np.int64)
+
+        return self.values_to_bytes(raw_values)
@@ -0,0 +1,114 @@
+from typing import List, Optional
+
+import numpy as np
+
+from symbol import OFDMSymbol
+
+
+class SymbolSynthesizer(object):
+    def __init__(self,
+                 frequencies_hz: List[float],
+                 samples_per_symbol: int,
+                 sample_rate_hz: float,
+                 cyclic_prefix_length: Optional[int] = None):
+        """
+        :param cyclic_prefix_length: when None, each symbol is guarded by samples_per_symbol // 16 silent samples
+                on both sides. Otherwise, a symbol is its last cyclic_prefix_length samples followed by an orthogonal
+                core of samples_per_symbol - cyclic_prefix_length samples, and the subcarriers should be spaced by
+                multiples of sample_rate_hz / core length.
+        """
+        if cyclic_prefix_length is not None and not 0 <= cyclic_prefix_length < samples_per_symbol // 2:
+            raise ValueError(f'The cyclic prefix must be shorter than half a symbol ({samples_per_symbol // 2} '
+                             f'samples), got {cyclic_prefix_length}')
+
+        self._samples_per_symbol = samples_per_symbol
+        self._sample_rate_hz = sample_rate_hz
+        self._frequencies = np.asarray(frequencies_hz, dtype=np.float64)
+        self._cyclic_prefix_length = cyclic_prefix_length or 0
+        self._padding_length = samples_per_symbol // 16 if cyclic_prefix_length is None else 0
+        self._data_length = samples_per_symbol - 2 * self._padding_length - self._cyclic_prefix_length
+        self._data_start = self._padding_length + self._cyclic_prefix_length
+
+        # One row per subcarrier, evaluated in the same order of operations as utils.inverse_fft
+        # so that the synthesized samples are bit-identical to it.
+        time_steps = np.arange(self._data_length, dtype=np.float64)
+        self._subcarrier_table: np.ndarray = np.sin(
+            2 * np.pi * self._frequencies[:, np.newaxis] * time_steps / sample_rate_hz)
+        self._complex_subcarrier_table: Optional[np.ndarray] = None
+
+    @property
+    def samples_per_symbol(self) -> int:
+        return self._samples_per_symbol
+
+    @property
+    def padding_length(self) -> int:
+        """
+        The length of the silent guards, zero with a cyclic prefix.
+        """
+        return self._padding_length
+
+    @property
+    def cyclic_prefix_length(self) -> int:
+        return self._cyclic_prefix_length
+
+    @property
+    def data_length(self) -> int:
+        return self._data_length
+
+    @property
+    def subcarrier_table(self) -> np.ndarray:
+        return self._subcarrier_table
+
+    def _add_guards(self, signal: np.ndarray) -> np.ndarray:
+        """
+        Fill the cyclic prefix of a (n_symbols, samples_per_symbol) matrix whose data is synthesized,
+        the silent guards are already zeros.
+        """
+        if self._cyclic_prefix_length > 0:
+            signal[:, :self._cyclic_prefix_length] = signal[:, self._samples_per_symbol - self._cyclic_prefix_length:]
+
+        return signal.reshape(-1)
+
+    def indices_to_signal(self, symbol_indices: np.ndarray) -> np.ndarray:
+        """
+        Synthesize a batch of symbols given as a (n_symbols, symbol_weight) matrix of subcarrier indices.
+        Returns a flat signal of n_symbols * samples_per_symbol samples, guards included.
+        """
+        symbol_indices = np.asarray(symbol_indices, dtype=np.intp)
+        if symbol_indices.ndim != 2:
+            raise ValueError(f'Expected a 2-D matrix of subcarrier indices but got {symbol_indices.ndim} dimensions')
+
+        symbol_count, symbol_weight = symbol_indices.shape
+        signal = np.zeros((symbol_count, self._samples_per_symbol), dtype=np.float64)
+        if symbol_count == 0:
+            return signal.reshape(-1)
+
+        data = signal[:, self._data_start:self._data_start + self._data_length]
+        np.sum(self._subcarrier_table[symbol_indices], axis=1, out=data)
+        data /= symbol_weight
+
+        return self._add_guards(signal)
+
+    def coefficients_to_signal(self, coefficients: np.ndarray) -> np.ndarray:
+        """
+        Synthesize a batch of symbols given as a (n_symbols, symbol_size) matrix of complex subcarrier amplitudes,
+        a coefficient c keys the subcarrier |c| * sin(2 * pi * f * t + angle(c)).
+        Returns a (n_symbols, samples_per_symbol) matrix, guards included.
+        """
+        if self._complex_subcarrier_table is None:
+            time_steps = np.arange(self._data_length, dtype=np.float64)
+            self._complex_subcarrier_table = np.exp(
+                2j * np.pi * self._frequencies[:, np.newaxis] * time_steps / self._sample_rate_hz)
+
+        signal = np.zeros((len(coefficients), self._samples_per_symbol), dtype=np.float64)
+        signal[:, self._data_start:self._data_start + self._data_length] = (
+                coefficients @ self._complex_subcarrier_table).imag
+        self._add_guards(signal)
+
+        return signal
+
+    def symbols_to_signal(self, symbols: List[OFDMSymbol]) -> np.ndarray:
+        if len(symbols) == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        return self.indices_to_signal(np.array([symbol.indices for symbol in symbols], dtype=np.intp))
@@ -0,0 +1,217 @@
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+
+class TimingRecovery(object):
+    """
+    Places the demodulation windows of a message between its two preambles.
+    The sub-sample preamble peaks give the symbol count and the average symbol pitch (which absorbs a constant
+    sample clock offset between the transmitter and the receiver), and the silent guard padding around the data
+    of every symbol is used to track what is left of the drift along the message.
+    """
+    DEFAULT_LOOP_GAIN = 0.05
+
+    def __init__(self,
+                 samples_per_symbol: int,
+                 padding_length: int,
+                 loop_gain: float = DEFAULT_LOOP_GAIN):
+        self._samples_per_symbol = samples_per_symbol
+        self._padding_length = padding_length
+        self._data_length = samples_per_symbol - 2 * padding_length
+        # A symbol is searched for within half a guard of where it is expected, and the tracked windows never move
+        # by more than a quarter symbol from the preamble timing, which bounds the wander of the loop on pure noise
+        self._search_length = padding_length // 2
+        self._max_correction = samples_per_symbol // 4
+        self._loop_gain = loop_gain
+        # Critically damped second order loop
+        self._rate_gain = loop_gain * loop_gain / 4
+
+    @property
+    def samples_per_symbol(self) -> int:
+        return self._samples_per_symbol
+
+    @staticmethod
+    def interpolate_peak(correlation: np.ndarray, peak_index: int) -> float:
+        """
+        :return: the sub-sample position of a correlation peak, from a parabola through the peak and its neighbours.
+        """
+        if peak_index <= 0 or peak_index >= len(correlation) - 1:
+            return float(peak_index)
+
+        left, center, right = correlation[peak_index - 1:peak_index + 2]
+        curvature = left - 2 * center + right
+        if curvature >= 0:
+            return float(peak_index)
+
+        return peak_index + float(np.clip(0.5 * (left - right) / curvature, -0.5, 0.5))
+
+    @staticmethod
+    def local_correlation(signal: np.ndarray, preamble: np.ndarray, position: int) -> np.ndarray:
+        """
+        The normalized correlation of the preamble with the windows starting at position - 1, position and position + 1
+        (zeros where the signal ends).
+        """
+        correlation = np.zeros(3, dtype=np.float64)
+        # Same normalization as utils.normalized_correlation
+        normalized_preamble = preamble / np.std(preamble)
+        for window_index, window_start in enumerate(range(position - 1, position + 2)):
+            window = np.asarray(signal[max(0, window_start):window_start + len(preamble)], dtype=np.float64)
+            if window_start < 0 or len(window) < len(preamble) or np.std(window) == 0:
+                continue
+            correlation[window_index] = np.dot(window, normalized_preamble) / (np.std(window) * len(preamble))
+
+        return correlation
+
+    def refine_position(self, signal: np.ndarray, preamble: np.ndarray, position: int) -> float:
+        return position - 1 + self.interpolate_peak(self.local_correlation(signal, preamble, position), 1)
+
+    def symbol_count(self, data_start: float, data_end: float) -> int:
+        return max(0, int(round((data_end - data_start) / self._samples_per_symbol)))
+
+    @property
+    def search_length(self) -> int:
+        return self._search_length
+
+    @property
+    def is_tracking(self) -> bool:
+        """
+        Whether the windows are moved along the message, or left on the grid given by the preambles.
+        """
+        return self._padding_length > 0 and self._loop_gain > 0
+
+    def _data_energies(self, cumulative_energy: np.ndarray, window_starts: np.ndarray) -> np.ndarray:
+        """
+        :return: the energy of the data part of the symbol windows starting at window_starts.
+        """
+        sample_count = len(cumulative_energy) - 1
+        data_starts = np.clip(window_starts + self._padding_length, 0, sample_count)
+        data_ends = np.clip(window_starts + self._padding_length + self._data_length, 0, sample_count)
+
+        return cumulative_energy[data_ends] - cumulative_energy[data_starts]
+
+    def symbol_positions(self, signal: Union[np.ndarray, List[float]], data_start: float, data_end: float) -> np.ndarray:
+        """
+        :param data_start: the sub-sample position of the end of the start preamble.
+        :param data_end: the sub-sample position of the start of the terminating preamble.
+        :return: the start of every symbol window.
+        """
+        symbol_count = self.symbol_count(data_start, data_end)
+        if symbol_count == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        pitch = (data_end - data_start) / symbol_count
+        nominal_positions = data_start + pitch * np.arange(symbol_count)
+        if not self.is_tracking:
+            return nominal_positions
+
+        # The data of a symbol is where its window holds the most energy, the guards being silent
+        cumulative_energy = np.concatenate(([0], np.cumsum(np.square(np.asarray(signal), dtype=np.float64))))
+
+        corrections = np.zeros(symbol_count, dtype=np.float64)
+        correction = 0.0
+        rate = 0.0
+        for symbol_index in range(symbol_count):
+            correction, rate = self.track_symbol(cumulative_energy, 0, nominal_positions[symbol_index], correction, rate)
+            corrections[symbol_index] = correction
+
+        return nominal_positions + corrections
+
+    def predicted_start(self, nominal_position: float, correction: float, rate: float) -> int:
+        return int(round(nominal_position + correction + rate))
+
+    def track_symbol(self,
+                     cumulative_energy: np.ndarray,
+                     energy_start: int,
+                     nominal_position: float,
+                     correction: float,
+                     rate: float) -> Tuple[float, float]:
+        """
+        One step of the timing loop.
+        :param cumulative_energy: the cumulative energy of the signal from the sample energy_start, starting with a 0.
+        :return: the correction of the symbol window at nominal_position, and the updated drift rate.
+        """
+        search_offsets = np.arange(-self._search_length, self._search_length + 1)
+        predicted_correction = correction + rate
+        predicted_start = self.predicted_start(nominal_position, correction, rate)
+        search_energies = self._data_energies(cumulative_energy, predicted_start + search_offsets - energy_start)
+        measured_start = predicted_start + int(search_offsets[np.argmax(search_energies)])
+
+        error = measured_start - (nominal_position + predicted_correction)
+        correction = float(np.clip(predicted_correction + self._loop_gain * error,
+                                   -self._max_correction, self._max_correction))
+
+        return correction, rate + self._rate_gain * error
+
+    def extract_symbols(self, signal: Union[np.ndarray, List[float]], symbol_positions: np.ndarray) -> np.ndarray:
+        """
+        :return: the concatenated symbol windows, samples outside the signal are zeros.
+        """
+        signal = np.asarray(signal)
+        if len(signal) == 0:
+            return np.zeros(len(symbol_positions) * self._samples_per_symbol, dtype=signal.dtype)
+
+        window_starts = np.rint(symbol_positions).astype(np.intp)
+        sample_indices = window_starts[:, np.newaxis] + np.arange(self._samples_per_symbol)
+        is_inside = (sample_indices >= 0) & (sample_indices < len(signal))
+        windows = np.where(is_inside, signal[np.clip(sample_indices, 0, len(signal) - 1)], 0)
+
+        return windows.reshape(-1)
+
+    def align(self, signal: Union[np.ndarray, List[float]], data_start: float, data_end: float) -> np.ndarray:
+        return self.extract_symbols(signal, self.symbol_positions(signal, data_start, data_end))
+
+
+class SymbolTracker(object):
+    """
+    Places the symbol windows of a message one at a time as its samples arrive, with the loop of
+    TimingRecovery.symbol_positions. The symbols are assumed to be samples_per_symbol apart, the average pitch being
+    only known once the terminating preamble is found, and the drift rate of the loop absorbs the difference.
+    """
+
+    def __init__(self, timing_recovery: TimingRecovery, data_start: float):
+        """
+        :param data_start: the absolute sub-sample position of the end of the start preamble.
+        """
+        self._timing_recovery = timing_recovery
+        self._data_start = data_start
+        self._symbol_count = 0
+        self._correction = 0.0
+        self._rate = 0.0
+
+    @property
+    def symbol_count(self) -> int:
+        return self._symbol_count
+
+    def _nominal_position(self) -> float:
+        return self._data_start + self._symbol_count * self._timing_recovery.samples_per_symbol
+
+    def next_window_end(self) -> int:
+        """
+        :return: the absolute sample position up to which the signal is needed to place the next window.
+        """
+        predicted_start = self._timing_recovery.predicted_start(self._nominal_position(), self._correction, self._rate)
+        return predicted_start + self._timing_recovery.search_length + self._timing_recovery.samples_per_symbol + 1
+
+    def place_window(self, signal: np.ndarray, signal_position: int) -> Optional[float]:
+        """
+        :param signal: the received samples, the first one at the absolute position signal_position.
+        :return: the absolute position of the next symbol window, None until its samples arrived.
+        """
+        window_end = self.next_window_end()
+        if window_end > signal_position + len(signal):
+            return None
+
+        nominal_position = self._nominal_position()
+        self._symbol_count += 1
+        if not self._timing_recovery.is_tracking:
+            return nominal_position
+
+        predicted_start = self._timing_recovery.predicted_start(nominal_position, self._correction, self._rate)
+        energy_start = max(signal_position, predicted_start - self._timing_recovery.search_length)
+        segment = np.asarray(signal[energy_start - signal_position:window_end - signal_position])
+        cumulative_energy = np.concatenate(([0], np.cumsum(np.square(segment, dtype=np.float64))))
+        self._correction, self._rate = self._timing_recovery.track_symbol(
+            cumulative_energy, energy_start, nominal_position, self._correction, self._rate)
+
+        return nominal_position + self._correction
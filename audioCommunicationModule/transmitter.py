@@ -1,10 +1,16 @@
-from typing import List
+from typing import Iterable, Iterator, Optional
 
-import utils
-from OFDM import OFDM
-from reedsolo import RSCodec
+import numpy as np
 
-from utils import signal_to_pcm, crc_checksum_bytes
+from OFDM import CONSTANT_WEIGHT_MODE, OFDM
+from framing import DEFAULT_MAX_FRAME_PAYLOAD, PAYLOAD_ID_MODULO, split_payload
+from message_codec import get_message_codec
+from modem_profile import ModemProfile
+from waveform_codebook import WaveformCodebook
+
+from utils import signal_to_pcm, signal_to_pcm_array
+
+PCM16_SAMPLE_WIDTH = 2
 
 
 class Transmitter(object):
@@ -17,7 +23,17 @@ class Transmitter(object):
                  frequency_range_end_hz: float,
                  ecc_symbols: int,
                  ecc_block: int,
-                 snr_threshold: float = 1):
+                 snr_threshold: float = 1,
+                 codebook_memory_limit_bytes: int = WaveformCodebook.DEFAULT_MEMORY_LIMIT_BYTES,
+                 modulation_mode: str = CONSTANT_WEIGHT_MODE,
+                 cyclic_prefix_length: Optional[int] = None,
+                 modem_profile: Optional[ModemProfile] = None,
+                 sub_band_count: int = 1,
+                 sub_band_index: int = 0):
+        """
+        :param sub_band_count: the number of sub-bands of the frequency range (see OFDM), this transmitter only sends
+                on the sub-band sub_band_index.
+        """
 
         self._modulation = OFDM(symbol_weight,
                                 symbol_size,
@@ -25,17 +41,127 @@ class Transmitter(object):
                                 sample_rate_hz,
                                 frequency_range_start_hz,
                                 frequency_range_end_hz,
-                                snr_threshold)
-        self._ecc_codec = RSCodec(ecc_symbols, ecc_block)
+                                snr_threshold,
+                                codebook_memory_limit_bytes,
+                                modulation_mode=modulation_mode,
+                                cyclic_prefix_length=cyclic_prefix_length,
+                                modem_profile=modem_profile,
+                                sub_band_count=sub_band_count,
+                                sub_band_index=sub_band_index)
+        self._message_codec = get_message_codec(ecc_symbols, ecc_block)
+        self._next_payload_id = 0
 
-    def transmit_buffer(self, buffer: bytes) -> List[float]:
-        message_data = buffer + utils.crc_checksum_bytes(buffer)
-        message_signal = (
-            self._modulation.sync_preamble +
-            self._modulation.data_to_signal(self._ecc_codec.encode(message_data)) +
-            self._modulation.sync_preamble)
+    def transmit_buffer(self, buffer: bytes) -> np.ndarray:
+        message_signal = np.concatenate((
+            self._modulation.sync_preamble,
+            self._modulation.data_to_signal(self._message_codec.encode(buffer)),
+            self._modulation.sync_preamble))
 
         return message_signal
 
+    def transmit_signal_chunks(self, buffer: bytes, symbols_per_chunk: int = 1) -> Iterator[np.ndarray]:
+        """
+        Yield the message signal (preamble, data, preamble) as it is synthesized, a few symbols at a time.
+        """
+        yield self._modulation.sync_preamble
+        yield from self._modulation.data_to_signal_chunks(self._message_codec.encode(buffer), symbols_per_chunk)
+        yield self._modulation.sync_preamble
+
+    def transmit_payload_chunks(self,
+                                buffer: bytes,
+                                max_frame_payload: int = DEFAULT_MAX_FRAME_PAYLOAD,
+                                symbols_per_chunk: int = 1) -> Iterator[np.ndarray]:
+        """
+        Yield the signal of a payload split into frames (see framing.split_payload). The frames are sent back to back,
+        the preamble that terminates a frame also starts the next one.
+        """
+        frames = split_payload(buffer, self._next_payload_id, max_frame_payload)
+        self._next_payload_id = (self._next_payload_id + 1) % PAYLOAD_ID_MODULO
+
+        yield self._modulation.sync_preamble
+        for frame in frames:
+            yield from self._modulation.data_to_signal_chunks(self._message_codec.encode(frame), symbols_per_chunk)
+            yield self._modulation.sync_preamble
+
+    def transmit_payload(self, buffer: bytes, max_frame_payload: int = DEFAULT_MAX_FRAME_PAYLOAD) -> np.ndarray:
+        return np.concatenate(list(self.transmit_payload_chunks(buffer, max_frame_payload, symbols_per_chunk=256)))
+
+    def _symbols_per_block(self, block_size: int) -> int:
+        if block_size <= 0:
+            raise ValueError(f'The block size must be positive, got {block_size}')
+
+        return max(1, block_size // self._modulation.samples_per_symbol)
+
+    def transmit_pcm_blocks(self, buffer: bytes, block_size: int) -> Iterator[bytes]:
+        """
+        Yield the message as PCM16 blocks of exactly block_size samples (the last one is padded with silence),
+        synthesizing only the symbols needed for the next block. Memory use does not depend on the message length.
+        """
+        return self._pcm_blocks(self.transmit_signal_chunks(buffer, self._symbols_per_block(block_size)), block_size)
+
+    def transmit_payload_pcm_blocks(self,
+                                    buffer: bytes,
+                                    block_size: int,
+                                    max_frame_payload: int = DEFAULT_MAX_FRAME_PAYLOAD) -> Iterator[bytes]:
+        return self._pcm_blocks(
+            self.transmit_payload_chunks(buffer, max_frame_payload, self._symbols_per_block(block_size)), block_size)
+
+    @staticmethod
+    def _pcm_blocks(chunks: Iterable[np.ndarray], block_size: int) -> Iterator[bytes]:
+        block_signal = np.zeros(block_size, dtype=np.float64)
+        block_pcm = np.zeros(block_size, dtype=np.int16)
+        block_length = 0
+        for chunk in chunks:
+            chunk_index = 0
+            while chunk_index < len(chunk):
+                copied_length = min(block_size - block_length, len(chunk) - chunk_index)
+                block_signal[block_length:block_length + copied_length] = chunk[chunk_index:chunk_index + copied_length]
+                block_length += copied_length
+                chunk_index += copied_length
+                if block_length == block_size:
+                    yield signal_to_pcm_array(block_signal, out=block_pcm, overwrite_signal=True).tobytes()
+                    block_length = 0
+
+        if block_length > 0:
+            block_signal[block_length:] = 0
+            yield signal_to_pcm_array(block_signal, out=block_pcm, overwrite_signal=True).tobytes()
+
+    def pcm_stream(self, buffer: bytes, block_size: int) -> 'PCMStream':
+        return PCMStream(self.transmit_pcm_blocks(buffer, block_size))
+
     def transmit_pcm_data(self, buffer: bytes) -> bytes:
-        return signal_to_pcm(self.transmit_buffer(buffer))
+        # The message signal is a fresh array, so it can be scaled in place
+        return signal_to_pcm(self.transmit_buffer(buffer), overwrite_signal=True)
+
+
+class PCMStream(object):
+    """
+    Reads PCM16 blocks from an iterator in the sizes an audio output callback asks for,
+    padding with silence once the blocks run out.
+    """
+
+    def __init__(self, blocks: Iterator[bytes]):
+        self._blocks = blocks
+        self._pending = b''
+        self._is_exhausted = False
+
+    @property
+    def is_finished(self) -> bool:
+        return self._is_exhausted and len(self._pending) == 0
+
+    def read(self, frame_count: int) -> bytes:
+        byte_count = frame_count * PCM16_SAMPLE_WIDTH
+        chunks = [self._pending]
+        available = len(self._pending)
+        while available < byte_count and not self._is_exhausted:
+            block: Optional[bytes] = next(self._blocks, None)
+            if block is None:
+                self._is_exhausted = True
+                break
+            chunks.append(block)
+            available += len(block)
+
+        data = b''.join(chunks)
+        self._pending = data[byte_count:]
+
+        return data[:byte_count].ljust(byte_count, b'\x00')
@@ -1,25 +1,67 @@
+import zlib
+
 import numpy as np
-import crc
-from scipy.ndimage.filters import uniform_filter1d
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 from enum import Enum
 
+# 32767 is the maximum value for 16-bit signed integer
+# sound is represented by a 16 bit value PCM16 (sound format)
+PCM_16BIT_MAXIMUM_VALUE = 32767.0
+
+PCM16Data = Union[bytes, bytearray, memoryview, np.ndarray, List[int]]
+
+
+def pcm16_array(pcm_data: PCM16Data) -> np.ndarray:
+    """
+    View PCM16 data as an int16 array. Bytes-like objects and int16 arrays are not copied.
+    """
+    if isinstance(pcm_data, np.ndarray):
+        return pcm_data.astype(np.int16, copy=False)
+    if isinstance(pcm_data, (bytes, bytearray, memoryview)):
+        return np.frombuffer(pcm_data, dtype=np.int16)
+
+    return np.asarray(pcm_data, dtype=np.int16)
+
+
+def signal_to_pcm_array(signal: Union[np.ndarray, List[float]],
+                        out: Optional[np.ndarray] = None,
+                        overwrite_signal: bool = False) -> np.ndarray:
+    """
+    Scale a [-1, 1] signal to PCM16 samples, clipping what is out of range.
+    :param out: an int16 array to write the samples into.
+    :param overwrite_signal: scale a float64 signal array in place instead of allocating a scratch array.
+    """
+    signal = np.asarray(signal)
+    if overwrite_signal and signal.dtype == np.float64:
+        scaled_signal = np.multiply(signal, PCM_16BIT_MAXIMUM_VALUE, out=signal)
+    else:
+        scaled_signal = np.multiply(signal, PCM_16BIT_MAXIMUM_VALUE, dtype=np.float64)
+    np.clip(scaled_signal, -PCM_16BIT_MAXIMUM_VALUE - 1, PCM_16BIT_MAXIMUM_VALUE, out=scaled_signal)
 
-def signal_to_pcm(signal: List[float]) -> bytes:
-    # 32767 is the maximum value for 16-bit signed integer
-    # sound is represented by a 16 bit value PCM16 (sound format)
-    # Normalization by symbol_weight needed to prevent overflow
-    PCM_16BIT_MAXIMUM_VALUE = 32767.0
-    pcm_data = np.array([int(sample * PCM_16BIT_MAXIMUM_VALUE) for sample in signal], dtype=np.int16)
+    if out is None:
+        out = np.empty(len(scaled_signal), dtype=np.int16)
+    # Casting truncates towards zero, like int()
+    np.copyto(out, scaled_signal, casting='unsafe')
 
-    return pcm_data.tobytes()
+    return out
 
 
-def pcm_to_signal(pcm_data: bytes) -> List[float]:
-    pcm_array = np.frombuffer(pcm_data, dtype=np.int16)
+def signal_to_pcm(signal: Union[np.ndarray, List[float]], overwrite_signal: bool = False) -> bytes:
+    return signal_to_pcm_array(signal, overwrite_signal=overwrite_signal).tobytes()
 
-    PCM_16BIT_MAXIMUM_VALUE = 32767.0
-    return list(pcm_array / PCM_16BIT_MAXIMUM_VALUE)
+
+def pcm_to_signal(pcm_data: PCM16Data,
+                  out: Optional[np.ndarray] = None,
+                  dtype: np.dtype = np.float64) -> np.ndarray:
+    """
+    Scale PCM16 samples to a [-1, 1] signal.
+    :param out: a float array to write the signal into, e.g. a slice of a preallocated buffer.
+    """
+    pcm_array = pcm16_array(pcm_data)
+    if out is None:
+        out = np.empty(len(pcm_array), dtype=dtype)
+
+    return np.divide(pcm_array, PCM_16BIT_MAXIMUM_VALUE, out=out)
 
 
 def signal_fft(signal: List[float], sample_rate_hz: float) -> List[Tuple[float, float]]:
@@ -32,20 +74,18 @@ def signal_fft(signal: List[float], sample_rate_hz: float) -> List[Tuple[float,
     return list(zip(sampled_frequencies, np.abs(fft_magnitudes)))
 
 
-def inverse_fft(frequencies_hz: List[float], num_samples: int, sample_rate_hz: float) -> List[float]:
-    sum_of_sin = []
-    for time_step in range(num_samples):  # num_samples is representing discrete time axis t[s]
-
-        sin_values = [np.sin(2 * np.pi * frequency * time_step / sample_rate_hz) for frequency in
-                      frequencies_hz]
+def inverse_fft(frequencies_hz: List[float], num_samples: int, sample_rate_hz: float) -> np.ndarray:
+    time_steps = np.arange(num_samples, dtype=np.float64)  # num_samples is representing discrete time axis t[s]
+    frequencies = np.asarray(frequencies_hz, dtype=np.float64)[:, np.newaxis]
+    sin_values = np.sin(2 * np.pi * frequencies * time_steps / sample_rate_hz)
 
-        sample = sum(sin_values) / len(sin_values)
-        sum_of_sin.append(sample)
-
-    return sum_of_sin
+    return np.sum(sin_values, axis=0) / len(frequencies_hz)
 
 
 def rolling_std(data: np.ndarray, window_size: int) -> np.ndarray:
+    # scipy takes longer to import than the rest of the modem, only load it when needed
+    from scipy.ndimage import uniform_filter1d
+
     rolling_mean = uniform_filter1d(data,
                                     window_size,
                                     mode='constant',
@@ -62,11 +102,8 @@ def rolling_std(data: np.ndarray, window_size: int) -> np.ndarray:
 # TODO: For the Chirp Signal we get a correlation above 1, which is concerning
 def normalized_correlation(signal: Union[np.ndarray, list],
                            preamble: Union[np.ndarray, list]) -> np.ndarray:
-    if not isinstance(signal, np.ndarray):
-        signal = np.array(signal)
-
-    if not isinstance(preamble, np.ndarray):
-        preamble = np.array(preamble)
+    signal = np.asarray(signal, dtype=np.float64)
+    preamble = np.asarray(preamble, dtype=np.float64)
 
     if len(signal) < len(preamble):
         return np.array([])
@@ -80,4 +117,5 @@ def normalized_correlation(signal: Union[np.ndarray, list],
 
 CRC_SIZE = 4
 def crc_checksum_bytes(data: bytes) -> bytes:
-    return crc.Calculator(crc.Crc32.CRC32).checksum(data).to_bytes(length=CRC_SIZE, byteorder='little')
+    # zlib implements the same CRC-32 (IEEE 802.3) as crc.Crc32.CRC32, with a precomputed table in C
+    return zlib.crc32(data).to_bytes(length=CRC_SIZE, byteorder='little')
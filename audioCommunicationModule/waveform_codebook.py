@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from synthesizer import SymbolSynthesizer
+
+
+class WaveformCodebook(object):
+    DEFAULT_MEMORY_LIMIT_BYTES = 32 * 1024 * 1024
+
+    def __init__(self,
+                 synthesizer: SymbolSynthesizer,
+                 symbol_indices: np.ndarray,
+                 memory_limit_bytes: int = DEFAULT_MEMORY_LIMIT_BYTES,
+                 table: Optional[np.ndarray] = None):
+        """
+        Cache of synthesized (padded) symbol waveforms, one row per SymbolMap value.
+        :param synthesizer: the synthesizer used to fill the codebook rows.
+        :param symbol_indices: (symbol_count, symbol_weight) subcarrier indices of every symbol, in SymbolMap order.
+        :param memory_limit_bytes: upper bound on the codebook size. When the full codebook does not fit,
+                only the most recently used rows are kept.
+        :param table: the precomputed full codebook (see table()), only used when it fits in the memory limit.
+        """
+        if memory_limit_bytes < 0:
+            raise ValueError(f'The codebook memory limit must be non-negative, got {memory_limit_bytes}')
+
+        self._synthesizer = synthesizer
+        self._symbol_indices = np.asarray(symbol_indices, dtype=np.intp)
+        self._memory_limit_bytes = memory_limit_bytes
+        self._row_size_bytes = synthesizer.samples_per_symbol * np.dtype(np.float64).itemsize
+        self._capacity = min(len(self._symbol_indices), memory_limit_bytes // self._row_size_bytes)
+        self._table: Optional[np.ndarray] = None
+        if table is not None and self.is_complete:
+            if table.shape != (len(self._symbol_indices), synthesizer.samples_per_symbol):
+                raise ValueError(f'Expected a {len(self._symbol_indices)}x{synthesizer.samples_per_symbol} codebook table, '
+                                 f'got {table.shape}')
+            self._table = np.asarray(table, dtype=np.float64)
+
+        # Only used when the full codebook does not fit in the memory limit
+        self._slots: Dict[int, int] = OrderedDict()
+        self._slot_of_value = np.full(len(self._symbol_indices), -1, dtype=np.intp)
+        self._evictions = 0
+
+    @property
+    def is_complete(self) -> bool:
+        return self._capacity == len(self._symbol_indices)
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def evictions(self) -> int:
+        return self._evictions
+
+    @property
+    def memory_usage_bytes(self) -> int:
+        return 0 if self._table is None else self._table.nbytes
+
+    def _build_table(self):
+        if self.is_complete:
+            self._table = self._synthesizer.indices_to_signal(self._symbol_indices).reshape(
+                len(self._symbol_indices), self._synthesizer.samples_per_symbol)
+        else:
+            self._table = np.zeros((self._capacity, self._synthesizer.samples_per_symbol), dtype=np.float64)
+
+    def table(self) -> np.ndarray:
+        """
+        :return: the waveform of every symbol, built in full even when it does not fit in the memory limit.
+        """
+        if self.is_complete:
+            if self._table is None:
+                self._build_table()
+            return self._table
+
+        return self._synthesizer.indices_to_signal(self._symbol_indices).reshape(
+            len(self._symbol_indices), self._synthesizer.samples_per_symbol)
+
+    def _load_values(self, unique_values: np.ndarray):
+        missing_values = unique_values[self._slot_of_value[unique_values] < 0]
+        for value in unique_values:
+            if self._slot_of_value[value] >= 0:
+                self._slots.move_to_end(int(value))
+
+        if len(missing_values) == 0:
+            return
+
+        free_slots = list(range(len(self._slots), self._capacity))
+        for _ in range(len(missing_values) - len(free_slots)):
+            evicted_value, slot = self._slots.popitem(last=False)
+            self._slot_of_value[evicted_value] = -1
+            free_slots.append(slot)
+            self._evictions += 1
+
+        new_slots = np.array(free_slots[:len(missing_values)], dtype=np.intp)
+        self._table[new_slots] = self._synthesizer.indices_to_signal(self._symbol_indices[missing_values]).reshape(
+            len(missing_values), self._synthesizer.samples_per_symbol)
+        self._slot_of_value[missing_values] = new_slots
+        for value, slot in zip(missing_values, new_slots):
+            self._slots[int(value)] = int(slot)
+
+    def values_to_signal(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.intp)
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        if self._table is None and self._capacity > 0:
+            self._build_table()
+
+        if self.is_complete:
+            return self._table[values].reshape(-1)
+
+        unique_values = np.unique(values)
+        if len(unique_values) > self._capacity:
+            # The message uses more distinct symbols than fit in the cache, synthesize it directly
+            return self._synthesizer.indices_to_signal(self._symbol_indices[values])
+
+        self._load_values(unique_values)
+        return self._table[self._slot_of_value[values]].reshape(-1)